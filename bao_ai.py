@@ -0,0 +1,414 @@
+# file: bao_ai.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Search-based computer opponent for bao (Kalah).
+
+`AlphaBetaPlayer` runs an iterative-deepening alpha-beta (negamax) search over
+`bao_compact.CompactGame` positions. A move that ends in the mover's own target
+earns an extra turn (see `Game.update_player`), so the side to move does not
+always alternate: the value of a child is only negated when the turn passes.
+
+Positions are identified by a Zobrist key that is updated for the pits a move
+changes, and looked up in a fixed-size transposition table.
+'''
+
+from __future__ import print_function
+import random
+import time
+
+from bao_compact import CompactGame
+
+# Transposition table entry types
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+INFINITY = 1 << 20
+
+_zobrist_tables = {}
+
+
+def zobrist_table(n_pits, n_stones, seed=20160601):
+    '''return the (cached) Zobrist keys for a board of `n_pits`.
+    Returns `(pit_keys, player_key)`, where `pit_keys[pit][count]` is the key
+    for `pit` holding `count` stones and `player_key` is mixed in when player 2
+    is to move. Keys come from a seeded generator, so they are the same in
+    every process.'''
+    try:
+        return _zobrist_tables[(n_pits, n_stones, seed)]
+    except KeyError:
+        pass
+    rng = random.Random(seed)
+    pit_keys = [[rng.getrandbits(64) for count in range(n_stones + 1)]
+                for pit in range(2 * n_pits + 2)]
+    table = (pit_keys, rng.getrandbits(64))
+    _zobrist_tables[(n_pits, n_stones, seed)] = table
+    return table
+
+
+def zobrist_key(board, player, table):
+    '''compute the Zobrist key of a position from scratch'''
+    pit_keys, player_key = table
+    key = player_key if player == 2 else 0
+    for (pit, count) in enumerate(board):
+        key ^= pit_keys[pit][count]
+    return key
+
+
+def canonical_board(board, player):
+    '''return `board` as seen by the player to move.
+    Swapping the two halves of the board (pits and target of each player) and
+    the player to move gives an equivalent position, so a position with player
+    2 to move is turned into the one with player 1 to move.'''
+    if player == 1:
+        return board
+    n = len(board) // 2
+    return board[n:] + board[:n]
+
+
+def canonical_key(board, player, table):
+    '''Zobrist key of a position, the same for a position and its mirror image
+    (see `canonical_board`). Only use it for values relative to the player to move.'''
+    pit_keys = table[0]
+    key = 0
+    if player == 1:
+        for (pit, count) in enumerate(board):
+            key ^= pit_keys[pit][count]
+    else:
+        n = len(board) // 2
+        for (pit, count) in enumerate(board):
+            key ^= pit_keys[pit - n][count]
+    return key
+
+
+class SearchTimeout(Exception):
+    '''Raised inside the search when the time or node budget runs out'''
+    pass
+
+
+class TranspositionTable(object):
+    '''A fixed-size transposition table.
+    Entries live in parallel lists indexed by the low bits of the key, so the
+    memory used is set once, by `size_log2`. When two positions share a slot,
+    the new entry replaces the old one if the old one is from an earlier
+    search, or if the new one was searched at least as deeply.'''
+
+    def __init__(self, size_log2=16):
+        self.size = 1 << size_log2
+        self.mask = self.size - 1
+        self.keys = [None] * self.size
+        self.values = [0] * self.size
+        self.depths = [-1] * self.size
+        self.flags = [EXACT] * self.size
+        self.moves = [None] * self.size
+        self.ages = [0] * self.size
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        '''start a new search: older entries become preferred for replacement'''
+        self.age += 1
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key):
+        '''return the slot holding `key`, or None'''
+        self.probes += 1
+        i = key & self.mask
+        if self.keys[i] == key:
+            self.hits += 1
+            return i
+        return None
+
+    def store(self, key, depth, value, flag, move):
+        i = key & self.mask
+        if (self.keys[i] is not None and self.keys[i] != key and
+                self.ages[i] == self.age and self.depths[i] > depth):
+            return
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.values[i] = value
+        self.flags[i] = flag
+        self.moves[i] = move
+        self.ages[i] = self.age
+
+    @property
+    def hit_rate(self):
+        return float(self.hits) / self.probes if self.probes else 0.0
+
+
+class AlphaBetaPlayer(object):
+    '''Iterative-deepening negamax player with a transposition table.
+    * `max_depth` limits the depth (in plies, an extra turn counts as a ply)
+    * `time_limit` is the time budget per move, in seconds
+    * `node_limit` is the node budget per move
+    * `tt_size_log2` sets the transposition table size (2**tt_size_log2 entries)
+    * `tablebase` (optional, see `bao_tablebase`) gives exact values for endgames
+    * `book` (optional, see `bao_book`) gives moves for the opening without searching
+    * `cache` (optional, see `bao_cache`) keeps exact values of subtrees at least
+      `cache_depth` deep, keyed on canonical keys; it can be shared between players
+    After each `choose_move`, `stats` holds the nodes searched, nodes per second,
+    transposition table hit rate, depth reached, the root value and whether
+    the move came from the book.'''
+
+    check_every = 1024
+
+    def __init__(self, max_depth=64, time_limit=1.0, node_limit=None, tt_size_log2=16, tablebase=None, book=None,
+                 cache=None, cache_depth=2):
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.tablebase = tablebase
+        self.book = book
+        self.cache = cache
+        self.cache_depth = cache_depth
+        self.tt = TranspositionTable(tt_size_log2)
+        self.stats = {}
+
+    def __call__(self, game):
+        return self.choose_move(game)
+
+    def evaluate(self, cg):
+        '''value of a position for the player to move: the difference in targets'''
+        n = cg.n_pits
+        diff = cg.board[n] - cg.board[2 * n + 1]
+        return diff if cg.current_player == 1 else -diff
+
+    def choose_move(self, game, stop=None):
+        '''return the best pit id for the player to move in `game`
+        (a `bao_engine.Game` or a `CompactGame`).
+        If `stop` (a `threading.Event`) is set, the search ends early with the best move so far.'''
+        if isinstance(game, CompactGame):
+            cg = game.copy()
+        else:
+            cg = CompactGame.from_game(game)
+        if cg.game_over:
+            raise RuntimeError('choose_move called on a finished game')
+        moves = cg.legal_moves()
+
+        if self.book is not None:
+            hit = self.book.lookup(cg)
+            if hit is not None:
+                self.stats = {'nodes': 0, 'nps': 0.0, 'tt_hit_rate': 0.0, 'depth': 0,
+                              'value': hit[1], 'time': 0.0, 'book': True}
+                return hit[0]
+
+        self.table = zobrist_table(cg.n_pits, cg.n_stones)
+        self.tt.new_search()
+        self.nodes = 0
+        # check at least as often as the node limit, so it is not overshot
+        self.check_interval = self.check_every
+        if self.node_limit is not None:
+            self.check_interval = max(1, min(self.check_every, self.node_limit))
+        self.next_check = self.check_interval
+        self.stop = stop
+        self.start = time.time()
+        self.deadline = None if self.time_limit is None else self.start + self.time_limit
+
+        best_move = moves[0]
+        best_value = None
+        depth_reached = 0
+        key = zobrist_key(cg.board, cg.current_player, self.table)
+        try:
+            for depth in range(1, self.max_depth + 1):
+                self.root_depth = depth
+                value = self._search(cg, key, depth, -INFINITY, INFINITY)
+                i = self.tt.probe(key)
+                if i is not None and self.tt.moves[i] is not None:
+                    best_move = self.tt.moves[i]
+                best_value = value
+                depth_reached = depth
+                if len(moves) == 1:
+                    break
+        except SearchTimeout:
+            pass
+
+        elapsed = time.time() - self.start
+        self.stats = {
+            'nodes': self.nodes,
+            'nps': self.nodes / elapsed if elapsed > 0 else 0.0,
+            'tt_hit_rate': self.tt.hit_rate,
+            'depth': depth_reached,
+            'value': best_value,
+            'time': elapsed,
+            'book': False,
+        }
+        return best_move
+
+    def _check_budget(self):
+        self.next_check = self.nodes + self.check_interval
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise SearchTimeout()
+        if self.stop is not None and self.stop.is_set():
+            raise SearchTimeout()
+
+    def _search(self, cg, key, depth, alpha, beta):
+        '''negamax search; returns the value for the player to move in `cg`'''
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self._check_budget()
+
+        if cg.game_over or depth == 0:
+            return self.evaluate(cg)
+
+        # stop at tablebase hits (except at the root, where we still need a move)
+        if self.tablebase is not None and depth != self.root_depth:
+            value = self.tablebase.probe(cg)
+            if value is not None:
+                return self.evaluate(cg) + value
+
+        cache_key = None
+        if self.cache is not None and depth >= self.cache_depth and depth != self.root_depth:
+            cache_key = canonical_key(cg.board, cg.current_player, self.table)
+            hit = self.cache.get(cache_key)
+            if hit is not None and hit[1] >= depth:
+                return hit[0]
+
+        tt = self.tt
+        alpha_orig = alpha
+        tt_move = None
+        i = tt.probe(key)
+        if i is not None:
+            tt_move = tt.moves[i]
+            if tt.depths[i] >= depth:
+                value = tt.values[i]
+                flag = tt.flags[i]
+                if flag == EXACT:
+                    return value
+                elif flag == LOWER and value > alpha:
+                    alpha = value
+                elif flag == UPPER and value < beta:
+                    beta = value
+                if alpha >= beta:
+                    return value
+
+        # Try the transposition table move first, then pits closest to our target
+        moves = cg.legal_moves()
+        moves.reverse()
+        if tt_move is not None and tt_move in moves:
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
+
+        pit_keys, player_key = self.table
+        board = cg.board
+        player = cg.current_player
+        game_over = cg.game_over
+        best_value = -INFINITY
+        best_move = moves[0]
+        for move in moves:
+            before = board[:]
+            cg.sow(move)
+            cg.perform_captures()
+            cg.update_player()
+            cg.handle_endgame()
+
+            child_key = key
+            for (pit, count) in enumerate(before):
+                if board[pit] != count:
+                    child_key ^= pit_keys[pit][count] ^ pit_keys[pit][board[pit]]
+            if cg.current_player != player:
+                child_key ^= player_key
+                value = -self._search(cg, child_key, depth - 1, -beta, -alpha)
+            else:
+                value = self._search(cg, child_key, depth - 1, alpha, beta)
+
+            board[:] = before
+            cg.current_player = player
+            cg.game_over = game_over
+
+            if value > best_value:
+                best_value = value
+                best_move = move
+            if value > alpha:
+                alpha = value
+            if alpha >= beta:
+                break
+
+        if best_value <= alpha_orig:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        tt.store(key, depth, best_value, flag, best_move)
+        if cache_key is not None and flag == EXACT:
+            self.cache.put(cache_key, best_value, depth)
+        return best_value
+
+
+if __name__ == '__main__':
+    # A fixed-depth search must agree with a plain minimax search
+    def minimax(cg, depth, ai):
+        if cg.game_over or depth == 0:
+            return ai.evaluate(cg)
+        best = -INFINITY
+        for move in cg.legal_moves():
+            child = cg.copy()
+            child.play_round(move)
+            value = minimax(child, depth - 1, ai)
+            best = max(best, value if child.current_player == cg.current_player else -value)
+        return best
+
+    rng = random.Random(1)
+    for gno in range(10):
+        cg = CompactGame()
+        cg.initial_place()
+        for i in range(rng.randrange(20)):
+            if cg.game_over:
+                break
+            cg.play_round(cg.random_move(rng))
+        if cg.game_over:
+            continue
+        ai = AlphaBetaPlayer(max_depth=4, time_limit=None)
+        ai.choose_move(cg)
+        if ai.stats['value'] != minimax(cg, 4, ai):
+            raise RuntimeError('alpha-beta value {} != minimax value for {}'.format(ai.stats['value'], cg))
+
+    # The searcher should beat a random player
+    wins = 0
+    for gno in range(10):
+        ai = AlphaBetaPlayer(time_limit=0.05)
+        cg = CompactGame()
+        cg.initial_place()
+        ai_player = 1 + gno % 2
+        while not cg.game_over:
+            if cg.current_player == ai_player:
+                move = ai.choose_move(cg)
+            else:
+                move = cg.random_move(rng)
+            cg.play_round(move)
+        score = cg.score
+        if score[ai_player - 1] > score[2 - ai_player]:
+            wins += 1
+    print('AlphaBetaPlayer beat a random player {} times out of 10'.format(wins))
+
+    # Node limits smaller than `check_every` must be kept to as well
+    cg = CompactGame()
+    cg.initial_place()
+    for node_limit in (1, 100, 1000):
+        ai = AlphaBetaPlayer(time_limit=None, node_limit=node_limit)
+        ai.choose_move(cg)
+        if ai.stats['nodes'] > node_limit:
+            raise RuntimeError('searched {} nodes with a limit of {}'.format(ai.stats['nodes'], node_limit))
+
+    # A search in another thread must stop promptly when cancelled
+    import threading
+    cg = CompactGame()
+    cg.initial_place()
+    stop = threading.Event()
+    ai = AlphaBetaPlayer(time_limit=None)
+    worker = threading.Thread(target=ai.choose_move, args=(cg, stop))
+    worker.start()
+    time.sleep(0.2)
+    stop.set()
+    worker.join(1.0)
+    if worker.is_alive():
+        raise RuntimeError('cancelled search did not stop')
+
+    ai = AlphaBetaPlayer(time_limit=1.0)
+    move = ai.choose_move(cg)
+    print('Opening move: {} {}'.format(move, ai.stats))
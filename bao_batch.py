@@ -0,0 +1,179 @@
+# file: bao_batch.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Play many random games of bao at once with NumPy.
+
+`simulate` holds N boards as one `(N, 2*n_pits+2)` integer array, laid out like
+`Game.pits`, and advances every unfinished game by one move per step. Sowing,
+captures and the endgame sweep follow the same rules as `bao_engine.Game`, but
+are computed for all games at once:
+
+* A player sows around a cycle of `2*n_pits+1` pits (every pit except the
+  opponent's target). `s` seeds from a pit give every pit in the cycle
+  `s // cycle` seeds, and the next `s % cycle` pits one more.
+* The landing pit is `s` steps along the cycle from where the sowing began.
+'''
+
+from __future__ import print_function, division
+
+import numpy as np
+
+from bao_engine import sowing_cycle
+
+
+def sowing_tables(n_pits):
+    '''return `(cycles, cycle_pos)` for a board of `n_pits`: the tables of
+    `bao_engine.sowing_cycle` for both players, as arrays.
+    `cycles[player-1]` lists the pits, in order, that `player` sows into
+    and `cycle_pos[player-1][pit]` is the index of `pit` in that list
+    (-1 for the pit that is skipped).'''
+    tables = [sowing_cycle(n_pits, player) for player in (1, 2)]
+    cycles = np.array([cycle for (cycle, pos) in tables], dtype=np.intp)
+    cycle_pos = np.array([[-1 if i is None else i for i in pos] for (cycle, pos) in tables], dtype=np.intp)
+    return cycles, cycle_pos
+
+
+def initial_boards(n_games, n_stones=36, n_pits=6):
+    '''return `n_games` boards after `Game.initial_place`'''
+    board = np.zeros(2 * n_pits + 2, dtype=np.int64)
+    p = 0
+    for i in range(n_stones):
+        if p % (n_pits + 1) == n_pits:
+            p = (p + 1) % len(board)
+        board[p] += 1
+        p = (p + 1) % len(board)
+    return np.tile(board, (n_games, 1))
+
+
+def simulate(n_games, n_stones=36, n_pits=6, seed=None, boards=None, players=None,
+             record_moves=False, count_moves=False):
+    '''Play `n_games` random games of bao to completion.
+    * `seed` seeds the NumPy random generator used to choose moves
+    * `boards` (optional) is an `(n_games, 2*n_pits+2)` array of starting positions
+      and `players` (optional) the player to move in each. By default every game
+      starts from the initial placement with player 1 to move.
+    * if `record_moves` is True, the moves played are recorded.
+    * if `count_moves` is True, only the number of moves in each game is kept.
+    Returns an `(n_games, 2)` array of final scores, or, with `record_moves`,
+    `(scores, moves, n_moves)` where row i of `moves` holds the `n_moves[i]`
+    pit ids played in game i, padded with -1, or, with `count_moves`, `(scores, n_moves)`.'''
+    rng = np.random.RandomState(seed)
+    n = n_pits
+    if boards is None:
+        board = initial_boards(n_games, n_stones, n_pits)
+    else:
+        board = np.array(boards, dtype=np.int64)
+        n_games = board.shape[0]
+    if players is None:
+        player = np.ones(n_games, dtype=np.intp)
+    else:
+        player = np.array(players, dtype=np.intp)
+
+    cycles, cycle_pos = sowing_tables(n)
+    cycle_len = cycles.shape[1]
+    steps = np.arange(cycle_len)
+    own_pits = np.arange(n)
+
+    # a game is over when the player to move has no seeds left
+    # (handle_endgame has already swept the other side)
+    own_start = np.where(player == 1, 0, n + 1)
+    active = np.flatnonzero(board[np.arange(n_games)[:, None], own_start[:, None] + own_pits].sum(axis=1) > 0)
+
+    if record_moves:
+        moves = -np.ones((n_games, 64), dtype=np.int16)
+    if record_moves or count_moves:
+        n_moves = np.zeros(n_games, dtype=np.intp)
+
+    while len(active):
+        b = board[active]
+        p = player[active]
+        rows = np.arange(len(active))
+        own_start = np.where(p == 1, 0, n + 1)
+        target = own_start + n
+
+        # choose a random non-empty pit for each game
+        own = own_start[:, None] + own_pits
+        r = rng.random_sample(own.shape)
+        r[b[rows[:, None], own] == 0] = -1.0
+        pit = own_start + r.argmax(axis=1)
+
+        if record_moves:
+            if n_moves.max() >= moves.shape[1]:
+                moves = np.hstack([moves, -np.ones_like(moves)])
+            moves[active, n_moves[active]] = pit
+        if record_moves or count_moves:
+            n_moves[active] += 1
+
+        # sow
+        seeds = b[rows, pit]
+        b[rows, pit] = 0
+        start = cycle_pos[p - 1, pit]
+        full, extra = np.divmod(seeds, cycle_len)
+        ahead = (steps[None, :] - start[:, None] - 1) % cycle_len
+        b[rows[:, None], cycles[p - 1]] += full[:, None] + (ahead < extra[:, None])
+        last = cycles[p - 1, (start + seeds) % cycle_len]
+
+        # captures
+        opp = 2 * n - last
+        capture = ((last >= own_start) & (last < target) & (b[rows, last] == 1) &
+                   (b[rows, opp % b.shape[1]] > 0))
+        c = rows[capture]
+        b[c, target[capture]] += b[c, opp[capture]] + 1
+        b[c, opp[capture]] = 0
+        b[c, last[capture]] = 0
+
+        # switch players, unless the last seed landed in our target
+        p = np.where(last == target, p, 3 - p)
+
+        # endgame: if the player to move has no seeds, the other player
+        # sweeps their own seeds into their target
+        own_start = np.where(p == 1, 0, n + 1)
+        over = b[rows[:, None], own_start[:, None] + own_pits].sum(axis=1) == 0
+        o = rows[over]
+        p[over] = 3 - p[over]
+        sweep = np.where(p[over] == 1, 0, n + 1)[:, None] + own_pits
+        b[o, sweep[:, 0] + n] += b[o[:, None], sweep].sum(axis=1)
+        b[o[:, None], sweep] = 0
+
+        board[active] = b
+        player[active] = p
+        active = active[~over]
+
+    scores = board[:, [n, 2 * n + 1]]
+    if record_moves:
+        return scores, moves[:, :max(1, n_moves.max())], n_moves
+    if count_moves:
+        return scores, n_moves
+    return scores
+
+
+if __name__ == '__main__':
+    import time
+    import bao_engine
+    import bao_compact
+
+    # Scores must match the object engine when the moves are replayed
+    scores, moves, n_moves = simulate(200, seed=1, record_moves=True)
+    for i in range(len(scores)):
+        bg, s = bao_engine.play_game(list(moves[i, :n_moves[i]]))
+        bao_engine.check_game(bg, s)
+        if not bg.game_over or s != list(scores[i]):
+            raise RuntimeError('Batch score {} != {} for moves {}'.format(list(scores[i]), s, list(moves[i, :n_moves[i]])))
+
+    for (n_stones, n_pits) in ((72, 6), (96, 8), (480, 12)):
+        scores, moves, n_moves = simulate(50, n_stones, n_pits, seed=2, record_moves=True)
+        for i in range(len(scores)):
+            cg, s = bao_compact.play_game(list(moves[i, :n_moves[i]]), n_stones, n_pits)
+            if not cg.game_over or s != list(scores[i]):
+                raise RuntimeError('Batch score {} != {} for moves {}'.format(list(scores[i]), s, list(moves[i, :n_moves[i]])))
+
+    if (simulate(200, seed=1, count_moves=True)[1] != simulate(200, seed=1, record_moves=True)[2]).any():
+        raise RuntimeError('count_moves and record_moves disagree')
+
+    start = time.time()
+    n_games = 100000
+    scores = simulate(n_games, seed=3)
+    elapsed = time.time() - start
+    print('{} games in {:.2f}s ({:.0f} games/s). Player 1 wins {:.1%}'.format(
+        n_games, elapsed, n_games / elapsed, (scores[:, 0] > scores[:, 1]).mean()))
@@ -0,0 +1,238 @@
+# file: bao_bench.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Benchmarks for the bao engine.
+
+Microbenchmarks time the engine's hot paths (`Pit.add`, `Pit.pickup_stones`,
+`Game.sow`, `Game.perform_captures`, `Game.handle_endgame`, `random_game` and
+`play_game`), and self-play benchmarks measure moves per second for a grid of
+`Game(n_stones, n_pits)` configurations, for both the object and compact engines.
+
+Every result is a time per operation in nanoseconds (lower is better), the best
+of several repeats. Results are written as JSON, and can be compared against a
+stored baseline (benchmarks that look slower are run again, with more repeats,
+before they are flagged):
+
+    python bao_bench.py --output baseline.json
+    python bao_bench.py --compare baseline.json
+'''
+
+from __future__ import print_function, division
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+from timeit import default_timer as timer
+
+import bao_engine
+import bao_compact
+from bao_vectors import read_vectors
+
+CONFIGS = [(36, 6), (72, 6), (96, 8), (480, 12)]
+TEST_VECTORS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_vectors.json')
+
+
+def best_of(repeats, func):
+    '''run `func` (which returns `(seconds, operations)`) `repeats` times and return the best ns/op'''
+    best = None
+    for i in range(repeats):
+        (seconds, ops) = func()
+        ns = seconds * 1e9 / ops
+        if best is None or ns < best:
+            best = ns
+    return best
+
+
+def bench_pit_add(target, stones=48):
+    def run():
+        pit = bao_engine.Pit(id=0, target=target)
+        ss = [bao_engine.Stone(id=i) for i in range(stones)]
+        elapsed = 0.0
+        for rnd in range(20):
+            start = timer()
+            for s in ss:
+                pit.add(s)
+            elapsed += timer() - start
+            pit.pickup_stones()
+        return (elapsed, 20 * stones)
+    return run
+
+
+def bench_pit_pickup(stones=48):
+    def run():
+        pit = bao_engine.Pit(id=0, target=True)
+        ss = [bao_engine.Stone(id=i) for i in range(stones)]
+        elapsed = 0.0
+        for rnd in range(20):
+            for s in ss:
+                pit.add(s)
+            start = timer()
+            pit.pickup_stones()
+            elapsed += timer() - start
+        return (elapsed, 20)
+    return run
+
+
+def sample_positions(n, seed=12, n_stones=36, n_pits=6):
+    '''return `n` (move list, move) pairs: random positions part way through a game, and a move to play'''
+    rng = random.Random(seed)
+    samples = []
+    while len(samples) < n:
+        cg = bao_compact.CompactGame(n_stones, n_pits)
+        cg.initial_place()
+        cg, score = bao_compact.random_game(cg, rng=rng)
+        ply = rng.randrange(len(cg.move_list))
+        samples.append((cg.move_list[:ply], cg.move_list[ply]))
+    return samples
+
+
+def bench_phases(samples, n_stones=36, n_pits=6):
+    '''time sow, perform_captures and handle_endgame separately, over the sample positions'''
+    def setup():
+        games = []
+        for (moves, move) in samples:
+            bg = bao_engine.Game(n_stones, n_pits)
+            bg.initial_place()
+            for m in moves:
+                bg.play_round(m)
+            games.append((bg, move))
+        return games
+
+    def run(phase):
+        def timed():
+            games = setup()
+            elapsed = 0.0
+            for (bg, move) in games:
+                t0 = timer()
+                bg.sow(move)
+                t1 = timer()
+                bg.perform_captures()
+                t2 = timer()
+                bg.update_player()
+                t3 = timer()
+                bg.handle_endgame()
+                t4 = timer()
+                elapsed += {'sow': t1 - t0, 'perform_captures': t2 - t1, 'handle_endgame': t4 - t3}[phase]
+            return (elapsed, len(games))
+        return timed
+    return run
+
+
+def bench_random_game(n_games, engine, n_stones=36, n_pits=6):
+    '''time per move of random self-play'''
+    def run():
+        moves = 0
+        start = timer()
+        for i in range(n_games):
+            if engine == 'compact':
+                g = bao_compact.CompactGame(n_stones, n_pits)
+                g.initial_place()
+                g, score = bao_compact.random_game(g)
+            else:
+                g = bao_engine.Game(n_stones, n_pits)
+                g.initial_place()
+                g, score = bao_engine.random_game(g)
+            moves += len(g.move_list)
+        return (timer() - start, moves)
+    return run
+
+
+def bench_play_game(move_lists):
+    def run():
+        start = timer()
+        for ml in move_lists:
+            bao_engine.play_game(ml)
+        return (timer() - start, len(move_lists))
+    return run
+
+
+def benchmark_list(quick=False, configs=CONFIGS):
+    '''return the benchmarks, as a list of `(name, function)`'''
+    scale = 1 if quick else 4
+    benchmarks = [
+        ('Pit.add[target]', bench_pit_add(True)),
+        ('Pit.add[pit]', bench_pit_add(False, stones=16)),
+        ('Pit.pickup_stones', bench_pit_pickup()),
+    ]
+    phases = bench_phases(sample_positions(50 * scale))
+    for phase in ('sow', 'perform_captures', 'handle_endgame'):
+        benchmarks.append(('Game.{}'.format(phase), phases(phase)))
+    benchmarks.append(('random_game', bench_random_game(5 * scale, 'object')))
+    move_lists = [ml for (ml, score) in read_vectors(TEST_VECTORS)]
+    benchmarks.append(('play_game', bench_play_game(move_lists[:10 * scale])))
+    for (n_stones, n_pits) in configs:
+        for engine in ('object', 'compact'):
+            n_games = (5 if engine == 'object' else 50) * scale
+            benchmarks.append(('selfplay[{},{}/{}]'.format(engine, n_stones, n_pits),
+                               bench_random_game(n_games, engine, n_stones, n_pits)))
+    return benchmarks
+
+
+def run_benchmarks(quick=False, configs=CONFIGS, progress=None, names=None, repeats=None):
+    '''run every benchmark (or those in `names`), returning a dictionary of {name: ns per operation}'''
+    if repeats is None:
+        repeats = 3 if quick else 5
+    results = {}
+    for (name, func) in benchmark_list(quick, configs):
+        if names is not None and name not in names:
+            continue
+        results[name] = best_of(repeats, func)
+        if progress is not None:
+            progress(name, results[name])
+    return results
+
+
+def compare(baseline, results, threshold=0.10):
+    '''return a list of `(name, baseline ns, current ns, ratio)` for benchmarks
+    more than `threshold` slower than in `baseline`'''
+    slower = []
+    for (name, ns) in sorted(results.items()):
+        if name in baseline and ns > baseline[name] * (1 + threshold):
+            slower.append((name, baseline[name], ns, ns / baseline[name]))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the bao engine')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='flag slowdowns against this results file')
+    parser.add_argument('--threshold', type=float, default=0.10, help='slowdown (as a fraction) to flag')
+    parser.add_argument('--quick', action='store_true', help='fewer, shorter runs')
+    args = parser.parse_args(argv)
+
+    def progress(name, ns):
+        print('{:32} {:14.0f} ns/op'.format(name, ns), file=sys.stderr)
+
+    results = run_benchmarks(quick=args.quick, progress=progress)
+    report = {'python': platform.python_version(), 'unit': 'ns/op', 'results': results}
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            baseline = json.load(fp)['results']
+        slower = compare(baseline, results, args.threshold)
+        if slower:
+            # one slow run is often noise: only flag what is still slow when run again, for longer
+            names = [name for (name, old, new, ratio) in slower]
+            rerun = run_benchmarks(quick=args.quick, progress=progress, names=names,
+                                   repeats=3 * (3 if args.quick else 5))
+            for name in names:
+                results[name] = min(results[name], rerun[name])
+            slower = compare(baseline, results, args.threshold)
+        for (name, old, new, ratio) in slower:
+            print('SLOWER {}: {:.0f} -> {:.0f} ns/op ({:.2f}x)'.format(name, old, new, ratio), file=sys.stderr)
+        print(json.dumps({'slower': [name for (name, old, new, ratio) in slower],
+                          'ratios': dict((name, round(ratio, 3)) for (name, old, new, ratio) in slower)},
+                         sort_keys=True))
+        return 1 if slower else 0
+    print(json.dumps(report, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# file: bao_book.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Opening book for bao.
+
+Every game starts from the same `initial_place` layout, so the first few plies
+are the same handful of positions over and over. `build` searches every
+position up to `plies` moves from the start (with `AlphaBetaPlayer`, for much
+longer than a player would per move), and writes the best move and value of
+each to a book file.
+
+The file is a small header followed by fixed-size entries sorted by the
+position's Zobrist key (see `bao_ai.zobrist_key`), so a lookup is a binary
+search. `OpeningBook` only opens and memory-maps the file on its first lookup.
+'''
+
+from __future__ import print_function
+import mmap
+import struct
+import sys
+
+from bao_ai import AlphaBetaPlayer, zobrist_key, zobrist_table
+from bao_compact import CompactGame
+
+MAGIC = b'BAOBK001'
+HEADER = struct.Struct('<8sHHHHQ')      # magic, version, n_pits, n_stones, plies, n_entries
+ENTRY = struct.Struct('<QBBh')          # key, move, depth searched, value
+
+
+def position_key(game):
+    '''Zobrist key of `game` (a `CompactGame` or a `bao_engine.Game`)'''
+    board = getattr(game, 'board', None)
+    if board is None:
+        board = [p.count_stones() for p in game.pits]
+    return zobrist_key(board, game.current_player, zobrist_table(game.n_pits, game.n_stones))
+
+
+def opening_positions(n_stones=36, n_pits=6, plies=4):
+    '''return `{key: CompactGame}` for every unfinished position up to `plies` moves from the start'''
+    cg = CompactGame(n_stones=n_stones, n_pits=n_pits)
+    cg.initial_place()
+    positions = {position_key(cg): cg}
+    frontier = [cg]
+    for ply in range(plies):
+        next_frontier = []
+        for cg in frontier:
+            for move in cg.legal_moves():
+                child = cg.copy()
+                child.play_round(move)
+                if child.game_over:
+                    continue
+                key = position_key(child)
+                if key not in positions:
+                    positions[key] = child
+                    next_frontier.append(child)
+        frontier = next_frontier
+    return positions
+
+
+def build(filename, n_stones=36, n_pits=6, plies=4, time_limit=10.0, max_depth=64, progress=False):
+    '''Search every position up to `plies` moves from the start for `time_limit`
+    seconds (or to `max_depth`) and write the book to `filename`. Positions whose
+    search finished no iteration in time are left out, with a warning.
+    Returns the number of positions in the book.'''
+    positions = opening_positions(n_stones, n_pits, plies)
+    ai = AlphaBetaPlayer(max_depth=max_depth, time_limit=time_limit)
+    entries = []
+    for (i, key) in enumerate(sorted(positions)):
+        move = ai.choose_move(positions[key])
+        if ai.stats['value'] is None:
+            print('warning: no search of position {:016x} finished in {}s; left out of the book'.format(
+                key, time_limit), file=sys.stderr)
+            continue
+        entries.append(ENTRY.pack(key, move, ai.stats['depth'], ai.stats['value']))
+        if progress:
+            print('{}/{}: move {} {}'.format(i + 1, len(positions), move, ai.stats))
+
+    with open(filename, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, 1, n_pits, n_stones, plies, len(entries)))
+        fp.write(b''.join(entries))
+    return len(entries)
+
+
+class OpeningBook(object):
+    '''Read-only view of a book file. The file is not opened until the first lookup.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.mm = None
+        self.hits = 0
+        self.probes = 0
+
+    def _open(self):
+        with open(self.filename, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.n_pits, self.n_stones, self.plies, self.n_entries) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise RuntimeError('{} is not a bao opening book'.format(self.filename))
+        if len(self.mm) != HEADER.size + self.n_entries * ENTRY.size:
+            raise RuntimeError('{} is truncated or corrupt'.format(self.filename))
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def lookup(self, game):
+        '''return `(move, value)` for `game` (a `CompactGame` or a `bao_engine.Game`),
+        or None if the position is not in the book'''
+        if self.mm is None:
+            self._open()
+        self.probes += 1
+        if game.n_pits != self.n_pits or game.n_stones != self.n_stones or game.game_over:
+            return None
+        key = position_key(game)
+        lo = 0
+        hi = self.n_entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (k, move, depth, value) = ENTRY.unpack_from(self.mm, HEADER.size + mid * ENTRY.size)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                self.hits += 1
+                return (move, value)
+        return None
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import time
+
+    fd, filename = tempfile.mkstemp(suffix='.book')
+    os.close(fd)
+    try:
+        start = time.time()
+        build(filename, plies=2, time_limit=0.05)
+        positions = opening_positions(plies=2)
+        print('Built a {} position book in {:.1f}s ({} bytes)'.format(
+            len(positions), time.time() - start, os.path.getsize(filename)))
+
+        book = OpeningBook(filename)
+        if book.mm is not None:
+            raise RuntimeError('book was opened before its first lookup')
+        for cg in positions.values():
+            hit = book.lookup(cg)
+            if hit is None or hit[0] not in cg.legal_moves():
+                raise RuntimeError('book has no legal move for {}'.format(cg))
+            if book.lookup(cg.to_game()) != hit:
+                raise RuntimeError('book lookup differs for a Game and a CompactGame')
+
+        # a search too short to finish depth 1 leaves the position out, rather than failing
+        fd, short = tempfile.mkstemp(suffix='.book')
+        os.close(fd)
+        AlphaBetaPlayer.check_every = 1
+        try:
+            if build(short, plies=1, time_limit=1e-9) != 0 or OpeningBook(short).lookup(cg) is not None:
+                raise RuntimeError('book holds positions that were not searched')
+        finally:
+            AlphaBetaPlayer.check_every = 1024
+            os.remove(short)
+
+        # positions further in must miss
+        cg = list(positions.values())[0].copy()
+        while not cg.game_over and position_key(cg) in positions:
+            cg.play_round(cg.legal_moves()[0])
+        if not cg.game_over and book.lookup(cg) is not None:
+            raise RuntimeError('book found a position it does not have')
+
+        ai = AlphaBetaPlayer(time_limit=0.01, book=book)
+        cg = CompactGame()
+        cg.initial_place()
+        if ai.choose_move(cg) != book.lookup(cg)[0] or not ai.stats['book']:
+            raise RuntimeError('AlphaBetaPlayer did not use the book')
+        book.close()
+    finally:
+        os.remove(filename)
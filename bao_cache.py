@@ -0,0 +1,365 @@
+# file: bao_cache.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Size-bounded caches of position values, keyed on canonical position keys.
+
+The board is symmetric: a position with player 2 to move is the same as the
+one with the halves of the board swapped and player 1 to move (see
+`bao_ai.canonical_board`). Keyed on `bao_ai.canonical_key`, a cache holds each
+position once rather than twice, as long as the values it holds are relative
+to the player to move (like every value `AlphaBetaPlayer` computes).
+
+Both caches map a 64-bit key to a `(value, depth)` pair, where `depth` says how
+deeply the value was searched (0 for a plain evaluation), and count hits,
+misses and evictions.
+
+* `EvalCache` is an ordinary dictionary with least-recently-used eviction.
+* `SharedEvalCache` lives in a memory-mapped file, so every process that has it
+  (it pickles as the file name) shares the same entries. It is a table of
+  buckets of `WAYS` entries; a bucket evicts with the CLOCK algorithm. There
+  are no locks: each entry stores its key XORed with its data, so an entry torn
+  by two processes writing at once reads as a miss rather than a wrong value.
+
+    cache = SharedEvalCache(size_log2=20)
+    player = AlphaBetaPlayer(cache=cache)     # share `cache` with players in other processes
+'''
+
+from __future__ import print_function
+from collections import OrderedDict
+import mmap
+import os
+import struct
+import tempfile
+
+from bao_ai import canonical_key, zobrist_table
+
+MAGIC = b'BAOEC001'
+HEADER = struct.Struct('<8sHHI')    # magic, version, size_log2, ways
+ENTRY = struct.Struct('<QQ')        # key ^ data, data
+WAYS = 4
+
+_DEPTH_SHIFT = 32
+_VALUE_MASK = (1 << _DEPTH_SHIFT) - 1
+
+
+def _pack(value, depth):
+    return (value & _VALUE_MASK) | (depth << _DEPTH_SHIFT)
+
+
+def _unpack(data):
+    value = data & _VALUE_MASK
+    if value >= 1 << 31:
+        value -= 1 << _DEPTH_SHIFT
+    return (value, data >> _DEPTH_SHIFT)
+
+
+def position_key(game):
+    '''canonical key of `game` (a `CompactGame` or a `bao_engine.Game`)'''
+    board = getattr(game, 'board', None)
+    if board is None:
+        board = [p.count_stones() for p in game.pits]
+    return canonical_key(board, game.current_player, zobrist_table(game.n_pits, game.n_stones))
+
+
+class EvalCache(object):
+    '''An in-process cache of at most `capacity` entries, evicting the least recently used'''
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        '''return `(value, depth)` for `key`, or None'''
+        try:
+            entry = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key, value, depth=0):
+        '''store `value`, unless `key` is already held with a deeper value'''
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry[1] > depth:
+            self.entries[key] = entry
+            return
+        if entry is None and len(self.entries) >= self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = (value, depth)
+
+    @property
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return float(self.hits) / probes if probes else 0.0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'capacity': self.capacity, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'hit_rate': self.hit_rate}
+
+
+class SharedEvalCache(object):
+    '''A cache of `2**size_log2` entries in a memory-mapped file, shared by every
+    process that opens it. `filename` is created if it does not exist, and kept;
+    with no `filename`, a temporary file is created (in /dev/shm where there is
+    one) and deleted by `close`. The file starts with a header (`MAGIC`, a format
+    version, `size_log2` and `WAYS`); opening an existing file whose header does
+    not match raises ValueError. Unpickling opens the same file, so a cache
+    passed to pool workers is shared with them.
+    The hit, miss and eviction counts are for this process only.'''
+
+    def __init__(self, filename=None, size_log2=16):
+        self.owner = filename is None
+        if filename is None:
+            shm = '/dev/shm'
+            (fd, filename) = tempfile.mkstemp(suffix='.cache', dir=shm if os.path.isdir(shm) else None)
+            os.close(fd)
+        self.filename = filename
+        self.size = 1 << size_log2
+        self.n_buckets = max(1, self.size // WAYS)
+        # a header, the entries, then one CLOCK reference byte per entry, then one hand per bucket
+        self.entry_offset = HEADER.size
+        self.ref_offset = self.entry_offset + self.n_buckets * WAYS * ENTRY.size
+        self.hand_offset = self.ref_offset + self.n_buckets * WAYS
+        length = self.hand_offset + self.n_buckets
+        header = HEADER.pack(MAGIC, 1, size_log2, WAYS)
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT)
+        try:
+            size = os.fstat(fd).st_size
+            if size == 0:
+                os.ftruncate(fd, length)
+                os.write(fd, header)
+            elif size != length or os.read(fd, HEADER.size) != header:
+                raise ValueError('{} is not a bao evaluation cache of 2**{} entries'.format(filename, size_log2))
+            self.mm = mmap.mmap(fd, length)
+        finally:
+            os.close(fd)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'size_log2': self.size.bit_length() - 1}
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'], state['size_log2'])
+        self.owner = False
+
+    def close(self):
+        self.mm.close()
+        if self.owner and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def get(self, key):
+        '''return `(value, depth)` for `key`, or None'''
+        mm = self.mm
+        first = (key % self.n_buckets) * WAYS
+        for slot in range(first, first + WAYS):
+            (check, data) = ENTRY.unpack_from(mm, self.entry_offset + slot * ENTRY.size)
+            if check ^ data == key and (check or data):
+                mm[self.ref_offset + slot:self.ref_offset + slot + 1] = b'\x01'
+                self.hits += 1
+                return _unpack(data)
+        self.misses += 1
+        return None
+
+    def put(self, key, value, depth=0):
+        '''store `value`, unless `key` is already held with a deeper value'''
+        mm = self.mm
+        bucket = key % self.n_buckets
+        first = bucket * WAYS
+        data = _pack(value, depth)
+        victim = None
+        for slot in range(first, first + WAYS):
+            (check, old) = ENTRY.unpack_from(mm, self.entry_offset + slot * ENTRY.size)
+            if check ^ old == key and (check or old):
+                if _unpack(old)[1] > depth:
+                    return
+                victim = slot
+                break
+            if victim is None and not (check or old):
+                victim = slot
+        if victim is None:
+            # CLOCK: pass over (and clear) recently used entries until one was not
+            hand = self.hand_offset + bucket
+            way = ord(mm[hand:hand + 1])
+            ref = self.ref_offset + first
+            while mm[ref + way:ref + way + 1] != b'\x00':
+                mm[ref + way:ref + way + 1] = b'\x00'
+                way = (way + 1) % WAYS
+            victim = first + way
+            mm[hand:hand + 1] = struct.pack('B', (way + 1) % WAYS)
+            self.evictions += 1
+        ENTRY.pack_into(mm, self.entry_offset + victim * ENTRY.size, key ^ data, data)
+        mm[self.ref_offset + victim:self.ref_offset + victim + 1] = b'\x01'
+
+    def __len__(self):
+        n = 0
+        for slot in range(self.n_buckets * WAYS):
+            if ENTRY.unpack_from(self.mm, self.entry_offset + slot * ENTRY.size) != (0, 0):
+                n += 1
+        return n
+
+    @property
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return float(self.hits) / probes if probes else 0.0
+
+    def stats(self):
+        return {'entries': len(self), 'capacity': self.n_buckets * WAYS, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'hit_rate': self.hit_rate}
+
+
+def memoize(evaluate, cache):
+    '''wrap `evaluate(game)` (a value relative to the player to move) so it looks in `cache` first'''
+    def cached(game):
+        key = position_key(game)
+        hit = cache.get(key)
+        if hit is not None:
+            return hit[0]
+        value = evaluate(game)
+        cache.put(key, value)
+        return value
+    return cached
+
+
+def _fill(task):
+    '''worker for the self-check: store values for some keys, and read back others'''
+    (cache, keys, expected) = task
+    for key in keys:
+        cache.put(key, key % 1000 - 500, 3)
+    found = [cache.get(key) for key in expected]
+    return [hit[0] if hit is not None else None for hit in found]
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import random
+    from bao_ai import AlphaBetaPlayer, canonical_board
+    from bao_compact import CompactGame
+
+    # a position and its mirror image share a key, and have the same value
+    rng = random.Random(3)
+    table = zobrist_table(6, 36)
+    for gno in range(20):
+        cg = CompactGame()
+        cg.initial_place()
+        for i in range(rng.randrange(1, 30)):
+            if cg.game_over:
+                break
+            cg.play_round(cg.random_move(rng))
+        if cg.game_over:
+            continue
+        mirror = cg.copy()
+        mirror.board = canonical_board(cg.board, cg.current_player)
+        if cg.current_player == 2:
+            mirror.current_player = 1
+        else:
+            mirror.board = canonical_board(cg.board, 2)
+            mirror.current_player = 2
+        if position_key(mirror) != position_key(cg):
+            raise RuntimeError('mirror image has a different key:\n{}{}'.format(cg, mirror))
+        values = []
+        for game in (cg, mirror):
+            ai = AlphaBetaPlayer(max_depth=5, time_limit=None)
+            ai.choose_move(game)
+            values.append(ai.stats['value'])
+        if values[0] != values[1]:
+            raise RuntimeError('mirror image has a different value: {}'.format(values))
+
+    # least recently used entries go first
+    cache = EvalCache(2)
+    cache.put(1, 10)
+    cache.put(2, 20)
+    cache.get(1)
+    cache.put(3, 30)
+    if cache.get(2) is not None or cache.get(1) != (10, 0) or cache.stats()['evictions'] != 1:
+        raise RuntimeError('LRU eviction is wrong: {}'.format(cache.stats()))
+
+    # a full shared bucket evicts an entry that has not been used since the hand last passed
+    shared = SharedEvalCache(size_log2=2)
+    try:
+        for key in range(1, 5):
+            shared.put(key, -key, key)
+        shared.put(3, 0, 1)
+        if shared.get(3) != (-3, 3):
+            raise RuntimeError('a shallower value replaced a deeper one')
+        shared.put(5, 5)        # every entry is referenced: the hand clears them all, then evicts key 1
+        shared.get(2)
+        shared.put(6, 6)        # key 2 was used since: key 3 goes
+        if [shared.get(key) is not None for key in range(1, 7)] != [False, True, False, True, True, True]:
+            raise RuntimeError('CLOCK eviction is wrong')
+        if len(shared) != 4:
+            raise RuntimeError('expected a full cache')
+    finally:
+        shared.close()
+
+    # a named cache is created if need be, and keeps its entries once closed
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'named.cache')
+        shared = SharedEvalCache(filename, size_log2=8)
+        shared.put(42, -7, 5)
+        shared.close()
+        shared = SharedEvalCache(filename, size_log2=8)
+        if shared.get(42) != (-7, 5):
+            raise RuntimeError('a named cache lost its entries')
+        shared.close()
+
+        # but not with another size, and not a file that is not a cache
+        with open(os.path.join(tmpdir, 'other'), 'wb') as fp:
+            fp.write(b'\x01' * 8192)
+        for (name, size_log2) in ((filename, 9), (os.path.join(tmpdir, 'other'), 8)):
+            try:
+                SharedEvalCache(name, size_log2)
+            except ValueError:
+                pass
+            else:
+                raise RuntimeError('{} opened as a 2**{} cache'.format(name, size_log2))
+        os.remove(os.path.join(tmpdir, 'other'))
+    finally:
+        os.remove(filename)
+        os.rmdir(tmpdir)
+
+    # workers in a pool see each other's entries, and the parent sees theirs
+    shared = SharedEvalCache(size_log2=14)
+    try:
+        parent = [key * 7919 for key in range(1, 101)]
+        for key in parent:
+            shared.put(key, key % 1000 - 500, 3)
+        pool = multiprocessing.Pool(2)
+        results = pool.map(_fill, [(shared, [k * 104729 for k in range(1, 201)], parent)] * 2)
+        pool.close()
+        pool.join()
+        if any(result != [k % 1000 - 500 for k in parent] for result in results):
+            raise RuntimeError('workers did not see the parent\'s entries')
+        if any(shared.get(k * 104729) != ((k * 104729) % 1000 - 500, 3) for k in range(1, 201)):
+            raise RuntimeError('the parent did not see the workers\' entries')
+
+        # a search with a cache finds the same move and value, and a second
+        # player sharing the cache searches fewer nodes
+        cg = CompactGame()
+        cg.initial_place()
+        plain = AlphaBetaPlayer(max_depth=7, time_limit=None)
+        move = plain.choose_move(cg)
+        nodes = []
+        for i in range(2):
+            ai = AlphaBetaPlayer(max_depth=7, time_limit=None, cache=shared)
+            if (ai.choose_move(cg), ai.stats['value']) != (move, plain.stats['value']):
+                raise RuntimeError('the cache changed the search result')
+            nodes.append(ai.stats['nodes'])
+        if nodes[1] >= nodes[0]:
+            raise RuntimeError('the shared cache saved no work: {} nodes'.format(nodes))
+        print('Nodes searched: {} without a cache, {} with a cold one, {} with a warm one; {}'.format(
+            plain.stats['nodes'], nodes[0], nodes[1], shared.stats()))
+    finally:
+        shared.close()
@@ -0,0 +1,184 @@
+# file: bao_cli.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Headless command line for batch jobs. Never imports Kivy.
+
+    python -m bao_cli simulate --games 100000 --engine batch --seed 1
+    python -m bao_cli verify test_vectors.json --processes 8
+    python -m bao_cli export positions/ --games 1000000
+    python -m bao_cli tournament results.jsonl random greedy alphabeta mcts --rounds 20
+    python -m bao_cli bench --quick
+
+Each command prints a one-line JSON summary on stdout (and exits non-zero if
+verification fails or a benchmark regresses). Only the modules a command needs
+are imported, when it runs, so starting up costs little more than the
+interpreter itself.
+'''
+
+from __future__ import print_function
+import argparse
+import json
+import sys
+import time
+
+
+def simulate(args):
+    '''play random games and summarize the results'''
+    from bao_rollout import RolloutStats
+    stats = RolloutStats()
+    start = time.time()
+    if args.engine == 'compact':
+        from bao_rollout import rollouts
+        for result in rollouts(args.games, args.seed, args.processes, n_stones=args.stones, n_pits=args.pits):
+            stats.add(result)
+    elif args.engine == 'batch':
+        from bao_batch import simulate as batch_simulate
+        (scores, n_moves) = batch_simulate(args.games, args.stones, args.pits, seed=args.seed, count_moves=True)
+        for (score, plies) in zip(scores.tolist(), n_moves.tolist()):
+            stats.add((None, score, plies))
+    else:
+        import random
+        from bao_engine import Game, random_game
+        random.seed(args.seed)
+        for i in range(args.games):
+            bg = Game(n_stones=args.stones, n_pits=args.pits)
+            bg.initial_place()
+            bg, score = random_game(bg)
+            stats.add((None, score, len(bg.move_list)))
+    elapsed = time.time() - start
+
+    summary = stats.summary()
+    summary['engine'] = args.engine
+    summary['seconds'] = elapsed
+    summary['games_per_s'] = stats.games / elapsed if elapsed > 0 else 0.0
+    if not args.histograms:
+        del summary['p1_score_hist']
+        del summary['plies_hist']
+    print(json.dumps(summary, sort_keys=True))
+    return 0
+
+
+def verify(args):
+    '''replay a test vector file and report any mismatches'''
+    from bao_vectors import verify_stream
+    checked = [0]
+
+    def progress(n):
+        checked[0] = n
+
+    start = time.time()
+    mismatches = [{'index': index, 'moves': moves, 'expected': list(expected), 'score': list(score)}
+                  for (index, moves, expected, score)
+                  in verify_stream(args.filename, args.format, args.processes, args.chunk_size, progress)]
+    print(json.dumps({'file': args.filename, 'checked': checked[0], 'seconds': time.time() - start,
+                      'ok': not mismatches, 'mismatches': mismatches}, sort_keys=True))
+    return 1 if mismatches else 0
+
+
+def export(args):
+    '''append self-play positions to column files (see `bao_export`)'''
+    from bao_export import export as export_games
+    start = time.time()
+    rows = export_games(args.directory, args.games, args.seed, args.processes,
+                        n_stones=args.stones, n_pits=args.pits, buffer_rows=args.buffer_rows)
+    print(json.dumps({'directory': args.directory, 'games': args.games, 'rows': rows,
+                      'seconds': time.time() - start}, sort_keys=True))
+    return 0
+
+
+def tournament(args):
+    '''play the built-in players against each other (see `bao_tournament`)'''
+    from bao_tournament import Tournament, random_policy, greedy_policy
+    players = {}
+    for name in args.players:
+        if name == 'random':
+            players[name] = random_policy
+        elif name == 'greedy':
+            players[name] = greedy_policy
+        elif name == 'alphabeta':
+            from bao_ai import AlphaBetaPlayer
+            players[name] = AlphaBetaPlayer(time_limit=args.time, tt_size_log2=16)
+        else:
+            from bao_mcts import MCTSPlayer
+            players[name] = MCTSPlayer(time_limit=args.time)
+    t = Tournament(players, args.results, args.pairing, args.rounds, args.processes,
+                   n_stones=args.stones, n_pits=args.pits, seed=args.seed)
+    start = time.time()
+    standings = t.run()
+    print(json.dumps({'results': args.results, 'games': len(t.played), 'seconds': time.time() - start,
+                      'standings': standings}, sort_keys=True))
+    return 0
+
+
+def bench(args):
+    '''run the engine benchmarks (see `bao_bench`)'''
+    import bao_bench
+    argv = ['--threshold', str(args.threshold)]
+    if args.quick:
+        argv.append('--quick')
+    if args.output:
+        argv += ['--output', args.output]
+    if args.compare:
+        argv += ['--compare', args.compare]
+    return bao_bench.main(argv)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bao_cli', description='Headless bao jobs')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    p = commands.add_parser('simulate', help='play random games')
+    p.add_argument('--games', type=int, default=1000)
+    p.add_argument('--stones', type=int, default=36)
+    p.add_argument('--pits', type=int, default=6)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--engine', choices=['object', 'compact', 'batch'], default='compact',
+                   help='object: bao_engine.Game, compact: CompactGame (in parallel), batch: NumPy')
+    p.add_argument('--processes', type=int, default=None, help='compact engine: worker processes (default: one per CPU)')
+    p.add_argument('--histograms', action='store_true', help='include score and game length histograms')
+    p.set_defaults(func=simulate)
+
+    p = commands.add_parser('verify', help='replay test vectors')
+    p.add_argument('filename', nargs='?', default='test_vectors.json')
+    p.add_argument('--format', choices=['json', 'jsonl', 'binary'], default=None)
+    p.add_argument('--processes', type=int, default=None, help='worker processes (default: one per CPU)')
+    p.add_argument('--chunk-size', type=int, default=1000)
+    p.set_defaults(func=verify)
+
+    p = commands.add_parser('export', help='export self-play positions as column files')
+    p.add_argument('directory')
+    p.add_argument('--games', type=int, default=1000)
+    p.add_argument('--stones', type=int, default=36)
+    p.add_argument('--pits', type=int, default=6)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--processes', type=int, default=None, help='worker processes (default: one per CPU)')
+    p.add_argument('--buffer-rows', type=int, default=1 << 16, help='rows to buffer before writing')
+    p.set_defaults(func=export)
+
+    p = commands.add_parser('tournament', help='rate players against each other')
+    p.add_argument('results', help='results file (.csv or .jsonl); an existing one is resumed')
+    p.add_argument('players', nargs='+', choices=['random', 'greedy', 'alphabeta', 'mcts'])
+    p.add_argument('--pairing', choices=['round-robin', 'swiss'], default='round-robin')
+    p.add_argument('--rounds', type=int, default=1)
+    p.add_argument('--time', type=float, default=0.1, help='search time per move, in seconds')
+    p.add_argument('--stones', type=int, default=36)
+    p.add_argument('--pits', type=int, default=6)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--processes', type=int, default=None, help='worker processes (default: one per CPU)')
+    p.set_defaults(func=tournament)
+
+    p = commands.add_parser('bench', help='benchmark the engine')
+    p.add_argument('--output', help='write results to this JSON file')
+    p.add_argument('--compare', metavar='BASELINE', help='flag slowdowns against this results file')
+    p.add_argument('--threshold', type=float, default=0.10, help='slowdown (as a fraction) to flag')
+    p.add_argument('--quick', action='store_true', help='fewer, shorter runs')
+    p.set_defaults(func=bench)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,313 @@
+# file: bao_compact.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''A count-only version of the bao (Kalah) engine.
+
+`bao_engine.Game` tracks the identity and position of every stone, which is
+what the Kivy front end needs. For simulation and search only the number of
+stones in each pit matters, so `CompactGame` keeps the whole board as one flat
+list of integers, laid out exactly like `Game.pits`:
+
+         0  1  2  3  4  5  6(T)
+  13(T) 12 11 10  9  8  7
+
+The rules (`sow`, `perform_captures`, `update_player`, `handle_endgame`) are
+the same as in `bao_engine.Game`, and a position can be converted to and from
+a full `Game` with `CompactGame.from_game()` and `CompactGame.to_game()`.
+'''
+
+from __future__ import print_function
+import random
+
+import bao_engine
+from bao_engine import sowing_cycle
+
+
+class CompactGame(object):
+    '''A bao game that only counts stones.
+    Invalid moves are rejected by returning False (nothing is printed),
+    since this engine is mostly driven by simulations and search.'''
+
+    __slots__ = ('n_pits', 'n_stones', 'board', 'targets', 'current_player',
+                 'game_over', 'captures_done', 'last_pit', 'move_list')
+
+    def __init__(self, n_stones=36, n_pits=6):
+        '''Create a (count-only) bao game.
+        * `n_pits` is the number of (non-target) pits per player
+        * `n_stones` is the number of stones (seeds) that the game starts with'''
+        self.n_pits = n_pits
+        self.n_stones = n_stones
+        self.board = [0] * (2 * n_pits + 2)
+        self.targets = {1: n_pits, 2: 2 * n_pits + 1}
+        self.current_player = 1
+        self.game_over = True
+        self.captures_done = True
+        self.last_pit = None
+        self.move_list = None
+
+    def __repr__(self):
+        '''Text representation of the game board'''
+        n = self.n_pits
+        s = '\t\t' + '\t'.join(str(c) for c in self.board[:n] + ['{} (T)'.format(self.board[n])])
+        s += '\n' + '\t'.join(str(self.board[i]) for i in range(2 * n + 1, n, -1))
+        return s + '\nNext: Player {} \tGame State: {}\n'.format(self.current_player, 'Game Over' if self.game_over else 'Playing')
+
+    def copy(self):
+        '''return an independent copy of this game'''
+        cg = CompactGame.__new__(CompactGame)
+        cg.n_pits = self.n_pits
+        cg.n_stones = self.n_stones
+        cg.board = self.board[:]
+        cg.targets = self.targets
+        cg.current_player = self.current_player
+        cg.game_over = self.game_over
+        cg.captures_done = self.captures_done
+        cg.last_pit = self.last_pit
+        cg.move_list = None
+        return cg
+
+    @classmethod
+    def from_game(cls, game):
+        '''Build a compact game from the position of a `bao_engine.Game`'''
+        cg = cls(n_stones=game.n_stones, n_pits=game.n_pits)
+        cg.board = [p.count_stones() for p in game.pits]
+        cg.current_player = game.current_player
+        cg.game_over = game.game_over
+        cg.captures_done = game.captures_done
+        cg.last_pit = game.last_pit
+        return cg
+
+    def to_game(self):
+        '''Build a `bao_engine.Game` holding this position.
+        Stones are numbered in pit order, and coloured by the owner of the pit
+        they are in, the same way `Game.initial_place` colours them.'''
+        game = bao_engine.Game(n_stones=self.n_stones, n_pits=self.n_pits)
+        stones = iter(game.stones)
+        for pit, count in zip(game.pits, self.board):
+            for i in range(count):
+                stone = next(stones)
+                pit.add(stone)
+                stone.color = '#6666af' if pit.player == 1 else '#75755e'
+        # `get_player` is a cycle that has already produced player 1
+        if self.current_player != game.current_player:
+            game.current_player = next(game.get_player)
+        game.game_over = self.game_over
+        game.captures_done = self.captures_done
+        game.last_pit = self.last_pit
+        return game
+
+    @property
+    def score(self):
+        '''returns a list containing the current score [p1_score, p2_score]'''
+        return [self.board[self.n_pits], self.board[2 * self.n_pits + 1]]
+
+    def initial_place(self):
+        '''Do the initial placement (sowing) of stones.
+        Place one in each non-target pit until all stones have been placed.
+        If the game is already initialized, do nothing.'''
+        if self.game_over == False:
+            return
+        n = self.n_pits
+        per_pit, extra = divmod(self.n_stones, 2 * n)
+        board = self.board
+        for i in range(2 * n + 2):
+            board[i] = per_pit
+        board[n] = 0
+        board[2 * n + 1] = 0
+        p = 0
+        while extra:
+            if p != n:
+                board[p] += 1
+                extra -= 1
+            p += 1
+        self.game_over = False
+
+    def legal_moves(self):
+        '''return a list of the pit ids the current player may sow from'''
+        board = self.board
+        start = 0 if self.current_player == 1 else self.n_pits + 1
+        return [p for p in range(start, start + self.n_pits) if board[p]]
+
+    def random_move(self, rng=random):
+        '''choose a (valid) random move for the active player'''
+        return rng.choice(self.legal_moves())
+
+    def moves_available(self):
+        '''Return True if there are stones in non-target pits for the current player'''
+        start = 0 if self.current_player == 1 else self.n_pits + 1
+        return any(self.board[start:start + self.n_pits])
+
+    def sow(self, pit_id):
+        '''Current player picks up the seeds in pit `pit_id` and sows them,
+        skipping the opponent's target.'''
+        n = self.n_pits
+        board = self.board
+        player = self.current_player
+        if (1 if pit_id <= n else 2) != player:
+            return False
+        if board[pit_id] == 0 or pit_id == n or pit_id == 2 * n + 1:
+            return False
+        if self.captures_done == False:
+            return False
+
+        self.captures_done = False
+
+        seeds = board[pit_id]
+        board[pit_id] = 0
+        # closed form (see `bao_engine.sowing_plan`), inlined as this is the hot path
+        (cycle, cycle_pos) = sowing_cycle(n, player)
+        n_cycle = len(cycle)
+        start = cycle_pos[pit_id] + 1
+        if seeds >= n_cycle:
+            full = seeds // n_cycle
+            for p in cycle:
+                board[p] += full
+        end = start + seeds % n_cycle
+        for p in cycle[start:end]:
+            board[p] += 1
+        if end > n_cycle:
+            for p in cycle[:end - n_cycle]:
+                board[p] += 1
+        self.last_pit = cycle[(start - 1 + seeds) % n_cycle]
+        return True
+
+    def perform_captures(self):
+        '''Perform captures. Can only be done after a sow.'''
+        if self.captures_done == True:
+            if self.last_pit is None:
+                return # nothing to do
+            else:
+                raise RuntimeError('last_pit is set but captures done')
+        if self.last_pit is None:
+            raise RuntimeError('captures needed, but last_pit not set')
+
+        n = self.n_pits
+        board = self.board
+        last = self.last_pit
+        if last != n and last != 2 * n + 1 and (1 if last <= n else 2) == self.current_player:
+            if board[last] == 1:
+                opp_p = 2 * n - last
+                if board[opp_p]:
+                    board[self.targets[self.current_player]] += board[opp_p] + 1
+                    board[opp_p] = 0
+                    board[last] = 0
+
+        self.captures_done = True
+
+    def update_player(self):
+        '''Switch players, unless the last stone landed in the current player's target'''
+        if self.last_pit is None:
+            raise RuntimeError('update_player called and last_pit is None')
+        if self.last_pit != self.targets[self.current_player]:
+            self.current_player = 3 - self.current_player
+        self.last_pit = None
+
+    def handle_endgame(self):
+        '''Check if there are any valid moves for the current player.
+        If not, move opponent's stones to their target pit and declare the game over
+        '''
+        n = self.n_pits
+        board = self.board
+        start = 0 if self.current_player == 1 else n + 1
+        if any(board[start:start + n]):
+            return
+        self.current_player = 3 - self.current_player
+        start = 0 if self.current_player == 1 else n + 1
+        board[start + n] += sum(board[start:start + n])
+        for p in range(start, start + n):
+            board[p] = 0
+        self.game_over = True
+
+    def play_round(self, pit_no):
+        '''Play a round of bao. Sow, starting at `pit_no`.
+        If the indicated move is invalid, return None.
+        Otherwise, return the game status, current player, and board.
+        '''
+        if not self.sow(pit_no):
+            return None
+        self.perform_captures()
+        self.update_player()
+        self.handle_endgame()
+        return (self.game_over, self.current_player, self.board)
+
+
+def random_game(cg=None, rng=random, tablebase=None):
+    '''Play a compact game of bao to completion by choosing (valid) moves at random.
+    If `cg` is passed, the game will be played at random from the supplied position.
+    `rng` may be any object with a `choice` method (e.g. a seeded `random.Random`).
+    If a `tablebase` (see `bao_tablebase`) is passed, play stops as soon as the
+    position is in the table, and the scores returned are the perfect-play result.
+    The moves played are stored in `move_list` of the returned game.'''
+    if cg is None:
+        cg = CompactGame()
+        cg.initial_place()
+    move_list = []
+    choice = rng.choice
+    while not cg.game_over:
+        if tablebase is not None:
+            scores = tablebase.final_scores(cg)
+            if scores is not None:
+                cg.move_list = move_list
+                return (cg, scores)
+        move = choice(cg.legal_moves())
+        move_list.append(move)
+        cg.sow(move)
+        cg.perform_captures()
+        cg.update_player()
+        cg.handle_endgame()
+    cg.move_list = move_list
+    return (cg, cg.score)
+
+
+def play_game(move_list, n_stones=36, n_pits=6):
+    '''Play a new compact game of bao with the specified move list.
+    Returns the game, and the score after all moves are completed.'''
+    cg = CompactGame(n_stones=n_stones, n_pits=n_pits)
+    cg.initial_place()
+    for move in move_list:
+        cg.play_round(move)
+    return (cg, cg.score)
+
+
+if __name__ == '__main__':
+    import json
+    import time
+
+    # Compact games must agree with the full engine on every move
+    for gno in range(50):
+        bg, score = bao_engine.random_game()
+        cg, cscore = play_game(bg.move_list)
+        if cscore != score or cg.board != CompactGame.from_game(bg).board:
+            raise RuntimeError('Compact engine disagrees on game {}: {} != {}'.format(bg.move_list, cscore, score))
+
+    # ...and round-trip through the full engine
+    for gno in range(50):
+        cg, score = random_game()
+        bg, bscore = bao_engine.play_game(cg.move_list)
+        bao_engine.check_game(bg, bscore)
+        if bscore != score or CompactGame.from_game(cg.to_game()).board != cg.board:
+            raise RuntimeError('Full engine disagrees on game {}: {} != {}'.format(cg.move_list, bscore, score))
+
+    with open('test_vectors.json', 'r') as fr:
+        data = fr.read()
+    decoder = json.JSONDecoder()
+    idx = 0
+    while idx < len(data):
+        tv, idx = decoder.raw_decode(data, idx)
+        for (ml, score) in tv:
+            cg, s = play_game(ml)
+            if s != score:
+                raise RuntimeError('New score {} != {}. for test moves {}'.format(s, score, ml))
+
+    # Self-play throughput
+    rates = []
+    for name, play in (('Game', bao_engine.random_game), ('CompactGame', random_game)):
+        moves = 0
+        start = time.time()
+        while time.time() - start < 1.0:
+            g, s = play()
+            moves += len(g.move_list)
+        rates.append(moves / (time.time() - start))
+        print('{}: {:.0f} moves/s'.format(name, rates[-1]))
+    print('Speedup: {:.1f}x'.format(rates[1] / rates[0]))
@@ -3,18 +3,34 @@
 # license:  MIT. See LICENSE for complete license text
 
 from __future__ import print_function
-from random import choice
+from random import choice, randrange
 from math import ceil
 from itertools import cycle
-from operator import sub
-import json
+from struct import Struct, pack as struct_pack, unpack_from as struct_unpack_from
+
+# Binary snapshots (see `Game.to_bytes`): a header, then the seed count of every pit
+# (one byte each, or two if there are more than 255 stones), then optionally the stones:
+# a palette (a count byte, then each colour as a length byte and ASCII text) and a
+# record per stone.
+SNAPSHOT_HEADER = Struct('<BBHh')    # n_pits, flags, n_stones, last_pit (-1 for None)
+SNAPSHOT_STONE = Struct('<BBB')      # pit (255 if not placed), position, colour index
+SNAPSHOT_PLAYER2 = 1
+SNAPSHOT_GAME_OVER = 2
+SNAPSHOT_CAPTURES_DONE = 4
+SNAPSHOT_STONES = 8
 
 
 class Pit():
     '''Represent a pit in a mankala (bao) style game.
     We assume locations are a grid overlaying the circular pit,
     so we flag some locations as unusable (the corners) by placing an 'X' there.
-    All other locations receive a list of stones'''
+    All other locations receive a list of stones.
+
+    To keep `add`, `pickup_stones` and `count_stones` cheap, the usable
+    locations are kept in `_slots`, partitioned so that the first `_n_free`
+    entries are the empty locations and the rest are occupied.
+    `_where[loc]` gives the index of location `loc` in `_slots`, and
+    `_count` is the number of stones in the pit.'''
 
     def __init__(self, id=-1, n=4, player=1, n_target_pos=48, target=False):
         '''Create a bao pit.
@@ -41,6 +57,12 @@ class Pit():
         self.loc[-n] = 'X'
         self.target = target
         self.player = player
+        self._slots = [i for (i, contents) in enumerate(self.loc) if contents != 'X']
+        self._where = [None] * len(self.loc)
+        for (i, loc) in enumerate(self._slots):
+            self._where[loc] = i
+        self._n_free = len(self._slots)
+        self._count = 0
 
     def __repr__(self):
         return '{}: {} {}'.format(self.id, self.count_stones(), ('(T)' if self.target else ''))
@@ -68,59 +90,103 @@ class Pit():
         Useful in conjunction with `random.choice()`
         if `reuse == True`, then a list of all non-'X' pits is returned
         '''
-        ret = []
-        for (i, contents) in enumerate(self.loc):
-            if reuse == True and (contents != 'X' or len(contents) == 0):
-                ret += [i]
-            elif reuse == False and len(contents) == 0:
-                ret += [i]
-        return ret
-
-    def add(self, stone, debug=False):
+        if reuse == True:
+            return sorted(self._slots)
+        return sorted(self._slots[:self._n_free])
+
+    def _occupy(self, loc):
+        '''mark the (currently empty) location `loc` as occupied'''
+        i = self._where[loc]
+        last = self._n_free - 1
+        other = self._slots[last]
+        self._slots[i] = other
+        self._where[other] = i
+        self._slots[last] = loc
+        self._where[loc] = last
+        self._n_free = last
+
+    def _release(self, loc):
+        '''mark the (now empty) location `loc` as free'''
+        i = self._where[loc]
+        first = self._n_free
+        other = self._slots[first]
+        self._slots[i] = other
+        self._where[other] = i
+        self._slots[first] = loc
+        self._where[loc] = first
+        self._n_free = first + 1
+
+    def add(self, stone, debug=False, position=None):
         '''Add the supplied stone to this pit.
-        Stone should be currently unallocated. Add will fail (return False) if stone is already positioned somewhere '''
+        Stone should be currently unallocated. Add will fail (return False) if stone is already positioned somewhere.
+        The stone is put in a random free location, unless a `position` is given.'''
         if stone.pit is not None:
-            raise RuntimeError, "Tried to add stone to pit {} that is already placed in pit {}".format(self.id, stone.pit)
+            raise RuntimeError("Tried to add stone to pit {} that is already placed in pit {}".format(self.id, stone.pit))
             return False
 
-        free = self.free_locations()
-        if (len(free)):
-            loc = choice(free)
+        if position is not None:
+            loc = position
+            if self._where[loc] < self._n_free:
+                self._occupy(loc)
+        elif self._n_free:
+            loc = self._slots[randrange(self._n_free)]
+            self._occupy(loc)
         else:
             # no locations free
-            free = self.free_locations(reuse=True)
-            loc = choice(free)
+            loc = choice(self._slots)
 
         stone.position = loc
         stone.pit = self.id
         self.loc[loc].append(stone)
+        self._count += 1
         return True
 
+    def remove(self, stone):
+        '''remove a single stone from this pit (its location becomes None)'''
+        if (stone.pit != self.id):
+            raise RuntimeError('Stone {} has pit_id {}, but being removed from {}'.format(stone.id, stone.pit, self.id))
+        stones = self.loc[stone.position]
+        stones.remove(stone)
+        if not stones:
+            self._release(stone.position)
+        self._count -= 1
+        stone.pit = None
+        stone.position = None
+
+    def stones(self):
+        '''return a list of the stones in this pit'''
+        ret = []
+        for i in self._slots[self._n_free:]:
+            ret.extend(self.loc[i])
+        return ret
+
     def pickup_stones(self, debug=False):
-        '''pick-up all stones in this pit (i.e. their location becomes None'''
-        for i, stone_l in enumerate(self.loc):
-            stones = stone_l[:] # make a copy: we need to mutate the list
-            if (stones != 'X') and (len(stones) > 0):
-                for stone in stones:
-                    if (stone.pit != self.id):
-                        raise RuntimeError, 'Stone {} has pit_id {}, but being removed from {}'.format(stone.id, stone.pit, self.id)
-                    if debug:
-                        print('Removing stone {} from pit {}, loc {}'.format(stone.id, self.id, stone.position))
-                    stone.pit = None
-                    stone.position = None
-                    self.loc[i].remove(stone)
+        '''pick-up all stones in this pit (i.e. their location becomes None).
+        Returns a list of the stones that were picked up'''
+        lifted = []
+        for i in self._slots[self._n_free:]:
+            stones = self.loc[i]
+            for stone in stones:
+                if (stone.pit != self.id):
+                    raise RuntimeError('Stone {} has pit_id {}, but being removed from {}'.format(stone.id, stone.pit, self.id))
+                if debug:
+                    print('Removing stone {} from pit {}, loc {}'.format(stone.id, self.id, stone.position))
+                stone.pit = None
+                stone.position = None
+            lifted.extend(stones)
+            del stones[:]
+        # occupied locations sit after the free ones, so they are now all free
+        self._n_free = len(self._slots)
+        self._count = 0
+        return lifted
 
     def count_stones(self, debug=False):
         '''count the number of stones in a pit'''
-        c = 0
-        for i,stones in enumerate(self.loc):
-            if debug:
-                print('{}:{} '.format(i,stones),end='')
-            if (stones != 'X') and (len(stones) > 0):
-                c = c + len(stones)
         if debug:
+            for i,stones in enumerate(self.loc):
+                print('{}:{} '.format(i,stones),end='')
             print()
-        return c
+        return self._count
 
 
 class Stone():
@@ -161,9 +227,16 @@ class Game():
         self.captures_done = True
         self.last_pit = None
 
+        # State variables for make_move / unmake_move.
+        # While a move is being made, `_journal` records every stone lifted,
+        # as (kind, stone, pit_id, position), where kind is one of
+        # 'sow', 'capture' or 'endgame'
+        self._journal = None
+        self._undo = []
+
         #self.get_player = self.toggle_player()
         self.get_player = cycle([1,2])
-        self.current_player = self.get_player.next()
+        self.current_player = next(self.get_player)
         # remember player targets
         for p in self.pits:
             if p.target:
@@ -201,24 +274,19 @@ class Game():
         if self.game_over == False:
             return
 
-        # pick everything up
+        # pick everything up. After this, every stone is in hand.
         for p in self.pits:
             p.pickup_stones()
 
-        unplaced = (stone for stone in self.stones if stone.pit is None)
         p = 0
-        try:
-            while True:
-                stone = unplaced.next()
-                if self.pits[p].target == True:
-                    p = (p + 1) % len(self.pits)
-                if debug:
-                    print('Placing stone {} in pit {}'.format(stone.id, self.pits[p].id))
-                self.pits[p].add(stone)
-                stone.color = '#6666af' if self.pits[p].player == 1 else '#75755e'
+        for stone in self.stones:
+            if self.pits[p].target == True:
                 p = (p + 1) % len(self.pits)
-        except StopIteration:
-            pass
+            if debug:
+                print('Placing stone {} in pit {}'.format(stone.id, self.pits[p].id))
+            self.pits[p].add(stone)
+            stone.color = '#6666af' if self.pits[p].player == 1 else '#75755e'
+            p = (p + 1) % len(self.pits)
         self.game_over = False
 
     def is_player_target(self, pit_id):
@@ -239,11 +307,23 @@ class Game():
             yield 1
             yield 2
 
+    def legal_moves(self):
+        '''generate the ids of the pits the current player may sow from'''
+        for p in self.pits:
+            if p.player == self.current_player and p.target != True and p.count_stones():
+                yield p.id
+
     def random_move(self):
         '''choose a (valid) random move for the active player'''
-        pits_remaining = [p for p in self.pits if p.player == self.current_player and p.target != True and p.count_stones()]
-        move = choice(pits_remaining)
-        return move.id
+        return choice(list(self.legal_moves()))
+
+    def _lift(self, pit_id, kind):
+        '''pick up all stones in pit `pit_id`, returning them.
+        If a move is being made (see `make_move`), record where they came from.'''
+        pit = self.pits[pit_id]
+        if self._journal is not None:
+            self._journal.extend((kind, stone, pit_id, stone.position) for stone in pit.stones())
+        return pit.pickup_stones()
 
     def perform_captures(self):
         '''Perform captures. Can only be done after a sow.
@@ -254,10 +334,10 @@ class Game():
             if self.last_pit is None:
                 return # nothing to do
             else:
-                raise RuntimeError, 'last_pit is set but captures done'
+                raise RuntimeError('last_pit is set but captures done')
 
         if self.last_pit is None:
-                raise RuntimeError, 'captures needed, but last_pit not set'
+                raise RuntimeError('captures needed, but last_pit not set')
 
         if self.pits[self.last_pit].player == self.current_player: # my pit
             if self.pits[self.last_pit].count_stones() == 1: # potential capture
@@ -271,16 +351,12 @@ class Game():
                 opp_p = (len(self.pits) - 2) - self.last_pit
                 if self.pits[opp_p].count_stones():
                     # capture occurs
-                    self.pits[opp_p].pickup_stones()
-                    self.pits[self.last_pit].pickup_stones()
+                    captured = self._lift(opp_p, 'capture')
+                    captured += self._lift(self.last_pit, 'capture')
 
-                    captured = (stone for stone in self.stones if stone.pit is None)
-                    try:
-                        while True:
-                            stone = captured.next()
-                            self.pits[self.targets[self.current_player]].add(stone)
-                    except StopIteration:
-                        pass
+                    target = self.pits[self.targets[self.current_player]]
+                    for stone in captured:
+                        target.add(stone)
 
         self.captures_done = True
 
@@ -297,18 +373,15 @@ class Game():
         if (self.moves_available()):
             return
 
-        self.current_player = self.get_player.next()
+        self.current_player = next(self.get_player)
 
         pits_remaining = [p for p in self.pits if p.player == self.current_player and p.target != True and p.count_stones()]
+        endgame_captures = []
         for p in pits_remaining:
-            p.pickup_stones()
-        endgame_captures = (stone for stone in self.stones if stone.pit is None)
-        try:
-            while True:
-                stone = endgame_captures.next()
-                self.pits[self.targets[self.current_player]].add(stone)
-        except StopIteration:
-            pass
+            endgame_captures += self._lift(p.id, 'endgame')
+        target = self.pits[self.targets[self.current_player]]
+        for stone in endgame_captures:
+            target.add(stone)
 
         self.game_over = True
 
@@ -316,9 +389,9 @@ class Game():
         if debug:
             print('Current player: {}'.format(self.current_player))
         if self.last_pit is None:
-            raise RuntimeError, 'update_player called and last_pit is None'
+            raise RuntimeError('update_player called and last_pit is None')
         if not self.is_player_target(self.last_pit):
-            self.current_player = self.get_player.next()
+            self.current_player = next(self.get_player)
         if debug:
             print('Toggle player? {}'.format(not self.is_player_target(self.last_pit)))
             print('New player? {}'.format(self.current_player))
@@ -346,52 +419,254 @@ class Game():
         self.captures_done = False
         self.next_player = None
 
-        # Perform the sowing
-        self.pits[pit_id].pickup_stones()
-        unplaced = (stone for stone in self.stones if stone.pit is None)
-        p = (pit_id + 1) % len(self.pits)
-        try:
-            while True:
-                stone = unplaced.next()
-                if self.is_opponent_target(p):
-                    p = (p + 1) % len(self.pits)
+        # Perform the sowing. Stone k of the hand lands k+1 steps along the
+        # player's sowing cycle, so the pit j+1 steps along gets stones j, j+L, j+2L...
+        hand = self._lift(pit_id, 'sow')
+        (cycle, cycle_pos) = sowing_cycle(self.n_pits, self.current_player)
+        ring = cycle + cycle
+        n_cycle = len(cycle)
+        start = cycle_pos[pit_id] + 1
+        for j in range(min(len(hand), n_cycle)):
+            pit = self.pits[ring[start + j]]
+            for stone in hand[j::n_cycle]:
                 if debug:
-                    print('Sowing stone {} in pit {}'.format(stone.id, self.pits[p].id))
-                self.pits[p].add(stone)
-                last_p = p
-                p = (p + 1) % len(self.pits)
-        except StopIteration:
-            pass
+                    print('Sowing stone {} in pit {}'.format(stone.id, pit.id))
+                pit.add(stone)
+        last_p = cycle[(start - 1 + len(hand)) % n_cycle]
 
         self.last_pit = last_p
 
         return True
 
-    def play_round(self, pit_no, direction='ccw', debug=False):
+    def play_round(self, pit_no, direction='ccw', debug=False, events=False):
         '''Play a round of bao. Sow, starting at `pit_no`
         * `direction` is currently ignored.
         If the indicated move is invalid, return None.
         Otherwise, return the game status, current player, and stones list.
+        If `events` is True, the stones list is replaced by a list of the stone
+        moves made during the round (see `move_events`).
         '''
-        success = self.sow(pit_no, direction, debug)
+        if events:
+            self._journal = []
+        try:
+            success = self.sow(pit_no, direction, debug)
 
-        if not success: # not a valid move
-            return None
+            if not success: # not a valid move
+                return None
 
-        self.perform_captures()
+            self.perform_captures()
 
-        self.update_player()
+            self.update_player()
 
-        self.handle_endgame()
+            self.handle_endgame()
+        finally:
+            journal = self._journal
+            self._journal = None
 
+        if events:
+            return (self.game_over, self.current_player, self.move_events(journal))
         return (self.game_over, self.current_player, self.stones)
 
+    def move_events(self, journal):
+        '''Turn a journal of lifted stones (see `_journal`) into a list of moves:
+        (kind, stone_id, from_pit, from_position, to_pit, to_position)
+        where `kind` is 'sow', 'capture' or 'endgame'.
+        A stone that is sown and then captured appears twice, in that order.
+        '''
+        events = []
+        latest = {}
+        for (kind, stone, pit_id, position) in journal:
+            if stone.id in latest:
+                # it was lifted from where its previous move left it
+                events[latest[stone.id]][4:] = [pit_id, position]
+            latest[stone.id] = len(events)
+            events.append([kind, stone.id, pit_id, position, None, None])
+        for i in latest.values():
+            stone = self.stones[events[i][1]]
+            events[i][4:] = [stone.pit, stone.position]
+        return [tuple(e) for e in events]
+
+    def make_move(self, pit_id):
+        '''Play a round of bao from `pit_id` so that it can later be taken back with `unmake_move`.
+        Returns False (and records nothing) if the move is invalid.
+        The undo record holds the stones lifted during the move (see `_journal`),
+        the number of times the player cycle was advanced, and the previous `game_over`.'''
+        game_over = self.game_over
+        journal = self._journal = []
+        try:
+            if not self.sow(pit_id):
+                return False
+            self.perform_captures()
+            player = self.current_player
+            self.update_player()
+            toggles = int(self.current_player != player)
+            player = self.current_player
+            self.handle_endgame()
+            toggles += int(self.current_player != player)
+        finally:
+            self._journal = None
+        self._undo.append((journal, toggles, game_over))
+        return True
 
-
-def random_game(bg=None, debug=False):
+    def unmake_move(self):
+        '''Take back the last move made with `make_move`'''
+        if not self._undo:
+            raise RuntimeError('unmake_move called with no moves to take back')
+        (journal, toggles, game_over) = self._undo.pop()
+        for (kind, stone, pit_id, position) in reversed(journal):
+            self.pits[stone.pit].remove(stone)
+            self.pits[pit_id].add(stone, position=position)
+        # `get_player` cycles between two players, so advancing it as many
+        # times again brings both it and `current_player` back
+        for i in range(toggles):
+            self.current_player = next(self.get_player)
+        self.game_over = game_over
+
+    def to_bytes(self, stones=False):
+        '''Pack the position into a compact binary snapshot: the pit counts,
+        current player, `game_over`, `captures_done` and `last_pit`.
+        With `stones=True`, the pit, position and colour of every stone are included too.
+        Without stones, a snapshot is `snapshot_size(n_stones, n_pits)` bytes.'''
+        flags = ((SNAPSHOT_PLAYER2 if self.current_player == 2 else 0) |
+                 (SNAPSHOT_GAME_OVER if self.game_over else 0) |
+                 (SNAPSHOT_CAPTURES_DONE if self.captures_done else 0) |
+                 (SNAPSHOT_STONES if stones else 0))
+        last_pit = -1 if self.last_pit is None else self.last_pit
+        counts = _counts_struct(self.n_stones, self.n_pits)
+        data = (SNAPSHOT_HEADER.pack(self.n_pits, flags, self.n_stones, last_pit) +
+                counts.pack(*[p.count_stones() for p in self.pits]))
+        if stones:
+            palette = []
+            for s in self.stones:
+                if s.color not in palette:
+                    palette.append(s.color)
+            if len(palette) > 255:
+                raise ValueError('A snapshot can hold at most 255 stone colours')
+            data += struct_pack('<B', len(palette))
+            for color in palette:
+                text = color.encode('ascii')
+                if len(text) > 255:
+                    raise ValueError('Stone colour {!r} is too long for a snapshot'.format(color))
+                data += struct_pack('<B', len(text)) + text
+            data += b''.join(SNAPSHOT_STONE.pack(255 if s.pit is None else s.pit,
+                                                0 if s.position is None else s.position,
+                                                palette.index(s.color)) for s in self.stones)
+        return data
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        '''Rebuild a game from a snapshot made by `to_bytes` (a string, or any buffer,
+        starting at `offset`). If the snapshot has no stones, they are put at random
+        positions in their pits.'''
+        (n_pits, flags, n_stones, last_pit) = SNAPSHOT_HEADER.unpack_from(data, offset)
+        offset += SNAPSHOT_HEADER.size
+        counts = _counts_struct(n_stones, n_pits)
+        pit_counts = counts.unpack_from(data, offset)
+        offset += counts.size
+
+        game = cls(n_stones=n_stones, n_pits=n_pits)
+        game.current_player = 2 if flags & SNAPSHOT_PLAYER2 else 1
+        # `get_player` must yield the other player next
+        game.get_player = cycle([3 - game.current_player, game.current_player])
+        game.game_over = bool(flags & SNAPSHOT_GAME_OVER)
+        game.captures_done = bool(flags & SNAPSHOT_CAPTURES_DONE)
+        game.last_pit = None if last_pit < 0 else last_pit
+
+        if flags & SNAPSHOT_STONES:
+            (n_colors,) = struct_unpack_from('<B', data, offset)
+            offset += 1
+            palette = []
+            for i in range(n_colors):
+                (length,) = struct_unpack_from('<B', data, offset)
+                palette.append(bytes(data[offset + 1:offset + 1 + length]).decode('ascii'))
+                offset += 1 + length
+            for stone in game.stones:
+                (pit_id, position, color) = SNAPSHOT_STONE.unpack_from(data, offset)
+                offset += SNAPSHOT_STONE.size
+                stone.color = str(palette[color])
+                if pit_id != 255:
+                    game.pits[pit_id].add(stone, position=position)
+            if [p.count_stones() for p in game.pits] != list(pit_counts):
+                raise RuntimeError('Snapshot stone positions do not match its pit counts')
+        else:
+            stones = iter(game.stones)
+            for (pit, count) in zip(game.pits, pit_counts):
+                for i in range(count):
+                    pit.add(next(stones))
+        return game
+
+
+_sowing_cycles = {}
+
+def sowing_cycle(n_pits, player):
+    '''return `(cycle, cycle_pos)` for `player` on a board of `n_pits`.
+    `cycle` lists, from pit 0, the pits `player` sows into (every pit but the
+    opponent's target) and `cycle_pos[pit]` is the index of `pit` in `cycle`
+    (None for the opponent's target). The lists are cached; do not modify them.'''
+    try:
+        return _sowing_cycles[(n_pits, player)]
+    except KeyError:
+        pass
+    skip = 2 * n_pits + 1 if player == 1 else n_pits
+    cycle = [p for p in range(2 * n_pits + 2) if p != skip]
+    cycle_pos = [None] * (2 * n_pits + 2)
+    for (i, p) in enumerate(cycle):
+        cycle_pos[p] = i
+    _sowing_cycles[(n_pits, player)] = (cycle, cycle_pos)
+    return (cycle, cycle_pos)
+
+def sowing_plan(n_pits, player, pit_id, seeds):
+    '''Where `seeds` seeds sown by `player` from `pit_id` land, in O(pits):
+    return `(full, ahead, last_pit)`, where every pit in the player's sowing cycle
+    gets `full` seeds, the pits in `ahead` get one more, and the last seed lands in `last_pit`.'''
+    (cycle, cycle_pos) = sowing_cycle(n_pits, player)
+    n_cycle = len(cycle)
+    (full, extra) = divmod(seeds, n_cycle)
+    start = cycle_pos[pit_id] + 1
+    ring = cycle + cycle if start + extra > n_cycle else cycle
+    return (full, ring[start:start + extra], cycle[(start - 1 + seeds) % n_cycle])
+
+def _counts_struct(n_stones, n_pits):
+    return Struct('<{}{}'.format(2 * n_pits + 2, 'B' if n_stones < 256 else 'H'))
+
+def snapshot_size(n_stones=36, n_pits=6):
+    '''size in bytes of a `Game.to_bytes()` snapshot (without stones)'''
+    return SNAPSHOT_HEADER.size + _counts_struct(n_stones, n_pits).size
+
+def pack_games(games):
+    '''pack snapshots (without stones) of `games` into one bytearray of fixed-size records'''
+    buf = bytearray()
+    for game in games:
+        buf += game.to_bytes()
+    return buf
+
+def unpack_snapshots(buf):
+    '''generate the raw fields of the snapshots in a buffer (a bytearray, memoryview,
+    mmap, ...) made by `pack_games`, without building any `Game`s:
+    `(offset, n_stones, n_pits, current_player, game_over, captures_done, last_pit, counts)`,
+    where `last_pit` is None if unset and `counts` is a tuple of pit counts'''
+    offset = 0
+    while offset < len(buf):
+        (n_pits, flags, n_stones, last_pit) = SNAPSHOT_HEADER.unpack_from(buf, offset)
+        counts = _counts_struct(n_stones, n_pits)
+        yield (offset, n_stones, n_pits, 2 if flags & SNAPSHOT_PLAYER2 else 1,
+               bool(flags & SNAPSHOT_GAME_OVER), bool(flags & SNAPSHOT_CAPTURES_DONE),
+               None if last_pit < 0 else last_pit,
+               counts.unpack_from(buf, offset + SNAPSHOT_HEADER.size))
+        offset += SNAPSHOT_HEADER.size + counts.size
+
+def unpack_games(buf):
+    '''generate the games in a buffer made by `pack_games` (see `unpack_snapshots`)'''
+    for fields in unpack_snapshots(buf):
+        yield Game.from_bytes(buf, fields[0])
+
+
+def random_game(bg=None, debug=False, tablebase=None):
     '''Play a game of bao to completion by choosing (valid) moves at random.
     If `bao` is passed, the game will be played at random from the supplied position.
     `debug = True` makes for more verbose output (e.g. prints the board after each move)
+    If a `tablebase` (see `bao_tablebase`) is passed, play stops as soon as the position
+    is in the table, and the scores returned are the perfect-play result.
     '''
     move_list = []
     if bg is None:
@@ -407,6 +682,11 @@ def random_game(bg=None, debug=False):
         print ('Move {}: Player {} sows {}'.format(mno, player, move))
     (done, player, stones) = bg.play_round(move)
     while not done:
+        if tablebase is not None:
+            scores = tablebase.final_scores(bg)
+            if scores is not None:
+                bg.move_list = move_list
+                return (bg, scores)
         if debug:
             print(bg)
         move = bg.random_move()
@@ -417,7 +697,7 @@ def random_game(bg=None, debug=False):
         try:
             (done, player, stones) = bg.play_round(move)
         except:
-            raise RuntimeError, "Error on game: {}".format(move_list)
+            raise RuntimeError("Error on game: {}".format(move_list))
 
     if debug:
         print(bg)
@@ -440,7 +720,7 @@ def check_game(bao_game, scores):
 
         # score should add to number of stones
         if sum(scores) != len(bao_game.stones):
-            raise RuntimeError, "Final score {} doesn't sum to {}".format(scores, len(bao_game.stones))
+            raise RuntimeError("Final score {} doesn't sum to {}".format(scores, len(bao_game.stones)))
 
 
 def play_game(move_list, debug=False):
@@ -465,29 +745,28 @@ def play_game(move_list, debug=False):
         scores.append(pscore)
     return (bg, scores)
 
-def generate_test_vectors(self, n=50, filename='test_vectors.json'):
-    test_vectors = []
-    for i in range(n):
-        bg = bao.bao_game()
-        bg.initial_place()
-        bao.random_game(bg=bg)
-        test_vectors.append((bg.move_list, bg.score))
-
-    with open(filename, 'w') as fp:
-        json.dump(test_vectors, fp)
+def generate_test_vectors(n=50, filename='test_vectors.json', format=None):
+    '''write `n` random games as test vectors.
+    `format` is one of 'json', 'jsonl' or 'binary' (see `bao_vectors`).
+    By default it is guessed from the filename.'''
+    from bao_vectors import VectorWriter
+    with VectorWriter(filename, format) as w:
+        for i in range(n):
+            bg, score = random_game()
+            w.write(bg.move_list, score)
 
 
-def verify_test_vectors(self, filename='test_vectors.json'):
+def verify_test_vectors(filename='test_vectors.json'):
     '''evaluate test vectors, consisting of tuples:
        [move list], [p1_score, p2_score]
-    Basically, run the supplied moves, and ensure the new score matches the old
+    Basically, run the supplied moves, and ensure the new score matches the old.
+    See `bao_vectors.verify_stream` to verify large files on several processes.
     '''
-    with open('test_vectors.json', 'r') as fr:
-        tv = json.load(fr)
-        for (ml, score) in tv:
-            b,s = play_game(ml)
-            if sum(tuple(map(sub, score, s))) != 0:
-                raise RuntimeError, 'New score {} != {}. for test moves {}'.format(s, score, ml)
+    from bao_vectors import read_vectors
+    for (ml, score) in read_vectors(filename):
+        b,s = play_game(ml)
+        if s != list(score):
+            raise RuntimeError('New score {} != {}. for test moves {}'.format(s, score, ml))
 
 
 if __name__ == '__main__':
@@ -524,12 +803,93 @@ if __name__ == '__main__':
         p.pretty_print()
         print([s for s in ss if s.pit is not None])
 
+    # make_move / unmake_move must restore the position exactly
+
+    for gno in range(20):
+        bg = Game()
+        bg.initial_place()
+        positions = []
+        while not bg.game_over:
+            positions.append(([(s.pit, s.position) for s in bg.stones], bg.current_player))
+            bg.make_move(bg.random_move())
+        while positions:
+            bg.unmake_move()
+            if positions.pop() != ([(s.pit, s.position) for s in bg.stones], bg.current_player):
+                raise RuntimeError('unmake_move did not restore the position')
+
+    # play_round's move events must take each stone from where it was to where it is
+
+    for gno in range(20):
+        bg = Game()
+        bg.initial_place()
+        while not bg.game_over:
+            where = dict((s.id, (s.pit, s.position)) for s in bg.stones)
+            done, player, events = bg.play_round(bg.random_move(), events=True)
+            for (kind, stone_id, from_pit, from_pos, to_pit, to_pos) in events:
+                if where[stone_id] != (from_pit, from_pos):
+                    raise RuntimeError('Move event {} does not start where the stone was'.format(events))
+                where[stone_id] = (to_pit, to_pos)
+            if where != dict((s.id, (s.pit, s.position)) for s in bg.stones):
+                raise RuntimeError('Move events {} do not match the board'.format(events))
+
+    # the closed-form sowing plan must match sowing seed by seed
+    for n_pits in (3, 6, 12):
+        for player in (1, 2):
+            skip = 2 * n_pits + 1 if player == 1 else n_pits
+            for pit_id in range(2 * n_pits + 2):
+                if pit_id == skip:
+                    continue
+                for seeds in range(1, 6 * n_pits):
+                    board = [0] * (2 * n_pits + 2)
+                    p = pit_id
+                    for i in range(seeds):
+                        p = (p + 1) % len(board)
+                        if p == skip:
+                            p = (p + 1) % len(board)
+                        board[p] += 1
+                    (full, ahead, last_pit) = sowing_plan(n_pits, player, pit_id, seeds)
+                    plan = [0 if q == skip else full + ahead.count(q) for q in range(len(board))]
+                    if (plan, last_pit) != (board, p):
+                        raise RuntimeError('sowing_plan({}, {}, {}, {}) is wrong'.format(n_pits, player, pit_id, seeds))
+
+    # snapshots must round-trip exactly, and be small without stones
+    for gno in range(20):
+        bg = Game()
+        bg.initial_place()
+        while not bg.game_over:
+            full = bg.to_bytes(stones=True)
+            if Game.from_bytes(full).to_bytes(stones=True) != full:
+                raise RuntimeError('Snapshot with stones did not round-trip')
+            copy = Game.from_bytes(bg.to_bytes())
+            if copy.to_bytes() != bg.to_bytes():
+                raise RuntimeError('Snapshot did not round-trip')
+            move = bg.random_move()
+            copy.play_round(move)
+            bg.play_round(move)
+            if copy.to_bytes() != bg.to_bytes():
+                raise RuntimeError('Restored game plays differently')
+    for (n_stones, n_pits) in [(36, 6), (480, 12)]:
+        if snapshot_size(n_stones, n_pits) >= 64:
+            raise RuntimeError('Snapshot of a {}/{} game is {} bytes'.format(n_stones, n_pits, snapshot_size(n_stones, n_pits)))
+    games = [Game() for i in range(10)]
+    for bg in games:
+        bg.initial_place()
+        random_game(bg)
+    buf = pack_games(games)
+    if [g.score for g in unpack_games(memoryview(buf))] != [g.score for g in games]:
+        raise RuntimeError('Packed games did not unpack')
+    fields = [(f[3:7], list(f[7])) for f in unpack_snapshots(memoryview(buf))]
+    if fields != [((g.current_player, g.game_over, g.captures_done, g.last_pit),
+                   [p.count_stones() for p in g.pits]) for g in games]:
+        raise RuntimeError('Packed snapshots did not unpack')
+
+    # stone colours of any length survive a snapshot
+    bg = Game()
+    bg.initial_place()
+    for (stone, color) in zip(bg.stones, ['#fff', 'red', '#00ff00cc']):
+        stone.color = color
+    if Game.from_bytes(bg.to_bytes(stones=True)).to_bytes(stones=True) != bg.to_bytes(stones=True):
+        raise RuntimeError('Snapshot colours did not round-trip')
+
     # known test vectors
-    import json
-    from kivy.vector import Vector
-    with open('testvectors.json', 'r') as fr:
-        tv = json.load(fr)
-        for (ml, score) in tv:
-            b,s = play_game(ml)
-            if sum(Vector(score) - s) != 0:
-                raise RuntimeError, 'New score {} != {}. for test moves {}'.format(s, score, ml)
+    verify_test_vectors('test_vectors.json')
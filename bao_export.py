@@ -0,0 +1,247 @@
+# file: bao_export.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Export self-play positions as column files, for fitting evaluation functions.
+
+Every ply of every game becomes one row. The columns are:
+
+* `board`: the pit counts before the move (`2*n_pits+2` uint16, laid out like `Game.pits`)
+* `player`: the player to move (uint8)
+* `move`: the pit sown (uint8)
+* `ply`: the ply number within the game (uint16)
+* `game`: the game number (uint32)
+* `result`: the final score difference, player 1 minus player 2 (int16)
+
+Each column is a raw, append-only file of fixed-size native-endian rows
+(`board.bin`, `player.bin`, ...), described by `columns.json`, which also holds
+the number of complete rows. `open_columns` maps them with `np.memmap`, so
+reading copies nothing. Rows past the recorded count (left by an interrupted
+run) are cut off when the export is next appended to.
+
+Games are played by a pool of workers (seeded like `bao_rollout`, by game
+number, so appending never repeats a game), a chunk of games at a time, and the writer buffers at most
+`buffer_rows` rows before writing them out, so memory stays bounded however
+many rows are produced.
+'''
+
+from __future__ import print_function
+from array import array
+import json
+import os
+import random
+import sys
+
+from bao_compact import CompactGame
+from bao_rollout import game_seed, imap_bounded
+
+META = 'columns.json'
+
+# column: (array typecode, numpy dtype without byte order)
+COLUMNS = [
+    ('board', 'H', 'u2'),
+    ('player', 'B', 'u1'),
+    ('move', 'B', 'u1'),
+    ('ply', 'H', 'u2'),
+    ('game', 'I', 'u4'),
+    ('result', 'h', 'i2'),
+]
+
+
+def export_chunk(task):
+    '''play games `start` to `start+count-1` of a run and return their rows,
+    as a dictionary of arrays (one per column).
+    `task` is a tuple `(master_seed, start, count, first_game, n_stones, n_pits)`;
+    games are numbered (and seeded) from `first_game + start`, so appending to
+    an export with the same `master_seed` plays new games.'''
+    (master_seed, start, count, first_game, n_stones, n_pits) = task
+    cols = dict((name, array(code)) for (name, code, dtype) in COLUMNS)
+    for index in range(start, start + count):
+        rng = random.Random(game_seed(master_seed, first_game + index))
+        cg = CompactGame(n_stones=n_stones, n_pits=n_pits)
+        cg.initial_place()
+        ply = 0
+        while not cg.game_over:
+            move = rng.choice(cg.legal_moves())
+            cols['board'].extend(cg.board)
+            cols['player'].append(cg.current_player)
+            cols['move'].append(move)
+            cols['ply'].append(ply)
+            cg.play_round(move)
+            ply += 1
+        score = cg.score
+        cols['game'].extend([first_game + index] * ply)
+        cols['result'].extend([score[0] - score[1]] * ply)
+    return cols
+
+
+class ColumnWriter(object):
+    '''Appends rows to the column files in `directory`, creating them if needed.
+    At most `buffer_rows` rows are held in memory; `columns.json` is updated
+    every time they are written out. Use as a context manager, or call `close`.'''
+
+    def __init__(self, directory, n_stones=36, n_pits=6, buffer_rows=1 << 16):
+        self.directory = directory
+        self.buffer_rows = buffer_rows
+        width = 2 * n_pits + 2
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        meta_file = os.path.join(directory, META)
+        if os.path.exists(meta_file):
+            with open(meta_file) as fp:
+                self.meta = json.load(fp)
+            if (self.meta['n_stones'], self.meta['n_pits']) != (n_stones, n_pits):
+                raise RuntimeError('{} holds {}/{} games, not {}/{}'.format(
+                    directory, self.meta['n_stones'], self.meta['n_pits'], n_stones, n_pits))
+        else:
+            order = '<' if sys.byteorder == 'little' else '>'
+            self.meta = {
+                'rows': 0, 'games': 0, 'n_stones': n_stones, 'n_pits': n_pits,
+                'columns': dict((name, {'file': name + '.bin', 'dtype': order + dtype,
+                                        'width': width if name == 'board' else 1})
+                                for (name, code, dtype) in COLUMNS),
+            }
+        self.files = {}
+        for (name, code, dtype) in COLUMNS:
+            col = self.meta['columns'][name]
+            fp = open(os.path.join(directory, col['file']), 'ab')
+            # drop anything written after the last complete flush
+            fp.truncate(self.meta['rows'] * col['width'] * array(code).itemsize)
+            self.files[name] = fp
+        self.buffer = dict((name, array(code)) for (name, code, dtype) in COLUMNS)
+        self.buffered = 0
+        self.games = 0
+
+    @property
+    def rows(self):
+        return self.meta['rows'] + self.buffered
+
+    def write(self, cols):
+        '''append rows, given as a dictionary of arrays (see `export_chunk`)'''
+        for (name, code, dtype) in COLUMNS:
+            self.buffer[name].extend(cols[name])
+        self.buffered += len(cols['player'])
+        self.games += len(set(cols['game']))
+        if self.buffered >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        '''write out the buffered rows, then record them in `columns.json`'''
+        for (name, code, dtype) in COLUMNS:
+            self.buffer[name].tofile(self.files[name])
+            self.files[name].flush()
+            self.buffer[name] = array(code)
+        self.meta['rows'] += self.buffered
+        self.meta['games'] += self.games
+        self.buffered = 0
+        self.games = 0
+        tmp = os.path.join(self.directory, META + '.tmp')
+        with open(tmp, 'w') as fp:
+            json.dump(self.meta, fp, indent=2, sort_keys=True)
+        os.rename(tmp, os.path.join(self.directory, META))
+
+    def close(self):
+        self.flush()
+        for fp in self.files.values():
+            fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export(directory, n_games, master_seed=0, processes=None, chunk_size=200,
+           n_stones=36, n_pits=6, buffer_rows=1 << 16, progress=None):
+    '''Play `n_games` random games on `processes` workers and append every ply to
+    the column files in `directory`. Returns the total number of rows.
+    If given, `progress(games, rows)` is called after each chunk.'''
+    with ColumnWriter(directory, n_stones, n_pits, buffer_rows) as writer:
+        first_game = writer.meta['games']
+        tasks = ((master_seed, start, min(chunk_size, n_games - start), first_game, n_stones, n_pits)
+                 for start in range(0, n_games, chunk_size))
+        done = 0
+        for cols in imap_bounded(export_chunk, tasks, processes):
+            writer.write(cols)
+            done += len(set(cols['game']))
+            if progress is not None:
+                progress(done, writer.rows)
+        return writer.rows
+
+
+def open_columns(directory):
+    '''map the column files in `directory` read-only with `np.memmap`.
+    Returns a dictionary of arrays: `board` is `(rows, 2*n_pits+2)`, the others `(rows,)`.'''
+    import numpy as np
+    with open(os.path.join(directory, META)) as fp:
+        meta = json.load(fp)
+    rows = meta['rows']
+    columns = {}
+    for (name, col) in meta['columns'].items():
+        shape = (rows, col['width']) if col['width'] > 1 else (rows,)
+        if rows == 0:
+            columns[name] = np.zeros(shape, dtype=col['dtype'])
+        else:
+            columns[name] = np.memmap(os.path.join(directory, col['file']), dtype=col['dtype'], mode='r', shape=shape)
+    return columns
+
+
+if __name__ == '__main__':
+    import shutil
+    import tempfile
+    from bao_compact import play_game
+    from bao_rollout import rollouts
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # the same rows whatever the number of workers, chunk size or buffer size
+        a = os.path.join(tmpdir, 'a')
+        b = os.path.join(tmpdir, 'b')
+        rows = export(a, 300, master_seed=5, processes=1, buffer_rows=1 << 20)
+        export(b, 120, master_seed=5, processes=2, chunk_size=7, buffer_rows=100)
+        for name in ('board', 'player', 'move', 'ply', 'game', 'result'):
+            with open(os.path.join(a, name + '.bin'), 'rb') as fa:
+                with open(os.path.join(b, name + '.bin'), 'rb') as fb:
+                    data = fb.read()
+                    if not data or fa.read(len(data)) != data:
+                        raise RuntimeError('{} differs between runs'.format(name))
+
+        # appending (even with the same seed) continues the game numbering with
+        # new games -- games 120 to 129 of `a` -- and cuts off a torn write
+        with open(os.path.join(b, 'move.bin'), 'ab') as fp:
+            fp.write(b'\x07' * 3)
+        export(b, 10, master_seed=5, processes=1)
+        with open(os.path.join(b, META)) as fp:
+            meta = json.load(fp)
+        if meta['games'] != 130 or os.path.getsize(os.path.join(b, 'move.bin')) != meta['rows']:
+            raise RuntimeError('append did not continue cleanly: {}'.format(meta))
+        with open(os.path.join(a, 'move.bin'), 'rb') as fa:
+            with open(os.path.join(b, 'move.bin'), 'rb') as fb:
+                data = fb.read()
+                if fa.read(len(data)) != data:
+                    raise RuntimeError('appended games are not the next games of the run')
+
+        # rows must replay: the board before each move, and the game's final result
+        games = list(rollouts(300, master_seed=5, processes=1))
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            cols = open_columns(a)
+            if len(cols['move']) != rows or rows != sum(plies for (moves, scores, plies) in games):
+                raise RuntimeError('expected one row per ply')
+            for g in (0, 17, 299):
+                idx = numpy.nonzero(cols['game'] == g)[0]
+                (moves, scores, plies) = games[g]
+                moves = list(bytearray(moves))
+                if cols['move'][idx].tolist() != moves or set(cols['result'][idx].tolist()) != set([scores[0] - scores[1]]):
+                    raise RuntimeError('game {} does not match its rollout'.format(g))
+                for (i, row) in enumerate(idx):
+                    cg, score = play_game(moves[:i])
+                    if cols['board'][row].tolist() != cg.board or cols['player'][row] != cg.current_player:
+                        raise RuntimeError('game {} ply {} has the wrong board'.format(g, i))
+        print('Exported {} rows from 300 games'.format(rows))
+    finally:
+        shutil.rmtree(tmpdir)
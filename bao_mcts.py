@@ -0,0 +1,305 @@
+# file: bao_mcts.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Monte Carlo Tree Search player for bao (Kalah).
+
+The tree lives in an arena: one typed array per node field, indexed by node
+number, so the tree holds no per-node Python objects. The children of a node are
+allocated together, as a block of consecutive node numbers.
+
+Each search step selects `batch_size` leaves with UCT, using a virtual loss so
+the leaves of one batch differ, then plays random games from all of them at once
+with `bao_batch.simulate` (or one by one with `bao_compact.random_game` if NumPy
+is not installed) and backs the results up the tree.
+
+Between moves the tree is kept: the next search starts from the node matching
+the new position, if the tree has one. When the arena is full, the tree is
+rebuilt keeping only the children of the most visited nodes.
+'''
+
+from __future__ import print_function, division
+from array import array
+from math import log, sqrt
+import random
+import time
+
+from bao_compact import CompactGame, random_game
+
+# bytes used per node: parent, first_child, n_children, move, mover, visits (int32) + value (double)
+NODE_BYTES = 6 * 4 + 8
+
+
+def batch_rollouts(games, rng):
+    '''play every game in `games` (a list of `CompactGame`) to the end at random.
+    Returns a list of final scores.'''
+    try:
+        import bao_batch
+    except ImportError:
+        return [random_game(g, rng=rng)[1] for g in games]
+    g = games[0]
+    scores = bao_batch.simulate(len(games), g.n_stones, g.n_pits, seed=rng.randrange(1 << 30),
+                                boards=[g.board for g in games],
+                                players=[g.current_player for g in games])
+    return scores.tolist()
+
+
+class MCTSPlayer(object):
+    '''UCT player with batched rollouts.
+    * `time_limit`, `playout_limit`: budget per move (seconds, playouts)
+    * `batch_size`: leaves selected (and rolled out together) per step
+    * `exploration`: the UCT exploration constant
+    * `memory_limit`: bytes the node arena may use
+    After each `choose_move`, `stats` holds the playouts, playouts per second,
+    and the number of nodes in the tree.'''
+
+    def __init__(self, time_limit=1.0, playout_limit=None, batch_size=64,
+                 exploration=1.4, memory_limit=64 << 20, seed=None):
+        self.time_limit = time_limit
+        self.playout_limit = playout_limit
+        self.batch_size = batch_size
+        self.exploration = exploration
+        self.max_nodes = max(memory_limit // NODE_BYTES, 1024)
+        self.rng = random.Random(seed)
+        self.stats = {}
+        self.root_game = None
+        self._clear()
+
+    def __call__(self, game):
+        return self.choose_move(game)
+
+    def _clear(self):
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.n_children = array('i')
+        self.move = array('i')
+        self.mover = array('i')
+        self.visits = array('i')
+        self.value = array('d')
+        self.root = self._alloc(1)
+        self.parent[self.root] = -1
+
+    @property
+    def n_nodes(self):
+        return len(self.visits)
+
+    def _alloc(self, count):
+        '''allocate `count` consecutive nodes, returning the first'''
+        first = len(self.visits)
+        for field in (self.parent, self.first_child, self.move, self.mover):
+            field.extend([-1] * count)
+        for field in (self.n_children, self.visits):
+            field.extend([0] * count)
+        self.value.extend([0.0] * count)
+        return first
+
+    def _find(self, game, max_depth=4):
+        '''return the node (within `max_depth` plies of the root) holding the position in `game`, or None'''
+        want = (game.board, game.current_player, game.game_over)
+        frontier = [(self.root, self.root_game)]
+        for depth in range(max_depth + 1):
+            next_frontier = []
+            for (node, g) in frontier:
+                if (g.board, g.current_player, g.game_over) == want:
+                    return node
+                first = self.first_child[node]
+                for child in range(first, first + self.n_children[node]):
+                    cg = g.copy()
+                    cg.play_round(self.move[child])
+                    next_frontier.append((child, cg))
+            frontier = next_frontier
+        return None
+
+    def _reroot(self, game):
+        '''make the node matching `game` the root, or start a new tree'''
+        node = None
+        if self.root_game is not None and self.root_game.n_pits == game.n_pits:
+            node = self._find(game)
+        if node is None:
+            self._clear()
+        else:
+            self.root = node
+            self.parent[node] = -1
+        self.root_game = game.copy()
+
+    def _prune(self, keep_nodes):
+        '''rebuild the arena from the root, keeping the children of the most visited
+        nodes, up to `keep_nodes` nodes. Other nodes become unexpanded leaves.'''
+        expanded = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            k = self.n_children[node]
+            if k:
+                expanded.append((self.visits[node], node))
+                first = self.first_child[node]
+                stack.extend(range(first, first + k))
+        # a parent has more visits than any of its children, so this keeps whole branches
+        expanded.sort(reverse=True)
+        keep = set()
+        total = 1
+        for (visits, node) in expanded:
+            total += self.n_children[node]
+            if total > keep_nodes:
+                break
+            keep.add(node)
+
+        old = (self.first_child, self.n_children, self.move, self.mover, self.visits, self.value)
+        old_first, old_k, old_move, old_mover, old_visits, old_value = old
+        old_root = self.root
+        self._clear()
+        self.move[self.root] = old_move[old_root]
+        self.mover[self.root] = old_mover[old_root]
+        self.visits[self.root] = old_visits[old_root]
+        self.value[self.root] = old_value[old_root]
+        queue = [(old_root, self.root)]
+        while queue:
+            (old_node, node) = queue.pop()
+            if old_node not in keep:
+                continue
+            k = old_k[old_node]
+            first = self._alloc(k)
+            self.first_child[node] = first
+            self.n_children[node] = k
+            for i in range(k):
+                (o, n) = (old_first[old_node] + i, first + i)
+                self.parent[n] = node
+                self.move[n] = old_move[o]
+                self.mover[n] = old_mover[o]
+                self.visits[n] = old_visits[o]
+                self.value[n] = old_value[o]
+                queue.append((o, n))
+
+    def _select(self):
+        '''walk from the root to a leaf, expanding it if possible.
+        Visits along the path are counted straight away (a virtual loss).
+        Returns the leaf and its position.'''
+        first_child, n_children, visits, value = self.first_child, self.n_children, self.visits, self.value
+        c = self.exploration
+        node = self.root
+        cg = self.root_game.copy()
+        visits[node] += 1
+        while n_children[node]:
+            first = first_child[node]
+            log_n = log(visits[node])
+            best = -1.0
+            for child in range(first, first + n_children[node]):
+                nv = visits[child]
+                if nv == 0:
+                    node = child
+                    break
+                score = value[child] / nv + c * sqrt(log_n / nv)
+                if score > best:
+                    best = score
+                    node = child
+            cg.play_round(self.move[node])
+            visits[node] += 1
+        if not cg.game_over:
+            # expand, then continue to one of the new children
+            moves = cg.legal_moves()
+            first = self._alloc(len(moves))
+            first_child[node] = first
+            n_children[node] = len(moves)
+            for (i, move) in enumerate(moves):
+                self.parent[first + i] = node
+                self.move[first + i] = move
+                self.mover[first + i] = cg.current_player
+            node = first + self.rng.randrange(len(moves))
+            cg.play_round(self.move[node])
+            visits[node] += 1
+        return node, cg
+
+    def _backup(self, node, scores):
+        if scores[0] > scores[1]:
+            rewards = (1.0, 0.0)
+        elif scores[0] < scores[1]:
+            rewards = (0.0, 1.0)
+        else:
+            rewards = (0.5, 0.5)
+        parent, mover, value = self.parent, self.mover, self.value
+        while node != -1:
+            if mover[node] != -1:
+                value[node] += rewards[mover[node] - 1]
+            node = parent[node]
+
+    def choose_move(self, game):
+        '''return the most visited move for the player to move in `game`
+        (a `bao_engine.Game` or a `CompactGame`)'''
+        if not isinstance(game, CompactGame):
+            game = CompactGame.from_game(game)
+        if game.game_over:
+            raise RuntimeError('choose_move called on a finished game')
+        self._reroot(game)
+
+        start = time.time()
+        playouts = 0
+        # room for a batch of expansions
+        headroom = self.batch_size * (game.n_pits + 1)
+        while True:
+            if self.n_nodes + headroom > self.max_nodes:
+                self._prune((self.max_nodes - headroom) // 2)
+            leaves = [self._select() for i in range(self.batch_size)]
+            pending = [(node, cg) for (node, cg) in leaves if not cg.game_over]
+            for (node, cg) in leaves:
+                if cg.game_over:
+                    self._backup(node, cg.score)
+            if pending:
+                for ((node, cg), scores) in zip(pending, batch_rollouts([cg for (node, cg) in pending], self.rng)):
+                    self._backup(node, scores)
+            playouts += len(leaves)
+            if self.playout_limit is not None and playouts >= self.playout_limit:
+                break
+            if self.time_limit is not None and time.time() - start >= self.time_limit:
+                break
+
+        first = self.first_child[self.root]
+        children = range(first, first + self.n_children[self.root])
+        best = max(children, key=lambda child: self.visits[child])
+        elapsed = time.time() - start
+        self.stats = {
+            'playouts': playouts,
+            'pps': playouts / elapsed if elapsed > 0 else 0.0,
+            'nodes': self.n_nodes,
+            'root_visits': self.visits[self.root],
+            'win_rate': self.value[best] / max(self.visits[best], 1),
+        }
+        return self.move[best]
+
+
+if __name__ == '__main__':
+    rng = random.Random(5)
+
+    # The player should beat a random player, while reusing its tree
+    wins = 0
+    for gno in range(6):
+        mcts = MCTSPlayer(time_limit=None, playout_limit=1024, memory_limit=1 << 20, seed=gno)
+        cg = CompactGame()
+        cg.initial_place()
+        mcts_player = 1 + gno % 2
+        while not cg.game_over:
+            if cg.current_player == mcts_player:
+                move = mcts.choose_move(cg)
+            else:
+                move = cg.random_move(rng)
+            cg.play_round(move)
+        score = cg.score
+        if score[mcts_player - 1] > score[2 - mcts_player]:
+            wins += 1
+    print('MCTSPlayer beat a random player {} times out of 6'.format(wins))
+
+    # A small memory cap forces pruning; the tree must stay consistent
+    mcts = MCTSPlayer(time_limit=None, playout_limit=5000, memory_limit=2000 * NODE_BYTES, seed=1)
+    cg = CompactGame()
+    cg.initial_place()
+    mcts.choose_move(cg)
+    if mcts.n_nodes > mcts.max_nodes:
+        raise RuntimeError('MCTS arena grew past its cap: {} > {}'.format(mcts.n_nodes, mcts.max_nodes))
+    for node in range(mcts.n_nodes):
+        first = mcts.first_child[node]
+        for child in range(first, first + mcts.n_children[node]):
+            if mcts.parent[child] != node:
+                raise RuntimeError('MCTS arena is inconsistent at node {}'.format(node))
+
+    mcts = MCTSPlayer(time_limit=1.0)
+    move = mcts.choose_move(cg)
+    print('Opening move: {} {}'.format(move, mcts.stats))
@@ -0,0 +1,242 @@
+# file: bao_perft.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Perft: count the move tree of a bao position, using the `bao_engine` rules.
+
+`perft(game, depth)` walks every sequence of `depth` moves from `game` with
+`Game.make_move` / `Game.unmake_move` and counts the leaves (positions reached
+after exactly `depth` moves; games that end sooner are not counted). Comparing
+counts between engines or versions is a quick, exhaustive check of the rules,
+and the nodes per second is a measure of raw move generation speed.
+
+With `distinct=True` it also counts the distinct leaf positions (pit counts and
+player to move). They are collected in a set, which is sorted and spilled to a
+temporary file whenever it outgrows `memory_limit`; the sorted runs are merged
+at the end. With `processes` > 1 the root moves are searched in parallel, each
+worker with its own `memory_limit`.
+
+    python bao_perft.py --depth 6 --distinct --processes 4
+
+(With no arguments, `python bao_perft.py` runs its self-checks.)
+'''
+
+from __future__ import print_function
+import argparse
+import heapq
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+from bao_engine import Game
+from bao_rollout import imap_bounded
+
+# rough cost of one position in the visited set, on top of its record
+ENTRY_OVERHEAD = 64
+
+
+def position_struct(n_stones, n_pits):
+    '''struct for the record of a position: the pit counts, then the player to move'''
+    return struct.Struct('<{}{}B'.format(2 * n_pits + 2, 'B' if n_stones < 256 else 'H'))
+
+
+class DistinctCounter(object):
+    '''Count distinct fixed-size records, holding at most about `memory_limit` bytes
+    of them in memory and spilling sorted runs to files in `tmpdir`.'''
+
+    def __init__(self, record_size, memory_limit=64 << 20, tmpdir=None):
+        self.record_size = record_size
+        self.max_entries = max(1, memory_limit // (record_size + ENTRY_OVERHEAD))
+        self.tmpdir = tmpdir
+        self.seen = set()
+        self.runs = []
+
+    def add(self, record):
+        self.seen.add(record)
+        if len(self.seen) >= self.max_entries:
+            self.spill()
+
+    def spill(self):
+        '''write the records in memory to a new sorted run'''
+        if not self.seen:
+            return
+        (fd, filename) = tempfile.mkstemp(suffix='.run', dir=self.tmpdir)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(b''.join(sorted(self.seen)))
+        self.runs.append(filename)
+        self.seen = set()
+
+    def _read_run(self, filename):
+        with open(filename, 'rb') as fp:
+            while True:
+                record = fp.read(self.record_size)
+                if not record:
+                    return
+                yield record
+
+    def count(self):
+        '''return the number of distinct records added, here and in any runs adopted with `merge`'''
+        if not self.runs:
+            return len(self.seen)
+        self.spill()
+        n = 0
+        last = None
+        for record in heapq.merge(*[self._read_run(f) for f in self.runs]):
+            if record != last:
+                n += 1
+                last = record
+        return n
+
+    def merge(self, runs):
+        '''take over sorted runs (file names) written by another counter'''
+        self.runs.extend(runs)
+
+    def close(self):
+        '''delete the run files'''
+        for filename in self.runs:
+            os.remove(filename)
+        self.runs = []
+        self.seen = set()
+
+
+def _perft(game, depth, counter, record):
+    '''return `(leaves, nodes)` below `game`'''
+    if depth == 0:
+        if counter is not None:
+            counter.add(record.pack(*([p.count_stones() for p in game.pits] + [game.current_player])))
+        return (1, 1)
+    if game.game_over:
+        return (0, 1)
+    leaves = 0
+    nodes = 1
+    for move in list(game.legal_moves()):
+        game.make_move(move)
+        (l, n) = _perft(game, depth - 1, counter, record)
+        game.unmake_move()
+        leaves += l
+        nodes += n
+    return (leaves, nodes)
+
+
+def perft_move(task):
+    '''count the tree below one root move. Returns `(move, leaves, nodes, runs)`.
+    `task` is a tuple `(snapshot, move, depth, distinct, memory_limit, tmpdir)`,
+    where `snapshot` is the root position from `Game.to_bytes`.'''
+    (snapshot, move, depth, distinct, memory_limit, tmpdir) = task
+    game = Game.from_bytes(snapshot)
+    record = position_struct(game.n_stones, game.n_pits)
+    counter = DistinctCounter(record.size, memory_limit, tmpdir) if distinct else None
+    game.make_move(move)
+    (leaves, nodes) = _perft(game, depth - 1, counter, record)
+    runs = []
+    if counter is not None:
+        counter.spill()
+        runs = counter.runs
+    return (move, leaves, nodes, runs)
+
+
+def perft(game, depth, distinct=False, memory_limit=64 << 20, processes=1, tmpdir=None):
+    '''Count the leaves `depth` moves below `game` (a `bao_engine.Game`, which is left unchanged).
+    Returns a dictionary with the `leaves`, `nodes` visited, `distinct` leaf positions
+    (if asked for), `seconds`, `nps` and `divide` (the leaves below each root move).'''
+    start = time.time()
+    record = position_struct(game.n_stones, game.n_pits)
+    counter = DistinctCounter(record.size, memory_limit, tmpdir) if distinct else None
+    divide = {}
+    try:
+        if depth == 0 or game.game_over:
+            (leaves, nodes) = _perft(game, depth, counter, record)
+        else:
+            snapshot = game.to_bytes()
+            tasks = [(snapshot, move, depth, distinct, memory_limit, tmpdir) for move in game.legal_moves()]
+            leaves = 0
+            nodes = 1
+            for (move, l, n, runs) in imap_bounded(perft_move, tasks, processes):
+                divide[move] = l
+                leaves += l
+                nodes += n
+                if counter is not None:
+                    counter.merge(runs)
+        n_distinct = None if counter is None else counter.count()
+    finally:
+        if counter is not None:
+            counter.close()
+    seconds = time.time() - start
+    return {
+        'depth': depth,
+        'leaves': leaves,
+        'nodes': nodes,
+        'distinct': n_distinct,
+        'seconds': seconds,
+        'nps': nodes / seconds if seconds > 0 else 0.0,
+        'divide': divide,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count the bao move tree to a given depth')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--stones', type=int, default=36)
+    parser.add_argument('--pits', type=int, default=6)
+    parser.add_argument('--moves', default='', help='comma separated moves to play from the start first')
+    parser.add_argument('--distinct', action='store_true', help='also count distinct leaf positions')
+    parser.add_argument('--memory', type=int, default=64, help='memory limit for distinct positions, in MB per process')
+    parser.add_argument('--processes', type=int, default=1, help='split root moves across this many processes')
+    args = parser.parse_args(argv)
+
+    game = Game(n_stones=args.stones, n_pits=args.pits)
+    game.initial_place()
+    for move in [int(m) for m in args.moves.split(',') if m]:
+        if not game.play_round(move):
+            parser.error('move {} is not legal'.format(move))
+    for depth in range(1, args.depth + 1):
+        result = perft(game, depth, args.distinct, args.memory << 20, args.processes)
+        print(json.dumps(result, sort_keys=True))
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:]:
+        sys.exit(main())
+
+    # with no arguments, check perft against the compact engine
+    from bao_compact import CompactGame
+
+    def perft_compact(cg, depth, seen):
+        if depth == 0:
+            seen.add((tuple(cg.board), cg.current_player))
+            return 1
+        if cg.game_over:
+            return 0
+        leaves = 0
+        for move in cg.legal_moves():
+            child = cg.copy()
+            child.play_round(move)
+            leaves += perft_compact(child, depth - 1, seen)
+        return leaves
+
+    # perft must agree with the compact engine, whatever the split and memory limit
+    for (n_stones, n_pits, depth) in [(36, 6, 4), (12, 3, 6)]:
+        game = Game(n_stones=n_stones, n_pits=n_pits)
+        game.initial_place()
+        cg = CompactGame.from_game(game)
+        seen = set()
+        leaves = perft_compact(cg, depth, seen)
+        before = game.to_bytes(stones=True)
+        for (processes, memory_limit) in [(1, 64 << 20), (1, 2000), (2, 2000)]:
+            result = perft(game, depth, distinct=True, memory_limit=memory_limit, processes=processes)
+            if (result['leaves'], result['distinct']) != (leaves, len(seen)):
+                raise RuntimeError('perft({}/{}, {}) = {} leaves, {} distinct; the compact engine finds {}, {}'.format(
+                    n_stones, n_pits, depth, result['leaves'], result['distinct'], leaves, len(seen)))
+            if sum(result['divide'].values()) != leaves:
+                raise RuntimeError('divide does not add up')
+        if game.to_bytes(stones=True) != before:
+            raise RuntimeError('perft changed the game')
+
+    game = Game()
+    game.initial_place()
+    print(json.dumps(perft(game, 5, distinct=True), sort_keys=True))
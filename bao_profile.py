@@ -0,0 +1,174 @@
+# file: bao_profile.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Optional instrumentation for `bao_engine.Game`.
+
+`Instrumentation.attach(game)` wraps the phases of a move on one game (and
+`Pit.add` on its pits) with counters and timers, by setting instance
+attributes that shadow the methods. Nothing in `bao_engine` is changed, so a
+game that is not attached (or has been detached) runs at full speed.
+
+    instr = Instrumentation()
+    bg = instr.attach(Game())
+    bg.initial_place()
+    random_game(bg)
+    instr.snapshot()
+    # {'sow': {'calls': 31, 'ns': ..., 'seeds': 126}, 'perform_captures': {...}, ...}
+
+For one-off runs, `profile()` runs a function under `cProfile` and prints the
+busiest functions.
+'''
+
+from __future__ import print_function
+import cProfile
+import pstats
+import sys
+from timeit import default_timer as timer
+
+from bao_engine import Game, Pit
+
+
+class Instrumentation(object):
+    '''Counts calls, seeds moved, captures, extra turns, endgame sweeps and
+    nanoseconds spent in each phase of a move, for every game attached to it.
+    Time in `Pit.add` is also included in the time of the phase calling it.'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {
+            'sow': {'calls': 0, 'ns': 0, 'seeds': 0},
+            'perform_captures': {'calls': 0, 'ns': 0, 'captures': 0, 'seeds': 0},
+            'update_player': {'calls': 0, 'ns': 0, 'extra_turns': 0},
+            'handle_endgame': {'calls': 0, 'ns': 0, 'sweeps': 0, 'seeds': 0},
+            'Pit.add': {'calls': 0, 'ns': 0},
+        }
+
+    def snapshot(self):
+        '''return a copy of the counters, adding the mean ns per call of each phase'''
+        snap = {}
+        for (phase, counters) in self.counters.items():
+            snap[phase] = dict(counters)
+            snap[phase]['ns_per_call'] = counters['ns'] / float(counters['calls']) if counters['calls'] else 0.0
+        return snap
+
+    def attach(self, game):
+        '''instrument `game` (a `bao_engine.Game`), returning it'''
+        counters = self.counters
+
+        def sow(pit_id, direction='ccw', debug=False):
+            c = counters['sow']
+            seeds = game.pits[pit_id].count_stones()
+            start = timer()
+            ok = Game.sow(game, pit_id, direction, debug)
+            c['ns'] += int((timer() - start) * 1e9)
+            c['calls'] += 1
+            if ok:
+                c['seeds'] += seeds
+            return ok
+
+        def perform_captures():
+            c = counters['perform_captures']
+            target = game.pits[game.targets[game.current_player]]
+            before = target.count_stones()
+            start = timer()
+            Game.perform_captures(game)
+            c['ns'] += int((timer() - start) * 1e9)
+            c['calls'] += 1
+            captured = target.count_stones() - before
+            if captured:
+                c['captures'] += 1
+                c['seeds'] += captured
+
+        def update_player(debug=False):
+            c = counters['update_player']
+            player = game.current_player
+            start = timer()
+            Game.update_player(game, debug)
+            c['ns'] += int((timer() - start) * 1e9)
+            c['calls'] += 1
+            if game.current_player == player:
+                c['extra_turns'] += 1
+
+        def handle_endgame():
+            c = counters['handle_endgame']
+            scores = game.score
+            start = timer()
+            Game.handle_endgame(game)
+            c['ns'] += int((timer() - start) * 1e9)
+            c['calls'] += 1
+            if game.game_over:
+                c['sweeps'] += 1
+                c['seeds'] += sum(game.score) - sum(scores)
+
+        game.sow = sow
+        game.perform_captures = perform_captures
+        game.update_player = update_player
+        game.handle_endgame = handle_endgame
+        for pit in game.pits:
+            pit.add = self._wrap_add(pit)
+        return game
+
+    def _wrap_add(self, pit):
+        c = self.counters['Pit.add']
+
+        def add(stone, debug=False, position=None):
+            start = timer()
+            ok = Pit.add(pit, stone, debug, position)
+            c['ns'] += int((timer() - start) * 1e9)
+            c['calls'] += 1
+            return ok
+        return add
+
+    @staticmethod
+    def detach(game):
+        '''remove the instrumentation from `game`'''
+        for name in ('sow', 'perform_captures', 'update_player', 'handle_endgame'):
+            game.__dict__.pop(name, None)
+        for pit in game.pits:
+            pit.__dict__.pop('add', None)
+
+
+def profile(func, *args, **kwargs):
+    '''Run `func(*args, **kwargs)` under cProfile, print the `limit` (default 20)
+    busiest functions, sorted by `sort` (default 'cumulative'), and return the result.'''
+    sort = kwargs.pop('sort', 'cumulative')
+    limit = kwargs.pop('limit', 20)
+    stream = kwargs.pop('stream', sys.stderr)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(limit)
+
+
+if __name__ == '__main__':
+    import json
+    from bao_engine import random_game, play_game, check_game
+
+    # instrumented games must play exactly like plain ones
+    instr = Instrumentation()
+    for gno in range(50):
+        bg = instr.attach(Game())
+        bg.initial_place()
+        bg, score = random_game(bg)
+        check_game(bg, score)
+        if play_game(bg.move_list)[1] != score:
+            raise RuntimeError('instrumented game scored differently')
+        Instrumentation.detach(bg)
+        if 'sow' in bg.__dict__ or 'add' in bg.pits[0].__dict__:
+            raise RuntimeError('detach left instrumentation behind')
+
+    snap = instr.snapshot()
+    if snap['sow']['calls'] != snap['perform_captures']['calls']:
+        raise RuntimeError('every sow should be followed by perform_captures')
+    if snap['handle_endgame']['sweeps'] != 50:
+        raise RuntimeError('expected 50 endgame sweeps, found {}'.format(snap['handle_endgame']['sweeps']))
+    # (a last seed landing alone in an empty target is "captured" back into it, which adds no seeds)
+    if snap['Pit.add']['calls'] < snap['sow']['seeds'] + snap['perform_captures']['seeds'] + snap['handle_endgame']['seeds'] + 50 * 36:
+        raise RuntimeError('Pit.add calls do not add up')
+    print(json.dumps(snap, indent=2, sort_keys=True))
+
+    profile(lambda: [random_game() for i in range(50)], limit=10, stream=sys.stdout)
@@ -0,0 +1,133 @@
+# file: bao_render.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Draw every stone of a bao game with a few canvas instructions.
+
+Instead of one `Image` widget (and one `Animation`) per stone, `StoneRenderer`
+draws all stones of one colour as textured quads in a single `Mesh`. Stones
+that move are interpolated by one clock callback, which only runs while
+something is moving and only touches the vertices of the stones in flight.
+
+The renderer keeps an index of which stones are in which pit, so when a pit is
+moved or resized only the stones in that pit are repositioned.
+'''
+
+from kivy.clock import Clock
+from kivy.core.image import Image as CoreImage
+from kivy.graphics import Color, Mesh
+from kivy.utils import get_color_from_hex
+
+# texture coordinates of a quad's four corners, in vertex order
+QUAD_UV = ((0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0))
+
+
+class StoneRenderer(object):
+    '''Draws the stones of `engine` (a `bao_engine.Game`) on `canvas`.
+    * `pos_to_coords(position, pit_widget)` gives the window coordinates of a position in a pit
+    * `source` is the stone image'''
+
+    def __init__(self, canvas, engine, pos_to_coords, source='assets/graphics/stone.png'):
+        self.canvas = canvas
+        self.engine = engine
+        self.pos_to_coords = pos_to_coords
+        self.texture = CoreImage(source).texture
+        self.groups = {}        # color -> (Mesh, vertex list)
+        self.slot = {}          # stone id -> (color, offset of its first float in the vertex list)
+        self.rects = {}         # stone id -> [x, y, w, h] as drawn
+        self.pit_stones = {}    # pit id -> set of stone ids
+        self.moving = {}        # stone id -> (start rect, end rect, start time, duration)
+        self.clock_event = None
+        self.time = 0.0
+
+    def rebuild(self):
+        '''(re)create the meshes and the pit index from the engine, with every stone in place'''
+        self.canvas.clear()
+        self.groups = {}
+        self.slot = {}
+        self.pit_stones = {}
+        self.moving = {}
+        by_color = {}
+        for stone in self.engine.stones:
+            by_color.setdefault(stone.color, []).append(stone)
+            self.pit_stones.setdefault(stone.pit, set()).add(stone.id)
+        for (color, stones) in by_color.items():
+            vertices = [0.0] * (16 * len(stones))
+            indices = []
+            for (i, stone) in enumerate(stones):
+                self.slot[stone.id] = (color, 16 * i)
+                indices.extend([4 * i, 4 * i + 1, 4 * i + 2, 4 * i + 2, 4 * i + 3, 4 * i])
+            with self.canvas:
+                Color(*get_color_from_hex(color))
+                mesh = Mesh(vertices=vertices, indices=indices, mode='triangles', texture=self.texture)
+            self.groups[color] = (mesh, vertices)
+        for stone in self.engine.stones:
+            self._put(stone.id, self.target_rect(stone))
+        self._flush(self.groups)
+
+    def target_rect(self, stone):
+        '''where `stone` should be drawn, as [x, y, w, h]'''
+        if stone.pit is None:
+            return self.rects.get(stone.id, [0.0, 0.0, 0.0, 0.0])
+        pit = self.engine.pits[stone.pit]
+        widget = pit.kivy_obj
+        (x, y) = self.pos_to_coords(stone.position, widget)
+        side = widget.width / float(pit.cols)
+        return [x, y, side, side]
+
+    def _put(self, stone_id, rect):
+        '''write a stone's quad into its mesh's vertex list'''
+        self.rects[stone_id] = rect
+        (color, offset) = self.slot[stone_id]
+        vertices = self.groups[color][1]
+        (x, y, w, h) = rect
+        for (corner, (u, v)) in enumerate(QUAD_UV):
+            i = offset + 4 * corner
+            vertices[i] = x + u * w
+            vertices[i + 1] = y + v * h
+            vertices[i + 2] = u
+            vertices[i + 3] = 1.0 - v
+
+    def _flush(self, colors):
+        '''upload the vertex lists of the given colours'''
+        for color in colors:
+            (mesh, vertices) = self.groups[color]
+            mesh.vertices = vertices
+
+    def animate(self, stone_ids, duration=0.5):
+        '''move the given stones to where the engine now has them, over `duration` seconds'''
+        for stone_id in stone_ids:
+            stone = self.engine.stones[stone_id]
+            for stones in self.pit_stones.values():
+                stones.discard(stone_id)
+            self.pit_stones.setdefault(stone.pit, set()).add(stone_id)
+            self.moving[stone_id] = (self.rects[stone_id], self.target_rect(stone), self.time, duration)
+        if self.moving and self.clock_event is None:
+            self.clock_event = Clock.schedule_interval(self._tick, 0)
+
+    def _tick(self, dt):
+        self.time += dt
+        dirty = set()
+        for (stone_id, (start, end, t0, duration)) in list(self.moving.items()):
+            t = min((self.time - t0) / duration, 1.0) if duration > 0 else 1.0
+            self._put(stone_id, [a + (b - a) * t for (a, b) in zip(start, end)])
+            dirty.add(self.slot[stone_id][0])
+            if t >= 1.0:
+                del self.moving[stone_id]
+        self._flush(dirty)
+        if not self.moving:
+            self.clock_event.cancel()
+            self.clock_event = None
+
+    def pit_moved(self, pit_widget):
+        '''reposition the stones in a pit that has moved or been resized'''
+        dirty = set()
+        for stone_id in self.pit_stones.get(pit_widget.pit_obj.id, ()):
+            rect = self.target_rect(self.engine.stones[stone_id])
+            if stone_id in self.moving:
+                (start, end, t0, duration) = self.moving[stone_id]
+                self.moving[stone_id] = (start, rect, t0, duration)
+            else:
+                self._put(stone_id, rect)
+                dirty.add(self.slot[stone_id][0])
+        self._flush(dirty)
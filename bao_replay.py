@@ -0,0 +1,147 @@
+# file: bao_replay.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Replay many move lists that share prefixes, without replaying the prefixes.
+
+`ReplayCache` puts every move list it replays into a trie (one node per move).
+Where move lists branch, it keeps a snapshot of the position at the branch
+point, and every `checkpoint_every` moves along new branches (so that the
+branch point of the next move list is never far from a snapshot). A new move
+list is replayed from the deepest snapshot along its path, so only its own
+suffix is played.
+
+Snapshots are packed board counts, kept in least-recently-used order within a
+byte budget. An evicted snapshot is simply taken again the next time a replay
+passes through its branch point.
+'''
+
+from __future__ import print_function
+from array import array
+from collections import OrderedDict
+
+from bao_compact import CompactGame
+
+# rough bookkeeping cost of one snapshot, on top of its packed board
+SNAPSHOT_OVERHEAD = 64
+
+
+class _TrieNode(object):
+    __slots__ = ('children',)
+
+    def __init__(self):
+        self.children = {}
+
+
+class ReplayCache(object):
+    '''Replay move lists from the initial position, sharing work between common prefixes.
+    * `budget_bytes` bounds the memory used by snapshots
+    * `checkpoint_every` is the spacing (in moves) of snapshots along new branches
+    `plies_requested` counts the moves in every move list replayed,
+    `plies_played` the moves that actually had to be played, and `n_nodes`
+    the moves in the trie (the fewest plies that could have been played).'''
+
+    def __init__(self, n_stones=36, n_pits=6, budget_bytes=1 << 20, checkpoint_every=4):
+        self.n_stones = n_stones
+        self.n_pits = n_pits
+        self.budget_bytes = budget_bytes
+        self.checkpoint_every = checkpoint_every
+        self.root = _TrieNode()
+        self.n_nodes = 0
+        self.snapshots = OrderedDict()
+        self.bytes_used = 0
+        self.plies_requested = 0
+        self.plies_played = 0
+
+    def _snapshot(self, node, cg):
+        if node in self.snapshots:
+            return
+        packed = array('i', cg.board + [cg.current_player, cg.game_over])
+        self.snapshots[node] = packed
+        self.bytes_used += packed.itemsize * len(packed) + SNAPSHOT_OVERHEAD
+        while self.bytes_used > self.budget_bytes and self.snapshots:
+            (old, packed) = self.snapshots.popitem(last=False)
+            self.bytes_used -= packed.itemsize * len(packed) + SNAPSHOT_OVERHEAD
+
+    def _restore(self, packed):
+        cg = CompactGame(n_stones=self.n_stones, n_pits=self.n_pits)
+        n_all = len(cg.board)
+        cg.board = list(packed[:n_all])
+        cg.current_player = packed[n_all]
+        cg.game_over = bool(packed[n_all + 1])
+        return cg
+
+    def replay(self, move_list):
+        '''return a `CompactGame` holding the position after playing `move_list`'''
+        self.plies_requested += len(move_list)
+
+        # find the deepest snapshot along the path we already know
+        node = self.root
+        start = 0
+        start_node = None
+        for (i, move) in enumerate(move_list):
+            node = node.children.get(move)
+            if node is None:
+                break
+            if node in self.snapshots:
+                start = i + 1
+                start_node = node
+
+        if start_node is None:
+            cg = CompactGame(n_stones=self.n_stones, n_pits=self.n_pits)
+            cg.initial_place()
+            node = self.root
+        else:
+            self.snapshots[start_node] = packed = self.snapshots.pop(start_node)
+            cg = self._restore(packed)
+            node = start_node
+
+        # play the rest, extending the trie, and snapshot any branch points we pass
+        for (depth, move) in enumerate(move_list[start:], start):
+            child = node.children.get(move)
+            if child is None:
+                if node is not self.root and (node.children or depth % self.checkpoint_every == 0):
+                    self._snapshot(node, cg)
+                child = node.children[move] = _TrieNode()
+                self.n_nodes += 1
+            elif len(node.children) > 1 and node is not self.root:
+                self._snapshot(node, cg)
+            cg.play_round(move)
+            self.plies_played += 1
+            node = child
+        return cg
+
+    def play_game(self, move_list):
+        '''Like `bao_compact.play_game`: returns the game, and the score after all moves are completed.'''
+        cg = self.replay(move_list)
+        return (cg, cg.score)
+
+
+if __name__ == '__main__':
+    import random
+    from bao_compact import play_game, random_game
+
+    # random games branching off a few shared openings
+    rng = random.Random(11)
+    games = []
+    for opening in range(20):
+        base, score = random_game(rng=rng)
+        for i in range(50):
+            prefix = base.move_list[:rng.randrange(len(base.move_list))]
+            cg, score = play_game(prefix)
+            if not cg.game_over:
+                cg, score = random_game(cg, rng=rng)
+                prefix = prefix + cg.move_list
+            games.append(prefix)
+    games.sort()
+
+    for budget in (1 << 20, 4096):
+        cache = ReplayCache(budget_bytes=budget)
+        for ml in games:
+            cg, score = cache.play_game(ml)
+            if score != play_game(ml)[1]:
+                raise RuntimeError('replay cache scored {} differently'.format(ml))
+        if cache.bytes_used > budget:
+            raise RuntimeError('snapshots use {} bytes, over the {} byte budget'.format(cache.bytes_used, budget))
+        print('Budget {} bytes: played {} of {} plies ({:.1%}), {} are unique'.format(
+            budget, cache.plies_played, cache.plies_requested, float(cache.plies_played) / cache.plies_requested, cache.n_nodes))
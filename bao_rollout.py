@@ -0,0 +1,161 @@
+# file: bao_rollout.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Reproducible random self-play spread over a pool of processes.
+
+Every game gets its own random generator, seeded from the master seed and the
+game's index, so a game is played the same way whichever process plays it.
+Games are handed out in chunks of consecutive indices and the results come back
+in index order, so a run is identical for any number of workers.
+
+Each result is a tuple `(moves, scores, plies)`, with the moves packed one byte
+per move. `RolloutStats` reduces results to win/draw rates and histograms.
+'''
+
+from __future__ import print_function, division
+from collections import deque
+from itertools import chain, islice
+import random
+
+from bao_compact import CompactGame, random_game
+
+
+def game_seed(master_seed, index):
+    '''return the seed for game `index` of a run started from `master_seed`'''
+    return (master_seed << 40) | index
+
+
+def play_chunk(task):
+    '''play games `start` to `start+count-1` of a run. Returns a list of results.
+    `task` is a tuple `(master_seed, start, count, n_stones, n_pits)`.'''
+    (master_seed, start, count, n_stones, n_pits) = task
+    results = []
+    for index in range(start, start + count):
+        rng = random.Random(game_seed(master_seed, index))
+        cg = CompactGame(n_stones=n_stones, n_pits=n_pits)
+        cg.initial_place()
+        cg, scores = random_game(cg, rng=rng)
+        results.append((bytes(bytearray(cg.move_list)), tuple(scores), len(cg.move_list)))
+    return results
+
+
+def imap_bounded(func, tasks, processes=None, window=None):
+    '''Like `Pool.imap`, but only takes tasks from the (possibly lazy) iterable
+    `tasks` as results are consumed, keeping at most `window` tasks in flight.
+    This keeps memory flat however many tasks there are.
+    With `processes=1`, or only one task, the tasks are run in this process.'''
+    tasks = iter(tasks)
+    head = list(islice(tasks, 2))
+    if processes == 1 or len(head) < 2:
+        # a single task is not worth starting a pool for
+        for task in chain(head, tasks):
+            yield func(task)
+        return
+
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    if window is None:
+        window = 2 * (processes or multiprocessing.cpu_count())
+    pending = deque()
+    try:
+        for task in chain(head, tasks):
+            pending.append(pool.apply_async(func, (task,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def rollouts(n_games, master_seed=0, processes=None, chunk_size=500, n_stones=36, n_pits=6):
+    '''Generate the results of `n_games` random games, in game order.
+    `processes` is the number of worker processes (default: one per CPU).
+    With `processes=1` the games are played in this process.'''
+    tasks = ((master_seed, start, min(chunk_size, n_games - start), n_stones, n_pits)
+             for start in range(0, n_games, chunk_size))
+    for chunk in imap_bounded(play_chunk, tasks, processes):
+        for result in chunk:
+            yield result
+
+
+class RolloutStats(object):
+    '''Aggregate rollout results: wins, draws, score and game length histograms.
+    Statistics from separate runs can be combined with `merge`.'''
+
+    def __init__(self):
+        self.games = 0
+        self.wins = [0, 0]
+        self.draws = 0
+        self.score_hist = {}
+        self.plies_hist = {}
+
+    def add(self, result):
+        (moves, scores, plies) = result
+        self.games += 1
+        if scores[0] > scores[1]:
+            self.wins[0] += 1
+        elif scores[1] > scores[0]:
+            self.wins[1] += 1
+        else:
+            self.draws += 1
+        self.score_hist[scores[0]] = self.score_hist.get(scores[0], 0) + 1
+        self.plies_hist[plies] = self.plies_hist.get(plies, 0) + 1
+
+    def merge(self, other):
+        self.games += other.games
+        self.wins = [a + b for (a, b) in zip(self.wins, other.wins)]
+        self.draws += other.draws
+        for (mine, theirs) in ((self.score_hist, other.score_hist), (self.plies_hist, other.plies_hist)):
+            for (k, v) in theirs.items():
+                mine[k] = mine.get(k, 0) + v
+
+    def summary(self):
+        '''return a dictionary summarizing the games seen so far'''
+        games = self.games or 1
+        return {
+            'games': self.games,
+            'p1_win_rate': self.wins[0] / games,
+            'p2_win_rate': self.wins[1] / games,
+            'draw_rate': self.draws / games,
+            'mean_plies': sum(k * v for (k, v) in self.plies_hist.items()) / games,
+            'p1_score_hist': dict(self.score_hist),
+            'plies_hist': dict(self.plies_hist),
+        }
+
+
+def run_rollouts(n_games, master_seed=0, processes=None, chunk_size=500, n_stones=36, n_pits=6):
+    '''Play `n_games` random games and return their `RolloutStats`'''
+    stats = RolloutStats()
+    for result in rollouts(n_games, master_seed, processes, chunk_size, n_stones, n_pits):
+        stats.add(result)
+    return stats
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import time
+    import bao_engine
+
+    # Results must not depend on the number of workers
+    serial = list(rollouts(2000, master_seed=7, processes=1, chunk_size=300))
+    for processes in (2, 4):
+        if list(rollouts(2000, master_seed=7, processes=processes, chunk_size=300)) != serial:
+            raise RuntimeError('Rollouts differ with {} processes'.format(processes))
+
+    # ...and must replay through the object engine
+    for (moves, scores, plies) in serial[:50]:
+        bg, s = bao_engine.play_game(list(bytearray(moves)))
+        if s != list(scores):
+            raise RuntimeError('Replayed score {} != {} for moves {}'.format(s, scores, list(bytearray(moves))))
+
+    for processes in (1, multiprocessing.cpu_count()):
+        start = time.time()
+        stats = run_rollouts(20000, master_seed=1, processes=processes)
+        elapsed = time.time() - start
+        summary = stats.summary()
+        print('{} processes: {:.0f} games/s. P1 wins {:.1%}, P2 wins {:.1%}, draws {:.1%}'.format(
+            processes, summary['games'] / elapsed, summary['p1_win_rate'], summary['p2_win_rate'], summary['draw_rate']))
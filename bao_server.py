@@ -0,0 +1,505 @@
+# file: bao_server.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Headless bao server: many `bao_engine.Game` sessions in one asyncio process.
+
+Clients connect over TCP or a Unix socket and send one JSON request per line.
+Every request may carry an `id`, which is echoed in its reply:
+
+    {"id": 1, "op": "new", "n_stones": 36, "n_pits": 6, "ai_player": 2}
+    {"id": 1, "ok": true, "session": 17, "state": {...}}
+    {"id": 2, "op": "move", "session": 17, "pit": 3}
+    {"id": 2, "ok": true, "state": {...}}
+    {"id": 3, "op": "state", "session": 17}
+    {"id": 4, "op": "close", "session": 17}
+
+A `state` is `{"board": [counts], "player": p, "game_over": bool, "score":
+[s1, s2], "moves": [legal moves]}`. Errors are `{"id": .., "ok": false,
+"error": "..."}`, with an `id` of null if the line could not be read as a
+request. When a session has an `ai_player`, the server plays that side
+itself and pushes `{"event": "ai_move", "session": .., "pit": .., "state": ..}`
+to the connection that created the session. If the AI fails (it is tried
+`AI_ATTEMPTS` times), `{"event": "error", "session": .., "error": "..."}` is
+pushed instead, and the next `move` request in the session starts it again.
+
+Sessions are kept as `Game.to_bytes` snapshots (about 20 bytes for the standard
+game) and a game is only rebuilt while a move is played, so idle sessions cost
+very little. Requests are queued as they arrive and handled in one batch per
+event loop tick. Sessions idle for longer than `idle_timeout` are evicted. AI
+searches run in a process pool so they never block the event loop.
+
+    python3 bao_server.py serve --port 7777
+    python3 bao_server.py load --port 7777 --sessions 10000
+
+(With no arguments, `python3 bao_server.py` runs its self-checks.) This module
+needs Python 3.
+'''
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from bao_engine import Game
+
+# attempts at an AI move before the session's owner is sent an error
+AI_ATTEMPTS = 3
+
+log = logging.getLogger(__name__)
+
+# largest games a client may ask for
+MAX_STONES = 1024
+MAX_PITS = 32
+
+_ai_player = None
+
+
+def ai_move(snapshot, time_limit):
+    '''choose a move for the position in `snapshot`. Runs in a worker process,
+    which keeps one `AlphaBetaPlayer` (and its transposition table) between calls.'''
+    global _ai_player
+    from bao_ai import AlphaBetaPlayer
+    if _ai_player is None:
+        _ai_player = AlphaBetaPlayer(tt_size_log2=14)
+    _ai_player.time_limit = time_limit
+    return _ai_player.choose_move(Game.from_bytes(snapshot))
+
+
+def describe(game):
+    '''the JSON state of a game'''
+    return {
+        'board': [p.count_stones() for p in game.pits],
+        'player': game.current_player,
+        'game_over': game.game_over,
+        'score': game.score,
+        'moves': [] if game.game_over else list(game.legal_moves()),
+    }
+
+
+class Session(object):
+    __slots__ = ('snapshot', 'last_seen', 'ai_player', 'owner', 'thinking', 'ai_failures')
+
+    def __init__(self, snapshot, last_seen, ai_player, owner):
+        self.snapshot = snapshot
+        self.last_seen = last_seen
+        self.ai_player = ai_player
+        self.owner = owner
+        self.thinking = False
+        self.ai_failures = 0
+
+
+class BaoServer(object):
+    '''Hosts game sessions for any number of connections.
+    * `idle_timeout` is how long (in seconds) a session may go unused before it is evicted
+    * `ai_time` is the AI's time budget per move, in seconds
+    * `executor` runs AI searches (default: a `ProcessPoolExecutor`)'''
+
+    def __init__(self, idle_timeout=300.0, ai_time=0.1, executor=None):
+        self.idle_timeout = idle_timeout
+        self.ai_time = ai_time
+        self.executor = executor
+        self.sessions = {}
+        self.next_session = 1
+        self.pending = []
+        self.stats = {'requests': 0, 'batches': 0, 'max_batch': 0, 'evicted': 0, 'ai_moves': 0}
+        self.loop = None
+
+    async def start(self, host='127.0.0.1', port=7777, path=None):
+        '''start listening (on a Unix socket if `path` is given) and return the `asyncio.Server`'''
+        self.loop = asyncio.get_running_loop()
+        if self.executor is None:
+            # spawn, rather than fork, workers so they do not inherit client sockets
+            self.executor = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        self.evictor = self.loop.create_task(self._evict_periodically())
+        if path is not None:
+            return await asyncio.start_unix_server(self._handle_client, path=path)
+        return await asyncio.start_server(self._handle_client, host, port)
+
+    def close(self):
+        self.evictor.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not self.pending:
+                    self.loop.call_soon(self._flush)
+                self.pending.append((writer, line))
+                if writer.transport.get_write_buffer_size() > 1 << 16:
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _flush(self):
+        '''handle every request that arrived since the last tick'''
+        batch = self.pending
+        self.pending = []
+        self.stats['batches'] += 1
+        self.stats['requests'] += len(batch)
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+        now = self.loop.time()
+        for (writer, line) in batch:
+            request = {}
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise TypeError('a request must be a JSON object')
+                reply = self.dispatch(request, writer, now)
+            except Exception as e:
+                reply = {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+                if not isinstance(request, dict) or 'id' not in request:
+                    reply['id'] = None      # the line could not be parsed, or had no id
+            if isinstance(request, dict) and 'id' in request:
+                reply['id'] = request['id']
+            self._send(writer, reply)
+
+    def _send(self, writer, message):
+        if writer is not None and not writer.is_closing():
+            writer.write(json.dumps(message).encode('ascii') + b'\n')
+
+    def dispatch(self, request, writer, now):
+        '''handle one request, returning the reply'''
+        op = request['op']
+        if op == 'new':
+            n_stones = request.get('n_stones', 36)
+            n_pits = request.get('n_pits', 6)
+            if not isinstance(n_stones, int) or not 1 <= n_stones <= MAX_STONES:
+                raise ValueError('n_stones must be from 1 to {}'.format(MAX_STONES))
+            if not isinstance(n_pits, int) or not 1 <= n_pits <= MAX_PITS:
+                raise ValueError('n_pits must be from 1 to {}'.format(MAX_PITS))
+            game = Game(n_stones=n_stones, n_pits=n_pits)
+            game.initial_place()
+            ai_player = request.get('ai_player')
+            if ai_player not in (None, 1, 2):
+                raise ValueError('ai_player must be 1 or 2')
+            sid = self.next_session
+            self.next_session += 1
+            session = self.sessions[sid] = Session(game.to_bytes(), now, ai_player, writer)
+            self._maybe_think(sid, session, game)
+            return {'ok': True, 'session': sid, 'state': describe(game)}
+
+        session = self.sessions.get(request['session'])
+        if session is None:
+            raise KeyError('no session {}'.format(request['session']))
+        session.last_seen = now
+        if op == 'state':
+            return {'ok': True, 'state': describe(Game.from_bytes(session.snapshot))}
+        if op == 'close':
+            del self.sessions[request['session']]
+            return {'ok': True}
+        if op == 'move':
+            game = Game.from_bytes(session.snapshot)
+            pit = request['pit']
+            if game.game_over:
+                raise ValueError('the game is over')
+            if game.current_player == session.ai_player:
+                self._maybe_think(request['session'], session, game)     # in case an earlier attempt failed
+                raise ValueError('it is the AI\'s turn')
+            # check first, as play_round complains about illegal moves on stdout
+            if pit not in game.legal_moves() or game.play_round(pit) is None:
+                raise ValueError('illegal move {}'.format(pit))
+            session.snapshot = game.to_bytes()
+            self._maybe_think(request['session'], session, game)
+            return {'ok': True, 'state': describe(game)}
+        raise ValueError('unknown op {!r}'.format(op))
+
+    def _maybe_think(self, sid, session, game):
+        '''start an AI search if it is the AI's turn in this session'''
+        if game.game_over or game.current_player != session.ai_player or session.thinking:
+            return
+        session.thinking = True
+        try:
+            future = self.loop.run_in_executor(self.executor, ai_move, session.snapshot, self.ai_time)
+        except RuntimeError as e:     # the executor has been shut down
+            session.thinking = False
+            log.warning('cannot start an AI move in session %s: %r', sid, e)
+            self._send(session.owner, {'event': 'error', 'session': sid, 'error': '{}: {}'.format(type(e).__name__, e)})
+            return
+        future.add_done_callback(partial(self._ai_done, sid, session.snapshot))
+
+    def _ai_done(self, sid, snapshot, future):
+        session = self.sessions.get(sid)
+        if session is None or session.snapshot != snapshot:
+            return      # evicted or closed while the AI was thinking
+        session.thinking = False
+        game = Game.from_bytes(snapshot)
+        try:
+            pit = future.result()
+            if pit not in game.legal_moves() or game.play_round(pit) is None:
+                raise ValueError('the AI chose illegal move {!r}'.format(pit))
+        except Exception as e:
+            session.ai_failures += 1
+            log.warning('AI move failed in session %s (attempt %d): %r', sid, session.ai_failures, e)
+            if session.ai_failures < AI_ATTEMPTS:
+                self._maybe_think(sid, session, Game.from_bytes(snapshot))
+            else:
+                session.ai_failures = 0
+                self._send(session.owner, {'event': 'error', 'session': sid,
+                                           'error': '{}: {}'.format(type(e).__name__, e)})
+            return
+        session.ai_failures = 0
+        session.snapshot = game.to_bytes()
+        session.last_seen = self.loop.time()
+        self.stats['ai_moves'] += 1
+        self._send(session.owner, {'event': 'ai_move', 'session': sid, 'pit': pit, 'state': describe(game)})
+        self._maybe_think(sid, session, game)
+
+    def evict_idle(self):
+        '''remove the sessions that have been idle for longer than `idle_timeout`'''
+        cutoff = self.loop.time() - self.idle_timeout
+        idle = [sid for (sid, s) in self.sessions.items() if s.last_seen < cutoff]
+        for sid in idle:
+            del self.sessions[sid]
+        self.stats['evicted'] += len(idle)
+
+    async def _evict_periodically(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 0.01))
+            self.evict_idle()
+
+
+class Client(object):
+    '''A connection to a `BaoServer` on which many requests may be in flight at once'''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 1
+        self.waiting = {}       # request id -> future for its reply
+        self.events = {}        # session -> pushed events not yet taken by `next_event`
+        self.event_waiters = {} # session -> future for its next pushed event
+        self.task = asyncio.get_running_loop().create_task(self._read())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=7777, path=None):
+        if path is not None:
+            (reader, writer) = await asyncio.open_unix_connection(path, limit=1 << 20)
+        else:
+            (reader, writer) = await asyncio.open_connection(host, port, limit=1 << 20)
+        return cls(reader, writer)
+
+    async def _read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if 'id' in message:
+                # an error for a line the server could not read has no id to answer
+                future = self.waiting.pop(message['id'], None)
+                if future is not None:
+                    future.set_result(message)
+            else:
+                future = self.event_waiters.pop(message['session'], None)
+                if future is not None:
+                    future.set_result(message)
+                else:
+                    self.events.setdefault(message['session'], deque()).append(message)
+
+    async def request(self, op, **kwargs):
+        kwargs['op'] = op
+        kwargs['id'] = rid = self.next_id
+        self.next_id += 1
+        future = self.waiting[rid] = asyncio.get_running_loop().create_future()
+        self.writer.write(json.dumps(kwargs).encode('ascii') + b'\n')
+        return await future
+
+    async def next_event(self, session):
+        '''return the next event pushed for `session`'''
+        if self.events.get(session):
+            return self.events[session].popleft()
+        future = self.event_waiters[session] = asyncio.get_running_loop().create_future()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.task.cancel()
+
+
+async def _play_session(client, n_moves, rng, latencies, ai):
+    '''play `n_moves` random moves in one session (starting new games as needed)'''
+    moves = 0
+    while moves < n_moves:
+        reply = await client.request('new', ai_player=2 if ai else None)
+        session = reply['session']
+        state = reply['state']
+        while not state['game_over'] and moves < n_moves:
+            if ai and state['player'] == 2:
+                state = (await client.next_event(session))['state']
+                continue
+            start = time.perf_counter()
+            reply = await client.request('move', session=session, pit=rng.choice(state['moves']))
+            latencies.append(time.perf_counter() - start)
+            if not reply['ok']:
+                raise RuntimeError('move failed: {}'.format(reply))
+            state = reply['state']
+            moves += 1
+        await client.request('close', session=session)
+        client.events.pop(session, None)
+
+
+async def load(host='127.0.0.1', port=7777, path=None, sessions=10000, connections=100, moves=20, ai=False, seed=0):
+    '''Play `moves` random moves in each of `sessions` simultaneous sessions over
+    `connections` connections, and return the move latencies (p50, p99, max, in ms)
+    and throughput. With `ai=True`, the server plays player 2 in every session.'''
+    clients = [await Client.connect(host, port, path) for i in range(connections)]
+    latencies = []
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    await asyncio.gather(*[_play_session(clients[i % connections], moves, random.Random(rng.getrandbits(32)), latencies, ai)
+                           for i in range(sessions)])
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.close()
+    latencies.sort()
+
+    def percentile(p):
+        return 1000 * latencies[int(p * (len(latencies) - 1))] if latencies else 0.0
+
+    return {
+        'sessions': sessions,
+        'moves': len(latencies),
+        'seconds': elapsed,
+        'moves_per_s': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(0.50),
+        'p99_ms': percentile(0.99),
+        'max_ms': percentile(1.0),
+    }
+
+
+async def serve(args):
+    server = BaoServer(idle_timeout=args.idle_timeout, ai_time=args.ai_time)
+    listener = await server.start(args.host, args.port, args.unix)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve bao games, or load-test a server')
+    parser.add_argument('command', choices=['serve', 'load'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--unix', metavar='PATH', help='use a Unix socket instead of TCP')
+    parser.add_argument('--idle-timeout', type=float, default=300.0, help='serve: evict sessions idle this long (s)')
+    parser.add_argument('--ai-time', type=float, default=0.1, help='serve: AI time budget per move (s)')
+    parser.add_argument('--sessions', type=int, default=10000, help='load: simultaneous sessions')
+    parser.add_argument('--connections', type=int, default=100, help='load: connections to share them over')
+    parser.add_argument('--moves', type=int, default=20, help='load: moves to play per session')
+    parser.add_argument('--ai', action='store_true', help='load: let the server play player 2')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        asyncio.run(serve(args))
+    else:
+        result = asyncio.run(load(args.host, args.port, args.unix, args.sessions, args.connections, args.moves, args.ai))
+        print(json.dumps(result, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:]:
+        sys.exit(main())
+
+    # with no arguments, run a small load test against an in-process server
+    async def check():
+        server = BaoServer(idle_timeout=60, ai_time=0.01)
+        listener = await server.start(port=0)
+        port = listener.sockets[0].getsockname()[1]
+
+        client = await Client.connect(port=port)
+        reply = await client.request('move', session=12345, pit=0)
+        if reply['ok']:
+            raise RuntimeError('a move in a missing session succeeded')
+        reply = await client.request('new')
+        session = reply['session']
+        reply = await client.request('move', session=session, pit=9)
+        if reply['ok'] or 'illegal' not in reply['error']:
+            raise RuntimeError('an illegal move was accepted: {}'.format(reply))
+        for (n_stones, n_pits) in ((-1, 6), (36, 0), (MAX_STONES + 1, 6), ('36', 6)):
+            reply = await client.request('new', n_stones=n_stones, n_pits=n_pits)
+            if reply['ok']:
+                raise RuntimeError('a {}/{} game was created'.format(n_stones, n_pits))
+        await client.close()
+
+        # malformed lines get an error without an id, and the rest of the batch is still answered
+        (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'{not json\n[1, 2]\n{"id": 7, "op": "new"}\n{"id": 8\n')
+        replies = [json.loads(await reader.readline()) for i in range(4)]
+        if [(r['id'], r['ok']) for r in replies] != [(None, False), (None, False), (7, True), (None, False)]:
+            raise RuntimeError('malformed requests were mishandled: {}'.format(replies))
+        writer.close()
+        await writer.wait_closed()
+
+        for (sessions, ai) in ((200, False), (20, True)):
+            result = await load(port=port, sessions=sessions, connections=10, moves=30, ai=ai)
+            if result['moves'] != sessions * 30:
+                raise RuntimeError('load test played {} moves'.format(result['moves']))
+            print(json.dumps(result, sort_keys=True))
+        if server.stats['ai_moves'] == 0 or server.stats['max_batch'] < 2:
+            raise RuntimeError('expected AI moves and batched requests: {}'.format(server.stats))
+
+        # a failing AI is retried, then reported to the session's owner
+        from concurrent.futures import ThreadPoolExecutor
+        global ai_move
+        real_ai_move = ai_move
+        calls = []
+
+        def flaky_ai_move(snapshot, time_limit):
+            calls.append(snapshot)
+            if len(calls) % AI_ATTEMPTS:
+                raise RuntimeError('worker died')
+            return real_ai_move(snapshot, time_limit)
+
+        ai_move = flaky_ai_move
+        flaky = BaoServer(ai_time=0.01, executor=ThreadPoolExecutor(1))
+        flaky_listener = await flaky.start(port=0)
+        client = await Client.connect(port=flaky_listener.sockets[0].getsockname()[1])
+        reply = await client.request('new', ai_player=1)
+        event = await client.next_event(reply['session'])
+        if event['event'] != 'ai_move' or len(calls) != AI_ATTEMPTS:
+            raise RuntimeError('the AI move was not retried: {} after {} calls'.format(event, len(calls)))
+        ai_move = lambda snapshot, time_limit: 99
+        session = (await client.request('new', ai_player=1))['session']
+        event = await client.next_event(session)
+        if event['event'] != 'error' or 'illegal' not in event['error']:
+            raise RuntimeError('a failing AI was not reported: {}'.format(event))
+        ai_move = real_ai_move
+        # the human's move is refused, but starts the AI again
+        reply = await client.request('move', session=session, pit=7)
+        event = await client.next_event(session)
+        if reply['ok'] or event['event'] != 'ai_move':
+            raise RuntimeError('a move request did not restart the AI: {}'.format(event))
+        await client.close()
+        flaky_listener.close()
+        await flaky_listener.wait_closed()
+        flaky.close()
+
+        # idle sessions are evicted
+        client = await Client.connect(port=port)
+        await client.request('new')
+        await client.close()
+        server.idle_timeout = 0.05
+        await asyncio.sleep(0.1)
+        server.evict_idle()
+        if server.sessions:
+            raise RuntimeError('{} idle sessions were not evicted'.format(len(server.sessions)))
+        print(server.stats)
+        listener.close()
+        await listener.wait_closed()
+        server.close()
+
+    asyncio.run(check())
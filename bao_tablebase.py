@@ -0,0 +1,266 @@
+# file: bao_tablebase.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Endgame tablebase for bao (Kalah).
+
+Once a seed reaches a target it never leaves, so how a game ends only depends
+on the seeds still in play (in the non-target pits). The tablebase stores, for
+every position with up to `max_seeds` seeds in play, the value under perfect
+play: the seeds the player to move will still gain, minus the seeds their
+opponent will gain.
+
+Positions are seen from the player to move: their `n_pits` pits first (in
+sowing order), then the opponent's. This folds player 1 and player 2 to move
+into one table. A position `x` is indexed by its rank among all tuples of
+`2*n_pits` counts summing to at most `max_seeds`, in lexicographic order, which
+is a perfect hash onto `0 .. C(max_seeds + 2*n_pits, 2*n_pits) - 1`.
+
+The table is solved by backward induction. A move either puts a seed into a
+target (fewer seeds in play), or only moves the mover's seeds further along
+their own row. So positions are solved in order of increasing seeds in play and,
+within that, decreasing `potential` (the sum of each seed's column), and every
+position a move can reach is solved before the position itself.
+
+The file is a small header followed by one signed byte per position, and
+`Tablebase` memory-maps it, so processes on one machine share a single copy.
+'''
+
+from __future__ import print_function, division
+import mmap
+import struct
+
+from bao_compact import CompactGame
+
+MAGIC = b'BAOTB001'
+HEADER = struct.Struct('<8sHHHHQ')
+
+
+class Ranking(object):
+    '''Perfect hash for tuples of `n_parts` non-negative counts summing to at most `max_sum`'''
+
+    def __init__(self, n_parts, max_sum):
+        self.n_parts = n_parts
+        self.max_sum = max_sum
+        size = max_sum + n_parts + 2
+        self.binom = [[0] * size for i in range(size)]
+        for a in range(size):
+            self.binom[a][0] = 1
+            for b in range(1, a + 1):
+                self.binom[a][b] = self.binom[a - 1][b - 1] + self.binom[a - 1][b]
+        self.size = self.count(n_parts, max_sum)
+
+    def count(self, parts, budget):
+        '''number of tuples of `parts` counts that sum to at most `budget`'''
+        return self.binom[budget + parts][parts]
+
+    def rank(self, counts):
+        binom = self.binom
+        r = 0
+        budget = self.max_sum
+        k = self.n_parts
+        for x in counts:
+            k -= 1
+            # skip every tuple starting with a smaller count here
+            if x:
+                r += binom[budget + k + 1][k + 1] - binom[budget - x + k + 1][k + 1]
+                budget -= x
+        return r
+
+    def unrank(self, r):
+        counts = []
+        budget = self.max_sum
+        for k in range(self.n_parts - 1, -1, -1):
+            x = 0
+            while True:
+                block = self.count(k, budget - x)
+                if r < block:
+                    break
+                r -= block
+                x += 1
+            counts.append(x)
+            budget -= x
+        return counts
+
+
+def compositions(total, parts):
+    '''generate every tuple of `parts` counts that sum to exactly `total`'''
+    if parts == 1:
+        yield (total,)
+        return
+    for first in range(total, -1, -1):
+        for rest in compositions(total - first, parts - 1):
+            yield (first,) + rest
+
+
+def relative_pits(board, player, n_pits):
+    '''return the non-target pits of `board` as seen by `player`: their own pits, then the opponent's'''
+    if player == 1:
+        return board[:n_pits] + board[n_pits + 1:2 * n_pits + 1]
+    return board[n_pits + 1:2 * n_pits + 1] + board[:n_pits]
+
+
+def build(filename, n_pits=6, max_seeds=8, n_stones=36, progress=False):
+    '''Solve every position with up to `max_seeds` seeds in play and write the table to `filename`.
+    `n_stones` is the seed total of the game; it caps `max_seeds` and is recorded in the header.
+    Values are stored as signed bytes, so `max_seeds` can be at most 127.'''
+    max_seeds = min(max_seeds, n_stones)
+    if max_seeds > 127:
+        raise ValueError('max_seeds must be at most 127, not {}'.format(max_seeds))
+    n_parts = 2 * n_pits
+    ranking = Ranking(n_parts, max_seeds)
+    values = bytearray(ranking.size)
+    rank = ranking.rank
+
+    def value(counts):
+        v = values[rank(counts)]
+        return v - 256 if v > 127 else v
+
+    cg = CompactGame(n_stones=n_stones, n_pits=n_pits)
+    board = cg.board
+    for in_play in range(max_seeds + 1):
+        # bucket this level by potential, then solve from the highest potential down
+        buckets = [[] for i in range(in_play * (n_pits - 1) + 1)]
+        for counts in compositions(in_play, n_parts):
+            potential = sum(i % n_pits * c for (i, c) in enumerate(counts))
+            buckets[potential].append(counts)
+        for bucket in reversed(buckets):
+            for counts in bucket:
+                own = counts[:n_pits]
+                if not any(own):
+                    # no moves: the opponent sweeps their own seeds
+                    best = -in_play
+                else:
+                    best = None
+                    for move in range(n_pits):
+                        if not own[move]:
+                            continue
+                        board[:] = list(own) + [0] + list(counts[n_pits:]) + [0]
+                        cg.current_player = 1
+                        cg.game_over = False
+                        cg.play_round(move)
+                        v = board[n_pits] - board[2 * n_pits + 1]
+                        if not cg.game_over:
+                            child = relative_pits(board, cg.current_player, n_pits)
+                            v = v + value(child) if cg.current_player == 1 else v - value(child)
+                        if best is None or v > best:
+                            best = v
+                values[rank(counts)] = best & 0xff
+        if progress:
+            print('Solved positions with {} seeds in play'.format(in_play))
+
+    with open(filename, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, 1, n_pits, max_seeds, n_stones, ranking.size))
+        fp.write(values)
+
+
+class Tablebase(object):
+    '''Read-only, memory-mapped view of a tablebase file'''
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.n_pits, self.max_seeds, self.n_stones, size) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise RuntimeError('{} is not a bao tablebase'.format(filename))
+        self.ranking = Ranking(2 * self.n_pits, self.max_seeds)
+        if size != self.ranking.size or len(self.mm) != HEADER.size + size:
+            raise RuntimeError('{} is truncated or corrupt'.format(filename))
+        self.hits = 0
+        self.probes = 0
+
+    def close(self):
+        self.mm.close()
+
+    def value(self, counts):
+        '''value of a position given as (mover's pits, opponent's pits)'''
+        return struct.unpack_from('b', self.mm, HEADER.size + self.ranking.rank(counts))[0]
+
+    def probe(self, game):
+        '''return the value of `game` for the player to move, or None if the position is not in the table.
+        `game` may be a `CompactGame` or a `bao_engine.Game`.'''
+        self.probes += 1
+        if game.n_pits != self.n_pits or game.game_over:
+            return None
+        board = getattr(game, 'board', None)
+        if board is None:
+            board = [p.count_stones() for p in game.pits]
+        counts = relative_pits(board, game.current_player, self.n_pits)
+        if sum(counts) > self.max_seeds:
+            return None
+        self.hits += 1
+        return self.value(counts)
+
+    def final_scores(self, game):
+        '''return the final score [p1_score, p2_score] of `game` under perfect play, or None'''
+        v = self.probe(game)
+        if v is None:
+            return None
+        board = getattr(game, 'board', None)
+        if board is None:
+            board = [p.count_stones() for p in game.pits]
+        n = self.n_pits
+        in_play = sum(board) - board[n] - board[2 * n + 1]
+        mover_gain = (in_play + v) // 2
+        gains = [mover_gain, in_play - mover_gain]
+        if game.current_player == 2:
+            gains.reverse()
+        return [board[n] + gains[0], board[2 * n + 1] + gains[1]]
+
+
+if __name__ == '__main__':
+    import os
+    import random
+    import tempfile
+    import time
+    from bao_compact import random_game
+    from bao_ai import AlphaBetaPlayer
+
+    # the ranking is a bijection
+    ranking = Ranking(4, 5)
+    seen = set()
+    for total in range(6):
+        for counts in compositions(total, 4):
+            r = ranking.rank(counts)
+            if ranking.unrank(r) != list(counts):
+                raise RuntimeError('unrank(rank({})) failed'.format(counts))
+            seen.add(r)
+    if seen != set(range(ranking.size)):
+        raise RuntimeError('ranking is not a perfect hash')
+
+    # values past a signed byte cannot be stored
+    try:
+        build(os.devnull, n_pits=1, max_seeds=128, n_stones=480)
+    except ValueError:
+        pass
+    else:
+        raise RuntimeError('a table with values past 127 was built')
+
+    fd, filename = tempfile.mkstemp(suffix='.tb')
+    os.close(fd)
+    try:
+        start = time.time()
+        build(filename, n_pits=6, max_seeds=6)
+        print('Built a 6 seed tablebase in {:.1f}s ({} bytes)'.format(time.time() - start, os.path.getsize(filename)))
+        tb = Tablebase(filename)
+
+        # tablebase values must agree with an exhaustive search
+        rng = random.Random(3)
+        checked = 0
+        while checked < 25:
+            cg, scores = random_game(tablebase=tb, rng=rng)
+            if cg.game_over or len(cg.legal_moves()) == 1:
+                continue
+            ai = AlphaBetaPlayer(time_limit=None)
+            ai.choose_move(cg)
+            n = cg.n_pits
+            diff = cg.board[n] - cg.board[2 * n + 1]
+            diff = diff if cg.current_player == 1 else -diff
+            if ai.stats['value'] != diff + tb.probe(cg):
+                raise RuntimeError('tablebase value {} != search value {} for {}'.format(diff + tb.probe(cg), ai.stats['value'], cg))
+            if sum(scores) != cg.n_stones:
+                raise RuntimeError('tablebase scores {} do not add up'.format(scores))
+            checked += 1
+        tb.close()
+    finally:
+        os.remove(filename)
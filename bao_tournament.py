@@ -0,0 +1,392 @@
+# file: bao_tournament.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Play move policies against each other and rate them.
+
+A policy is any callable taking a `bao_engine.Game` (which it must leave as it
+found it) and returning the pit to sow, like `random_policy`, `greedy_policy`,
+an `AlphaBetaPlayer` or an `MCTSPlayer`. Policies are sent to worker
+processes, so they must pickle (module level functions and player objects do).
+
+`Tournament` pairs the players round-robin (every pair, once with each colour,
+per round) or Swiss (players on similar scores meet, and nobody meets the same
+opponent twice if it can be helped), plays each round's games on a process
+pool, and appends each result to a CSV or JSONL file as soon as the game
+finishes. Elo ratings, with 95% confidence intervals, are updated after every
+game. Started again with the same results file, a tournament picks up where
+it stopped: games already in the file are not replayed.
+
+    t = Tournament({'random': random_policy, 'greedy': greedy_policy}, 'results.jsonl', rounds=50)
+    for row in t.standings():
+        print(row)
+'''
+
+from __future__ import print_function, division
+import copy
+import csv
+import json
+import math
+import os
+import random
+import time
+import zlib
+
+from bao_engine import Game
+from bao_rollout import game_seed
+
+FIELDS = ['round', 'p1', 'p2', 'score1', 'score2', 'result', 'plies', 'seconds', 'moves', 'error']
+
+
+def random_policy(game):
+    '''a legal move, at random'''
+    return game.random_move()
+
+
+def greedy_policy(game):
+    '''the move that leaves the mover furthest ahead in targets (ties at random)'''
+    player = game.current_player
+    best = []
+    best_value = None
+    for move in list(game.legal_moves()):
+        game.make_move(move)
+        score = game.score
+        game.unmake_move()
+        value = score[0] - score[1] if player == 1 else score[1] - score[0]
+        if best_value is None or value > best_value:
+            best = [move]
+            best_value = value
+        elif value == best_value:
+            best.append(move)
+    return random.choice(best)
+
+
+def play_match(task):
+    '''Play one game. `task` is `(round, p1, p2, policy1, policy2, seed, n_stones, n_pits)`.
+    Returns the result row (see `FIELDS`); `result` is player 1's points (1, 0.5 or 0).
+    A policy that returns an illegal move, or raises, forfeits the game.
+    Each game gets fresh copies of the policies, so no state (a transposition
+    table, say) carries over from the games a worker played before.'''
+    (rnd, p1, p2, policy1, policy2, seed, n_stones, n_pits) = task
+    random.seed(seed)
+    (policy1, policy2) = copy.deepcopy((policy1, policy2))
+    game = Game(n_stones=n_stones, n_pits=n_pits)
+    game.initial_place()
+    policies = {1: policy1, 2: policy2}
+    moves = []
+    error = ''
+    start = time.time()
+    while not game.game_over:
+        player = game.current_player
+        try:
+            move = policies[player](game)
+            legal = move in game.legal_moves()
+        except Exception as e:
+            (move, legal) = (None, False)
+            error = '{}: {}'.format(type(e).__name__, e)
+        if not legal:
+            error = error or 'illegal move {!r}'.format(move)
+            result = 0.0 if player == 1 else 1.0
+            break
+        game.play_round(move)
+        moves.append(move)
+    else:
+        score = game.score
+        result = 1.0 if score[0] > score[1] else 0.0 if score[0] < score[1] else 0.5
+    score = game.score
+    return {'round': rnd, 'p1': p1, 'p2': p2, 'score1': score[0], 'score2': score[1], 'result': result,
+            'plies': len(moves), 'seconds': time.time() - start,
+            'moves': ','.join(str(m) for m in moves), 'error': error}
+
+
+class ResultsFile(object):
+    '''Append-only results, as CSV or (if the name ends in `.jsonl`) JSON lines'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.jsonl = filename.endswith('.jsonl')
+
+    def read(self):
+        '''return the rows already in the file, first cutting off a last line
+        left unfinished by an interrupted write (so appending starts cleanly)'''
+        if not os.path.exists(self.filename):
+            return []
+        with open(self.filename, 'r+b') as fp:
+            data = fp.read()
+            if not data.endswith(b'\n'):
+                fp.truncate(data.rfind(b'\n') + 1)
+        with open(self.filename) as fp:
+            if self.jsonl:
+                rows = [json.loads(line) for line in fp]
+            else:
+                rows = list(csv.DictReader(fp))
+        for row in rows:
+            for name in ('round', 'score1', 'score2', 'plies'):
+                row[name] = int(row[name])
+            for name in ('result', 'seconds'):
+                row[name] = float(row[name])
+        return rows
+
+    def append(self, row):
+        new = not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0
+        with open(self.filename, 'a') as fp:
+            if self.jsonl:
+                fp.write(json.dumps(row, sort_keys=True) + '\n')
+            else:
+                writer = csv.DictWriter(fp, FIELDS)
+                if new:
+                    writer.writeheader()
+                writer.writerow(row)
+
+
+class EloRatings(object):
+    '''Elo ratings, updated one game at a time with a fixed `k_factor`.
+    The confidence interval of a rating is the Wilson score interval of the
+    player's score fraction, mapped onto the Elo scale around their rating.'''
+
+    def __init__(self, names, k_factor=16, initial=1500.0):
+        self.k_factor = k_factor
+        self.ratings = dict((name, initial) for name in names)
+        self.counts = dict((name, [0, 0, 0]) for name in names)     # wins, draws, losses
+
+    def update(self, p1, p2, result):
+        '''record a game in which `p1` scored `result` (1, 0.5 or 0) against `p2`'''
+        expected = 1 / (1 + 10 ** ((self.ratings[p2] - self.ratings[p1]) / 400))
+        delta = self.k_factor * (result - expected)
+        self.ratings[p1] += delta
+        self.ratings[p2] -= delta
+        for (name, points) in ((p1, result), (p2, 1 - result)):
+            self.counts[name][0 if points == 1 else 1 if points == 0.5 else 2] += 1
+
+    def interval(self, name, z=1.96):
+        '''return `(low, high)`: the confidence interval of `name`'s rating'''
+        (wins, draws, losses) = self.counts[name]
+        n = wins + draws + losses
+        if n == 0:
+            return (-float('inf'), float('inf'))
+        p = (wins + draws / 2) / n
+        centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+        half = z / (1 + z * z / n) * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        # a perfect score only bounds the rating from one side; go half a game past it
+        edge = 0.5 / (n + 1)
+
+        def elo(q):
+            q = min(max(q, edge), 1 - edge)
+            return -400 * math.log10(1 / q - 1)
+
+        rating = self.ratings[name]
+        return (rating + elo(centre - half) - elo(centre), rating + elo(centre + half) - elo(centre))
+
+
+class Tournament(object):
+    '''A tournament between the policies in `players` (a dictionary of name: policy),
+    recording results in `results_file`.
+    * `pairing` is 'round-robin' or 'swiss'
+    * `rounds` is the number of rounds. A round-robin round is two games (one with
+      each colour) per pair of players; a Swiss round is one game per player.
+    * `processes` is the number of worker processes (default: one per CPU; 1 plays here)
+    * `seed` seeds every game, so a tournament can be replayed exactly'''
+
+    def __init__(self, players, results_file, pairing='round-robin', rounds=1, processes=None,
+                 n_stones=36, n_pits=6, seed=0, k_factor=16):
+        if pairing not in ('round-robin', 'swiss'):
+            raise ValueError('unknown pairing {!r}'.format(pairing))
+        self.players = players
+        self.names = sorted(players)
+        self.results = ResultsFile(results_file)
+        self.pairing = pairing
+        self.rounds = rounds
+        self.processes = processes
+        self.n_stones = n_stones
+        self.n_pits = n_pits
+        self.seed = seed
+        self.elo = EloRatings(self.names, k_factor)
+        self.points = dict((name, 0.0) for name in self.names)
+        self.played = {}        # (round, p1, p2) -> row
+        self.rows = []          # in the order they were recorded
+        for row in self.results.read():
+            self._record(row)
+
+    def _record(self, row):
+        self.played[(row['round'], row['p1'], row['p2'])] = row
+        self.rows.append(row)
+        self._score(row, self.points, self.elo)
+
+    @staticmethod
+    def _score(row, points, elo):
+        if row['p2'] == '':
+            points[row['p1']] += 1
+            return
+        points[row['p1']] += row['result']
+        points[row['p2']] += 1 - row['result']
+        elo.update(row['p1'], row['p2'], row['result'])
+
+    def pairings(self, rnd):
+        '''return the `(p1, p2)` games of round `rnd` (`p2` is '' for a bye)'''
+        if self.pairing == 'round-robin':
+            return [(a, b) for a in self.names for b in self.names if a != b]
+
+        # Swiss: best-placed first, each paired with the best-placed opponent not yet met.
+        # Only earlier rounds count, so a round is paired the same way however
+        # much of it (or of later rounds) is already in the results file.
+        points = dict((name, 0.0) for name in self.names)
+        elo = EloRatings(self.names, self.elo.k_factor)
+        met = set()
+        byes = set()
+        as_p1 = dict((name, 0) for name in self.names)
+        for row in self.rows:
+            if row['round'] >= rnd:
+                continue
+            self._score(row, points, elo)
+            if row['p2'] == '':
+                byes.add(row['p1'])
+                continue
+            met.add((row['p1'], row['p2']))
+            met.add((row['p2'], row['p1']))
+            as_p1[row['p1']] += 1
+        ranked = sorted(self.names, key=lambda n: (-points[n], -elo.ratings[n], n))
+        games = []
+        if len(ranked) % 2:
+            bye = [n for n in reversed(ranked) if n not in byes] or ranked[-1:]
+            ranked.remove(bye[0])
+            games.append((bye[0], ''))
+        while ranked:
+            a = ranked.pop(0)
+            b = next((n for n in ranked if (a, n) not in met), ranked[0])
+            ranked.remove(b)
+            # whoever has had the first move less often gets it
+            games.append((a, b) if (as_p1[a], rnd % 2) <= (as_p1[b], 0) else (b, a))
+        return games
+
+    def _seed(self, rnd, p1, p2):
+        return game_seed(self.seed, zlib.crc32('{}:{}:{}'.format(rnd, p1, p2).encode('utf-8')) & 0xffffffff)
+
+    def run(self, progress=None):
+        '''play every game not already in the results file. If given,
+        `progress(row)` is called as each game finishes. Returns `standings()`.'''
+        for rnd in range(self.rounds):
+            tasks = []
+            pairings = self.pairings(rnd)
+            if any(r == rnd and (p1, p2) not in pairings for (r, p1, p2) in self.played):
+                raise RuntimeError('{} does not match this tournament (round {})'.format(self.results.filename, rnd))
+            for (p1, p2) in pairings:
+                if (rnd, p1, p2) in self.played:
+                    continue
+                if p2 == '':
+                    row = {'round': rnd, 'p1': p1, 'p2': '', 'score1': 0, 'score2': 0, 'result': 1.0,
+                           'plies': 0, 'seconds': 0.0, 'moves': '', 'error': 'bye'}
+                    self.results.append(row)
+                    self._record(row)
+                    continue
+                tasks.append((rnd, p1, p2, self.players[p1], self.players[p2],
+                              self._seed(rnd, p1, p2), self.n_stones, self.n_pits))
+            for row in self._play(tasks):
+                self.results.append(row)
+                self._record(row)
+                if progress is not None:
+                    progress(row)
+        return self.standings()
+
+    def _play(self, tasks):
+        '''generate results in the order games finish'''
+        if self.processes == 1 or not tasks:
+            for task in tasks:
+                yield play_match(task)
+            return
+        import multiprocessing
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            for row in pool.imap_unordered(play_match, tasks):
+                yield row
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def standings(self):
+        '''a list of `{name, games, points, rating, low, high}`, best rating first'''
+        rows = []
+        for name in self.names:
+            (low, high) = self.elo.interval(name)
+            rows.append({'name': name, 'games': sum(self.elo.counts[name]), 'points': self.points[name],
+                         'rating': round(self.elo.ratings[name], 1), 'low': round(low, 1), 'high': round(high, 1)})
+        return sorted(rows, key=lambda row: -row['rating'])
+
+
+if __name__ == '__main__':
+    import shutil
+    import tempfile
+    from bao_ai import AlphaBetaPlayer
+    from bao_engine import play_game
+
+    players = {
+        'random': random_policy,
+        'greedy': greedy_policy,
+        'alphabeta': AlphaBetaPlayer(max_depth=3, time_limit=None, tt_size_log2=10),
+    }
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # a tournament interrupted part way must finish with the same results
+        for name in ('results.jsonl', 'results.csv'):
+            whole = Tournament(players, os.path.join(tmpdir, 'whole-' + name), rounds=4, processes=2)
+            whole.run()
+            filename = os.path.join(tmpdir, name)
+            part = Tournament(players, filename, rounds=2, processes=1)
+            part.run()
+            resumed = Tournament(players, filename, rounds=4, processes=1)
+            played = []
+            resumed.run(progress=played.append)
+            if len(played) != 2 * 6:
+                raise RuntimeError('resuming replayed {} games'.format(len(played)))
+            key = lambda row: (row['round'], row['p1'], row['p2'])
+            rows = sorted(ResultsFile(filename).read(), key=key)
+            if [(key(r), r['moves']) for r in rows] != [(key(r), r['moves']) for r in sorted(whole.results.read(), key=key)]:
+                raise RuntimeError('resumed tournament differs from an uninterrupted one')
+            for row in rows:
+                if play_game([int(m) for m in row['moves'].split(',')])[1] != [row['score1'], row['score2']]:
+                    raise RuntimeError('result {} does not replay'.format(row))
+        print(resumed.standings())
+        if resumed.standings()[-1]['name'] != 'random':
+            raise RuntimeError('random play should come last')
+
+        # Swiss: everyone plays once a round, and nobody meets twice while they need not
+        swiss_players = dict(('p{}'.format(i), random_policy) for i in range(5))
+        swiss_players['greedy'] = greedy_policy
+        t = Tournament(swiss_players, os.path.join(tmpdir, 'swiss.jsonl'), pairing='swiss', rounds=5, processes=1)
+        t.run()
+        pairs = [frozenset((p1, p2)) for (r, p1, p2) in t.played]
+        if len(pairs) != 5 * 3 or len(set(pairs)) != len(pairs):
+            raise RuntimeError('Swiss pairings repeat: {}'.format(sorted(t.played)))
+        print(t.standings())
+
+        # a Swiss tournament cut off part way through a round (and through a
+        # line) resumes with the same pairings, and a finished one plays nothing
+        swiss_players['p5'] = random_policy
+        for name in ('swiss-resume.jsonl', 'swiss-resume.csv'):
+            whole = Tournament(swiss_players, os.path.join(tmpdir, 'whole-' + name), pairing='swiss', rounds=4, processes=1)
+            whole.run()
+            with open(whole.results.filename) as fp:
+                lines = fp.readlines()
+            filename = os.path.join(tmpdir, name)
+            with open(filename, 'w') as fp:
+                fp.writelines(lines[:len(lines) // 2])
+                fp.write(lines[len(lines) // 2][:20])
+            Tournament(swiss_players, filename, pairing='swiss', rounds=4, processes=1).run()
+            played = []
+            resumed = Tournament(swiss_players, filename, pairing='swiss', rounds=4, processes=1)
+            resumed.run(progress=played.append)
+            if played:
+                raise RuntimeError('a finished Swiss tournament replayed {} games'.format(len(played)))
+            key = lambda row: (row['round'], row['p1'], row['p2'])
+            rows = resumed.results.read()
+            if len(rows) != 4 * 4:
+                raise RuntimeError('expected 3 games and a bye a round, not {} rows'.format(len(rows)))
+            if sorted((key(r), r['moves']) for r in rows) != sorted((key(r), r['moves']) for r in whole.results.read()):
+                raise RuntimeError('resumed Swiss tournament differs from an uninterrupted one')
+
+        # a policy that cheats forfeits
+        row = play_match((0, 'cheat', 'random', lambda game: 99, random_policy, 1, 36, 6))
+        if row['result'] != 0.0 or 'illegal' not in row['error']:
+            raise RuntimeError('an illegal move did not forfeit: {}'.format(row))
+    finally:
+        shutil.rmtree(tmpdir)
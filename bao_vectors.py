@@ -0,0 +1,204 @@
+# file: bao_vectors.py
+# copyright: Copyright (C) 2016 Kjell Wooding
+# license:  MIT. See LICENSE for complete license text
+
+'''Reading, writing and verifying test vectors (move logs) in a streaming way.
+
+A test vector is a move list and the final score it should produce. Three file
+formats are supported:
+
+* `json`: a JSON list of `[move list, [p1_score, p2_score]]` entries. This is
+  the original `test_vectors.json` format. Files may hold several such lists
+  one after another. They are read whole.
+* `jsonl`: one `[move list, [p1_score, p2_score]]` entry per line.
+* `binary`: an 8 byte magic (`BAOMV001`), then `n_stones` and `n_pits` as
+  little-endian uint16. Each game is then `n_moves`, `p1_score` and `p2_score`
+  as little-endian uint16, followed by one byte per move.
+
+`jsonl` and `binary` files are read one game at a time, so memory use does not
+grow with the file.
+'''
+
+from __future__ import print_function
+import json
+import struct
+
+MAGIC = b'BAOMV001'
+FILE_HEADER = struct.Struct('<HH')
+GAME_HEADER = struct.Struct('<HHH')
+
+
+def guess_format(filename):
+    '''guess the format of a test vector file from its name and, if it exists, its contents'''
+    try:
+        with open(filename, 'rb') as fp:
+            start = fp.read(len(MAGIC))
+        if start == MAGIC:
+            return 'binary'
+    except IOError:
+        pass
+    if filename.endswith('.jsonl'):
+        return 'jsonl'
+    if filename.endswith('.bin'):
+        return 'binary'
+    return 'json'
+
+
+class VectorWriter(object):
+    '''Write test vectors one at a time. Use as a context manager:
+
+        with VectorWriter('games.bin') as w:
+            w.write(move_list, score)
+    '''
+
+    def __init__(self, filename, format=None, n_stones=36, n_pits=6):
+        self.format = format or guess_format(filename)
+        self.fp = open(filename, 'wb' if self.format == 'binary' else 'w')
+        self.count = 0
+        if self.format == 'binary':
+            self.fp.write(MAGIC + FILE_HEADER.pack(n_stones, n_pits))
+        elif self.format == 'json':
+            self.fp.write('[')
+
+    def write(self, move_list, score):
+        if self.format == 'binary':
+            self.fp.write(GAME_HEADER.pack(len(move_list), score[0], score[1]))
+            self.fp.write(bytes(bytearray(move_list)))
+        elif self.format == 'jsonl':
+            self.fp.write(json.dumps([list(move_list), list(score)]) + '\n')
+        else:
+            self.fp.write((', ' if self.count else '') + json.dumps([list(move_list), list(score)]))
+        self.count += 1
+
+    def close(self):
+        if self.format == 'json':
+            self.fp.write(']')
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_vectors(filename, format=None):
+    '''generate the `(move list, score)` test vectors in `filename`'''
+    format = format or guess_format(filename)
+    if format == 'binary':
+        with open(filename, 'rb') as fp:
+            if fp.read(len(MAGIC)) != MAGIC:
+                raise RuntimeError('{} is not a binary move log'.format(filename))
+            fp.read(FILE_HEADER.size)
+            while True:
+                header = fp.read(GAME_HEADER.size)
+                if not header:
+                    return
+                (n_moves, s1, s2) = GAME_HEADER.unpack(header)
+                yield (list(bytearray(fp.read(n_moves))), [s1, s2])
+    elif format == 'jsonl':
+        with open(filename, 'r') as fp:
+            for line in fp:
+                if line.strip():
+                    (ml, score) = json.loads(line)
+                    yield (ml, score)
+    else:
+        with open(filename, 'r') as fp:
+            data = fp.read()
+        decoder = json.JSONDecoder()
+        idx = 0
+        while idx < len(data):
+            if data[idx].isspace():
+                idx += 1
+                continue
+            (tv, idx) = decoder.raw_decode(data, idx)
+            for (ml, score) in tv:
+                yield (ml, score)
+
+
+def game_config(filename, format=None):
+    '''return `(n_stones, n_pits)` for a test vector file (only binary files record it)'''
+    if (format or guess_format(filename)) == 'binary':
+        with open(filename, 'rb') as fp:
+            fp.read(len(MAGIC))
+            return FILE_HEADER.unpack(fp.read(FILE_HEADER.size))
+    return (36, 6)
+
+
+def verify_chunk(task):
+    '''replay a chunk of test vectors with the compact engine.
+    `task` is `(first_index, vectors, n_stones, n_pits)`.
+    Returns `(count, mismatches)`, mismatches being `(index, move list, expected score, score)`'''
+    from bao_compact import play_game
+    (first, vectors, n_stones, n_pits) = task
+    mismatches = []
+    for (i, (ml, score)) in enumerate(vectors):
+        cg, s = play_game(ml, n_stones, n_pits)
+        if s != list(score):
+            mismatches.append((first + i, ml, list(score), s))
+    return (len(vectors), mismatches)
+
+
+def _chunks(vectors, chunk_size, n_stones, n_pits):
+    chunk = []
+    first = 0
+    for tv in vectors:
+        chunk.append(tv)
+        if len(chunk) == chunk_size:
+            yield (first, chunk, n_stones, n_pits)
+            first += len(chunk)
+            chunk = []
+    if chunk:
+        yield (first, chunk, n_stones, n_pits)
+
+
+def verify_stream(filename, format=None, processes=None, chunk_size=1000, progress=None):
+    '''Replay every test vector in `filename` on a pool of `processes` workers.
+    Generates mismatches, as `(index, move list, expected score, score)`, as they are found.
+    If given, `progress(games_checked)` is called after each chunk.'''
+    from bao_rollout import imap_bounded
+    format = format or guess_format(filename)
+    (n_stones, n_pits) = game_config(filename, format)
+    tasks = _chunks(read_vectors(filename, format), chunk_size, n_stones, n_pits)
+    checked = 0
+    for (count, mismatches) in imap_bounded(verify_chunk, tasks, processes):
+        checked += count
+        for mismatch in mismatches:
+            yield mismatch
+        if progress is not None:
+            progress(checked)
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    vectors = list(read_vectors('test_vectors.json'))
+    if list(verify_stream('test_vectors.json', processes=1)):
+        raise RuntimeError('test_vectors.json does not verify')
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for (name, format) in (('tv.jsonl', None), ('tv.bin', None), ('tv.json', 'json')):
+            filename = os.path.join(tmpdir, name)
+            with VectorWriter(filename, format) as w:
+                for (ml, score) in vectors:
+                    w.write(ml, score)
+            if list(read_vectors(filename)) != vectors:
+                raise RuntimeError('{} did not round-trip'.format(name))
+            if list(verify_stream(filename, processes=2, chunk_size=7)):
+                raise RuntimeError('{} does not verify'.format(name))
+
+        # a bad score must be reported
+        filename = os.path.join(tmpdir, 'bad.bin')
+        with VectorWriter(filename) as w:
+            for (i, (ml, score)) in enumerate(vectors):
+                w.write(ml, [score[1], score[0]] if i == 3 and score[0] != score[1] else score)
+        bad = [index for (index, ml, expected, s) in verify_stream(filename, processes=2, chunk_size=7)]
+        if bad != [3]:
+            raise RuntimeError('expected a mismatch in game 3, found {}'.format(bad))
+        print('Verified {} test vectors in every format ({} bytes as binary)'.format(len(vectors), os.path.getsize(filename)))
+    finally:
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
@@ -1,45 +1,78 @@
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.gridlayout import GridLayout
-from kivy.properties import ObjectProperty, NumericProperty, ListProperty
+from kivy.properties import ObjectProperty, NumericProperty, ListProperty, BooleanProperty
 import bao_engine as Bao
 from kivy.logger import Logger
-from kivy.uix.image import Image
-from kivy.utils import get_color_from_hex
+from kivy.clock import Clock
 from random import randrange
-from kivy.animation import Animation
+from threading import Event, Lock, Thread
+from bao_ai import AlphaBetaPlayer
+from bao_compact import CompactGame
+from bao_render import StoneRenderer
 
 class Pit(BoxLayout):
     def choose_pit(self):
         '''Pit was touched. Act on the touch'''
         Logger.debug('Pit: Touch on {}'.format(self.pit_obj))
-        self.board.engine.play_round(self.pit_obj.id)
-        self.board.stone_locations = self.board.engine.stones[:]
-        self.board.animate_stones(self.board.stone_locations)
-        self.board.turn_no += 1
-        self.board.scores = self.board.engine.score
-        self.board.curr_player = self.board.engine.current_player
+        if self.board.computer_to_move():
+            return
+        self.board.play_move(self.pit_obj.id)
 
-class Stone(Image):
-    pass
+class ComputerOpponent(object):
+    '''Chooses moves with an `AlphaBetaPlayer` in a background thread, so the UI
+    keeps running while it thinks. The search runs on a `CompactGame` snapshot,
+    and its move is handed back to the main thread with `Clock.schedule_once`.'''
+    def __init__(self, time_limit=1.0):
+        self.player = AlphaBetaPlayer(time_limit=time_limit)
+        self.lock = Lock()      # one search at a time: the player's tables are not shared
+        self.stop = None
+
+    def think(self, engine, callback):
+        '''start searching for a move in `engine`; `callback(move)` is called on the main thread'''
+        self.cancel()
+        snapshot = CompactGame.from_game(engine)
+        stop = self.stop = Event()
+
+        def work():
+            with self.lock:
+                if stop.is_set():
+                    return
+                move = self.player.choose_move(snapshot, stop=stop)
+            Logger.debug('ComputerOpponent: chose {} {}'.format(move, self.player.stats))
+            if not stop.is_set():
+                Clock.schedule_once(lambda dt: None if stop.is_set() else callback(move))
+
+        worker = Thread(target=work)
+        worker.daemon = True
+        worker.start()
+
+    def cancel(self):
+        '''abandon the current search, if any; its move will never be delivered'''
+        if self.stop is not None:
+            self.stop.set()
+            self.stop = None
 
 class BaoGame(BoxLayout):
     stone_locations = ObjectProperty(None)
     turn_no = NumericProperty(0)
     scores = ListProperty(None)
     curr_player = NumericProperty(None)
+    vs_computer = BooleanProperty(False)
+    computer_player = NumericProperty(2)
+    computer_time = NumericProperty(1.0)
     def __init__(self, **kwargs):
         super(BaoGame, self).__init__(**kwargs)
         self.engine = Bao.Game()
+        self.renderer = StoneRenderer(self.canvas.after, self.engine, self.pos_to_coords)
+        self.opponent = ComputerOpponent(self.computer_time)
+        self.started = False
         self.link_pits()
         self.init_stones()
 
     def move_stones(self, inst, value):
-        sl = [s.kivy_obj for s in self.engine.stones if s.pit == inst.pit_obj.id]
-        for s in sl:
-            my_pos = self.pos_to_coords(s.stone_obj.position, inst)
-            s.x = my_pos[0]
-            s.y = my_pos[1]
+        '''a pit moved or was resized: reposition just the stones in it'''
+        self.renderer.pit_moved(inst)
 
     def pos_to_coords(self, pos, obj, rows=4, cols=4):
         '''given a position (integer), compute its coordinates inside the supplied `obj`'''
@@ -56,15 +89,9 @@ class BaoGame(BoxLayout):
         for stone in self.engine.stones:
             target_pit = self.engine.pits[self.engine.targets[stone.id%2 + 1]]
             target_pit.add(stone)
-            my_pos = self.pos_to_coords(stone.position, target_pit.kivy_obj)
-            sz = (target_pit.kivy_obj.width/3,  target_pit.kivy_obj.width/3)
-            stone.kivy_obj = Stone(size_hint=(None,None),size=sz, pos=my_pos)
-            stone.kivy_obj.color = get_color_from_hex(stone.color)
-            stone.kivy_obj.stone_obj = stone
-            target_pit.kivy_obj.contents.add_widget(stone.kivy_obj)
-
+        self.renderer.rebuild()
 
-    def link_pits(self):
+    def link_pits(self, bind=True):
         for c in self.board_overlay.children:
             if type(c) is GridLayout:
                 for c2 in c.children:
@@ -72,26 +99,62 @@ class BaoGame(BoxLayout):
                         c2.board = self
                         c2.pit_obj = self.engine.pits[c2.pit_id]
                         self.engine.pits[c2.pit_id].kivy_obj = c2
-                        c2.bind(pos=self.move_stones, size=self.move_stones)
+                        if bind:
+                            c2.bind(pos=self.move_stones, size=self.move_stones)
                         Logger.debug('Link Pits: linked pit {} to {}'.format(c2.pit_id, c2.pit_obj))
 
     def animate_stones(self, stone_list):
-        for stone in stone_list:
-            my_pit = self.engine.pits[stone.pit].kivy_obj
-            my_pos = self.pos_to_coords(stone.position, my_pit)
-            anim = Animation(x=my_pos[0], y=my_pos[1],d=0.5)
-            anim.start(stone.kivy_obj)
+        self.renderer.animate([stone.id for stone in stone_list], duration=0.5)
 
     def on_stone_locations(self, inst, value):
         '''Update the stones by animating them to their final location'''
         self.animate_stones(value)
 
 
+    def play_move(self, pit_id):
+        '''play a move for the current player, animate it, and let the computer reply if it is its turn'''
+        result = self.engine.play_round(pit_id, events=True)
+        if result is None:
+            return
+        (game_over, player, events) = result
+        # only animate the stones that moved
+        moved = set(stone_id for (kind, stone_id, from_pit, from_pos, to_pit, to_pos) in events)
+        self.animate_stones([self.engine.stones[i] for i in moved])
+        self.turn_no += 1
+        self.scores = self.engine.score
+        self.curr_player = self.engine.current_player
+        if self.computer_to_move():
+            self.opponent.think(self.engine, self.play_move)
+
+    def computer_to_move(self):
+        return (self.vs_computer and self.started and not self.engine.game_over
+                and self.engine.current_player == self.computer_player)
+
+    def on_vs_computer(self, inst, value):
+        if self.computer_to_move():
+            self.opponent.think(self.engine, self.play_move)
+        elif not value:
+            self.opponent.cancel()
+
+    def on_computer_time(self, inst, value):
+        self.opponent.player.time_limit = value
+
     def start_game(self):
-        '''Do the initial sow (place) to start a game'''
+        '''Do the initial sow (place) to start a game, abandoning any game in progress'''
+        self.opponent.cancel()
+        if self.started:
+            self.engine = self.renderer.engine = Bao.Game()
+            self.link_pits(bind=False)
+            self.init_stones()
         self.engine.initial_place()
-        self.toolbar.start_button.disabled = True
+        self.started = True
+        self.toolbar.start_button.text = 'Restart'
+        self.turn_no = 1
+        self.scores = self.engine.score
+        self.curr_player = self.engine.current_player
         self.stone_locations = self.engine.stones[:]
+        if self.computer_to_move():
+            self.opponent.think(self.engine, self.play_move)
 
 class BaoApp(App):
     def build(self):